@@ -0,0 +1,318 @@
+"""
+Hourly analytics rollups over messages and feedback.
+
+refresh_rollups() recomputes the analytics_hourly buckets (by created_at hour)
+of every row inserted or changed since the previous refresh, minus
+ANALYTICS_LOOKBACK_HOURS for late commits. Both tables keep an updated_at that
+their upserts set, so a thumbs change on old feedback reaches its hour too.
+Deletes (a deleted chat cascades to its messages) leave a tombstone hour in
+analytics_deleted_hours through a trigger, so those hours are recomputed as well.
+Each run reads the touched hours through the created_at indexes. Latency is kept as a
+fixed-bucket histogram, which sums across hours, so daily figures and
+percentiles come from the hourly rows without touching the raw tables.
+
+Run it with `python -m agent.analytics` (--rebuild recomputes everything) or
+from the API's background task.
+"""
+import os
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from .db import get_pool, get_async_pool
+
+# Seconds between refreshes in the API process; 0 disables the background job
+ANALYTICS_REFRESH_INTERVAL_S = float(os.getenv("ANALYTICS_REFRESH_INTERVAL_S", "300"))
+# Changes this long before the last refresh are picked up again, for rows committed late
+ANALYTICS_LOOKBACK_HOURS = int(os.getenv("ANALYTICS_LOOKBACK_HOURS", "2"))
+
+# Upper bounds (ms) of the latency histogram; the last bucket is open-ended
+LATENCY_BOUNDS_MS = (250, 500, 1000, 2000, 3000, 5000, 8000, 13000, 20000, 30000, 60000)
+
+# Longest range one /analytics request may cover, which bounds the rows it reads
+MAX_RANGE = {"hour": timedelta(days=31), "day": timedelta(days=366)}
+
+# Another worker refreshing at the same time skips its run
+_LOCK_KEY = 727_002
+
+_BOUNDS_SQL = "'{" + ",".join(str(b) for b in LATENCY_BOUNDS_MS) + "}'::int[]"
+_HISTOGRAM_SQL = "ARRAY[" + ", ".join(
+    f"count(*) FILTER (WHERE width_bucket(response_time_ms, {_BOUNDS_SQL}) = {i})"
+    for i in range(len(LATENCY_BOUNDS_MS) + 1)
+) + "]"
+
+# Every bucket is recomputed from all of its rows, found by a range scan per touched hour
+_ROLLUP_SQL = """
+    WITH touched AS (SELECT unnest(%(buckets)s::timestamp[]) AS bucket),
+    hits AS (
+        SELECT touched.bucket, r.response_time_ms, r.context_used, r.error_occurred, r.error_type,
+               r.tool_names{columns}
+        FROM touched
+        JOIN {table} r ON r.created_at >= touched.bucket AND r.created_at < touched.bucket + interval '1 hour'
+        WHERE {rows}
+    )
+    INSERT INTO analytics_hourly (
+        source, bucket, row_count, latency_count, latency_sum, latency_max, latency_hist,
+        context_used, context_known, thumbs_up, thumbs_down, errors, error_types, tool_counts
+    )
+    SELECT '{table}', s.bucket, s.row_count, s.latency_count, s.latency_sum, s.latency_max, s.latency_hist,
+           s.context_used, s.context_known, s.thumbs_up, s.thumbs_down, s.errors,
+           COALESCE(e.error_types, '{{}}'::jsonb), COALESCE(t.tool_counts, '{{}}'::jsonb)
+    FROM (
+        SELECT bucket,
+               count(*) AS row_count,
+               count(response_time_ms) AS latency_count,
+               COALESCE(sum(response_time_ms), 0) AS latency_sum,
+               max(response_time_ms) AS latency_max,
+               {histogram} AS latency_hist,
+               count(*) FILTER (WHERE context_used) AS context_used,
+               count(context_used) AS context_known,
+               {thumbs},
+               count(*) FILTER (WHERE error_occurred) AS errors
+        FROM hits
+        GROUP BY 1
+    ) s
+    LEFT JOIN (
+        SELECT bucket, jsonb_object_agg(error_type, n) AS error_types
+        FROM (
+            SELECT bucket, error_type, count(*) AS n
+            FROM hits
+            WHERE error_type IS NOT NULL
+            GROUP BY 1, 2
+        ) x
+        GROUP BY bucket
+    ) e USING (bucket)
+    LEFT JOIN (
+        SELECT bucket, jsonb_object_agg(tool, n) AS tool_counts
+        FROM (
+            SELECT bucket, tool, count(*) AS n
+            FROM hits, unnest(tool_names) AS tool
+            GROUP BY 1, 2
+        ) x
+        GROUP BY bucket
+    ) t USING (bucket)
+"""
+
+_ROLLUPS = [
+    # Latency, context and tool figures live on the assistant's messages
+    _ROLLUP_SQL.format(table="messages", rows="r.role = 'assistant'", columns="", histogram=_HISTOGRAM_SQL,
+                       thumbs="0 AS thumbs_up, 0 AS thumbs_down"),
+    _ROLLUP_SQL.format(table="feedback", rows="TRUE", columns=", r.feedback", histogram=_HISTOGRAM_SQL,
+                       thumbs="count(*) FILTER (WHERE feedback = 'up') AS thumbs_up, "
+                              "count(*) FILTER (WHERE feedback = 'down') AS thumbs_down"),
+]
+
+_SINCE_SQL = """
+    SELECT refreshed_through - make_interval(hours => %s)
+    FROM analytics_state WHERE name = 'hourly'
+"""
+
+# Hours holding a row inserted, changed or deleted since `since`; every hour when
+# since is NULL. Rows from before migration 6 have no updated_at until they are next written.
+_TOUCHED_SQL = """
+    SELECT COALESCE(array_agg(bucket ORDER BY bucket), '{}') FROM (
+        SELECT date_trunc('hour', created_at) AS bucket FROM messages
+        WHERE role = 'assistant' AND (%(since)s::timestamp IS NULL OR updated_at >= %(since)s)
+        UNION
+        SELECT date_trunc('hour', created_at) FROM feedback
+        WHERE %(since)s::timestamp IS NULL OR updated_at >= %(since)s
+        UNION
+        SELECT bucket FROM analytics_deleted_hours
+        WHERE %(since)s::timestamp IS NOT NULL AND deleted_at >= %(since)s
+    ) hours
+"""
+
+# Tombstones older than the lookback were covered by an earlier refresh; a
+# rebuild leaves them to the next incremental run
+_PRUNE_TOMBSTONES_SQL = "DELETE FROM analytics_deleted_hours WHERE deleted_at < %(since)s"
+
+_DELETE_SQL = "DELETE FROM analytics_hourly WHERE %(since)s::timestamp IS NULL OR bucket = ANY(%(buckets)s)"
+
+_MARK_SQL = """
+    INSERT INTO analytics_state (name, refreshed_through) VALUES ('hourly', %(now)s)
+    ON CONFLICT (name) DO UPDATE SET refreshed_through = EXCLUDED.refreshed_through
+"""
+
+_SELECT_SQL = """
+    SELECT source, bucket, row_count, latency_count, latency_sum, latency_max, latency_hist,
+           context_used, context_known, thumbs_up, thumbs_down, errors, error_types, tool_counts
+    FROM analytics_hourly
+    WHERE bucket >= %s AND bucket < %s
+    ORDER BY bucket, source
+"""
+
+_REFRESHED_SQL = "SELECT refreshed_through FROM analytics_state WHERE name = 'hourly'"
+
+
+def refresh_rollups(rebuild: bool = False) -> int | None:
+    """Recompute the hours touched since the last refresh. Returns rows written, None if another run holds the lock."""
+    with get_pool().connection() as conn, conn.transaction():
+        if not conn.execute("SELECT pg_try_advisory_xact_lock(%s)", (_LOCK_KEY,)).fetchone()[0]:
+            return None
+        now = conn.execute("SELECT LOCALTIMESTAMP").fetchone()[0]
+        row = None if rebuild else conn.execute(_SINCE_SQL, (ANALYTICS_LOOKBACK_HOURS,)).fetchone()
+        params = {"since": row[0] if row else None, "now": now}
+        params["buckets"] = conn.execute(_TOUCHED_SQL, params).fetchone()[0]
+        conn.execute(_DELETE_SQL, params)
+        written = sum(conn.execute(sql, params).rowcount for sql in _ROLLUPS)
+        conn.execute(_PRUNE_TOMBSTONES_SQL, params)
+        conn.execute(_MARK_SQL, params)
+    return written
+
+
+async def arefresh_rollups(rebuild: bool = False) -> int | None:
+    async with get_async_pool().connection() as conn, conn.transaction():
+        cur = await conn.execute("SELECT pg_try_advisory_xact_lock(%s)", (_LOCK_KEY,))
+        if not (await cur.fetchone())[0]:
+            return None
+        now = (await (await conn.execute("SELECT LOCALTIMESTAMP")).fetchone())[0]
+        row = None if rebuild else await (await conn.execute(_SINCE_SQL, (ANALYTICS_LOOKBACK_HOURS,))).fetchone()
+        params = {"since": row[0] if row else None, "now": now}
+        params["buckets"] = (await (await conn.execute(_TOUCHED_SQL, params)).fetchone())[0]
+        await conn.execute(_DELETE_SQL, params)
+        written = 0
+        for sql in _ROLLUPS:
+            cur = await conn.execute(sql, params)
+            written += cur.rowcount
+        await conn.execute(_PRUNE_TOMBSTONES_SQL, params)
+        await conn.execute(_MARK_SQL, params)
+    return written
+
+
+async def refresh_forever(interval_s: float = ANALYTICS_REFRESH_INTERVAL_S) -> None:
+    """Background task for the API lifespan."""
+    while True:
+        try:
+            await arefresh_rollups()
+        except Exception as e:
+            print(f"Error refreshing analytics rollups: {e}")
+        await asyncio.sleep(interval_s)
+
+
+def _percentile(hist: list[int], total: int, q: float, latency_max: int | None) -> float | None:
+    """Estimate from bucket counts, interpolating linearly within the bucket."""
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(hist):
+        if count and seen + count >= rank:
+            lower = LATENCY_BOUNDS_MS[i - 1] if i > 0 else 0
+            upper = LATENCY_BOUNDS_MS[i] if i < len(LATENCY_BOUNDS_MS) else max(latency_max or lower, lower)
+            estimate = lower + (upper - lower) * (rank - seen) / count
+            return round(min(estimate, latency_max) if latency_max is not None else estimate, 1)
+        seen += count
+    return float(latency_max) if latency_max is not None else None
+
+
+def _empty() -> dict:
+    return {
+        "row_count": 0, "latency_count": 0, "latency_sum": 0, "latency_max": None,
+        "latency_hist": [0] * (len(LATENCY_BOUNDS_MS) + 1), "context_used": 0, "context_known": 0,
+        "thumbs_up": 0, "thumbs_down": 0, "errors": 0, "error_types": {}, "tool_counts": {},
+    }
+
+
+def _add(total: dict, row) -> None:
+    (_, _, row_count, latency_count, latency_sum, latency_max, latency_hist,
+     context_used, context_known, thumbs_up, thumbs_down, errors, error_types, tool_counts) = row
+    total["row_count"] += row_count
+    total["latency_count"] += latency_count
+    total["latency_sum"] += latency_sum
+    if latency_max is not None:
+        total["latency_max"] = max(total["latency_max"] or 0, latency_max)
+    total["latency_hist"] = [a + b for a, b in zip(total["latency_hist"], latency_hist)]
+    total["context_used"] += context_used
+    total["context_known"] += context_known
+    total["thumbs_up"] += thumbs_up
+    total["thumbs_down"] += thumbs_down
+    total["errors"] += errors
+    for counts, key in ((error_types, "error_types"), (tool_counts, "tool_counts")):
+        for name, n in counts.items():
+            total[key][name] = total[key].get(name, 0) + n
+
+
+def _summary(total: dict) -> dict:
+    n, hist, latency_max = total["latency_count"], total["latency_hist"], total["latency_max"]
+    votes = total["thumbs_up"] + total["thumbs_down"]
+    return {
+        "count": total["row_count"],
+        "latency_ms": {
+            "avg": round(total["latency_sum"] / n, 1) if n else None,
+            "p50": _percentile(hist, n, 0.50, latency_max),
+            "p95": _percentile(hist, n, 0.95, latency_max),
+            "p99": _percentile(hist, n, 0.99, latency_max),
+            "max": latency_max,
+        },
+        "thumbs_up": total["thumbs_up"],
+        "thumbs_down": total["thumbs_down"],
+        "thumbs_up_rate": round(total["thumbs_up"] / votes, 4) if votes else None,
+        "context_hit_rate": round(total["context_used"] / total["context_known"], 4) if total["context_known"] else None,
+        "errors": total["errors"],
+        "error_types": total["error_types"],
+        "tool_usage": total["tool_counts"],
+    }
+
+
+def _truncate(ts: datetime, granularity: str) -> datetime:
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if granularity == "day" else ts
+
+
+def summarize(rows, granularity: str) -> list[dict]:
+    """Merge hourly rows into hour or day buckets, one summary per source."""
+    buckets: dict[datetime, dict[str, dict]] = {}
+    for row in rows:
+        source, bucket = row[0], _truncate(row[1], granularity)
+        totals = buckets.setdefault(bucket, {})
+        _add(totals.setdefault(source, _empty()), row)
+    return [
+        {"bucket": bucket.isoformat(), **{source: _summary(total) for source, total in sorted(totals.items())}}
+        for bucket, totals in sorted(buckets.items())
+    ]
+
+
+async def aget_rollups(since: datetime, until: datetime, granularity: str = "day") -> dict:
+    """Summaries for [since, until) from analytics_hourly; cost depends on the range, not the history."""
+    async with get_async_pool().connection() as conn:
+        cur = await conn.execute(_SELECT_SQL, (since, until))
+        rows = await cur.fetchall()
+        cur = await conn.execute(_REFRESHED_SQL)
+        refreshed = await cur.fetchone()
+    return {
+        "granularity": granularity,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "refreshed_through": refreshed[0].isoformat() if refreshed else None,
+        "buckets": summarize(rows, granularity),
+    }
+
+
+def naive_utc(ts: datetime) -> datetime:
+    # created_at columns are naive timestamps in the database time zone (UTC on Supabase)
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def resolve_range(granularity: str, since: datetime | None, until: datetime | None) -> tuple[datetime, datetime]:
+    """Defaults to the last 24 hours or 7 days; raises ValueError for ranges over MAX_RANGE."""
+    if until is None:
+        now = naive_utc(datetime.now(timezone.utc))
+        until = _truncate(now, granularity) + (timedelta(days=1) if granularity == "day" else timedelta(hours=1))
+    until = naive_utc(until)
+    since = naive_utc(since) if since else until - (timedelta(days=7) if granularity == "day" else timedelta(hours=24))
+    if since >= until:
+        raise ValueError("since must be before until")
+    if until - since > MAX_RANGE[granularity]:
+        raise ValueError(f"Range too long for granularity={granularity} (max {MAX_RANGE[granularity].days} days)")
+    return since, until
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the hourly analytics rollups")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every hour from the raw tables")
+    args = parser.parse_args()
+    written = refresh_rollups(rebuild=args.rebuild)
+    if written is None:
+        print("Another refresh is running")
+    else:
+        print(f"Wrote {written} hourly rollup rows")
@@ -0,0 +1,76 @@
+"""
+Micro-batching of concurrent vector queries.
+
+Retrieval runs on worker threads (asyncio.to_thread, LangGraph's tool
+executor), so the batcher is thread-based. The first caller to arrive for a
+given (n_results, where) opens a batch. It waits up to the window, or until
+the batch holds max_batch query texts, and then runs one query for everything
+collected. Each caller gets back the rows for its own texts. Duplicate texts
+are sent once.
+"""
+import json
+import time
+import threading
+from typing import Callable
+
+from .metrics import observe, observe_size
+
+
+class _Batch:
+    def __init__(self):
+        self.queries: list[str] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.started_at = 0.0
+        self.results: list[dict] | None = None
+        self.error: Exception | None = None
+
+
+class QueryBatcher:
+    def __init__(self, run: Callable[[list[str], int, dict | None], list[dict]], window_s: float, max_batch: int):
+        self._run = run
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._open: dict[tuple, _Batch] = {}
+        self._lock = threading.Lock()
+
+    def query(self, queries: list[str], n_results: int, where: dict | None = None) -> list[dict]:
+        key = (n_results, json.dumps(where, sort_keys=True) if where else None)
+        enqueued_at = time.monotonic()
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            offset = len(batch.queries)
+            batch.queries.extend(queries)
+            if len(batch.queries) >= self.max_batch:
+                # Closed to newcomers; the leader stops waiting
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window_s)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            self._execute(batch, n_results, where)
+        else:
+            batch.done.wait()
+
+        observe("retrieval.batch_wait", max(batch.started_at - enqueued_at, 0.0))
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[offset:offset + len(queries)]
+
+    def _execute(self, batch: _Batch, n_results: int, where: dict | None) -> None:
+        batch.started_at = time.monotonic()
+        unique = list(dict.fromkeys(batch.queries))
+        observe_size("retrieval_batch_size", len(unique))
+        try:
+            rows = dict(zip(unique, self._run(unique, n_results, where)))
+            batch.results = [rows[query] for query in batch.queries]
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
@@ -0,0 +1,215 @@
+"""
+Okapi BM25 inverted index over the policy chunks, built by ingest_policies.
+
+Catches exact terms that embeddings blur: form numbers, course codes and
+acronyms like FERPA. Tokens keep hyphenated/slashed codes whole ("acct-201")
+and also index their parts ("acct", "201"). The index is one SQLite file of
+documents and postings, written as ingestion streams the chunks and reopened
+when ingestion replaces it.
+"""
+import os
+import re
+import json
+import math
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from .local_index import _matches
+
+BM25_INDEX_PATH = Path(os.getenv("BM25_INDEX_PATH", str(Path(__file__).parent / "bm25_index.sqlite")))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it my of on or "
+    "the this to what when where which who will with".split()
+)
+# Values per IN (...) query; SQLite builds before 3.32 allow 999 variables
+_IN_CHUNK = 500
+# Rows per read of iter_metadata, each taken under the connection lock
+_ITER_BATCH = 1000
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        parts = re.split(r"[-/.]", token)
+        if len(parts) > 1:
+            tokens.append(token)
+        tokens.extend(p for p in parts if p and p not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Reader over the SQLite file. Only the document lengths are held in memory;
+    postings are read per query term and documents per result row.
+    """
+
+    def __init__(self, path: Path = BM25_INDEX_PATH):
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        lengths = [length for (length,) in self._db.execute("SELECT length FROM docs ORDER BY row")]
+        self.doc_lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_length = float(self.doc_lengths.mean()) if lengths else 0.0
+        # Users of the shared index, and whether a newer file has replaced it;
+        # both guarded by the module lock
+        self._refs = 0
+        self._retired = False
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _select(self, sql: str, values: list) -> list[tuple]:
+        """Run sql with an IN (...) list, a chunk at a time to stay under SQLite's variable limit."""
+        found = []
+        with self._lock:
+            for i in range(0, len(values), _IN_CHUNK):
+                chunk = values[i:i + _IN_CHUNK]
+                found.extend(self._db.execute(sql.format(",".join("?" * len(chunk))), chunk))
+        return found
+
+    def search(self, query: str, n_results: int, where: dict | None = None) -> tuple[list[int], list[float]]:
+        """Row numbers and BM25 scores of the best n_results documents, best first."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_length, 1e-9))
+        for term in set(tokenize(query)):
+            with self._lock:
+                posting = self._db.execute("SELECT row, tf FROM postings WHERE term = ?", (term,)).fetchall()
+            if not posting:
+                continue
+            rows, tfs = np.asarray(posting, dtype=np.int64).T
+            idf = math.log(1 + (len(self) - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[rows])
+        matched = np.flatnonzero(scores)
+        if where and len(matched):
+            metadatas = self._select("SELECT row, metadata FROM docs WHERE row IN ({})", matched.tolist())
+            allowed = [row for row, metadata in metadatas if _matches(json.loads(metadata), where)]
+            matched = np.asarray(sorted(allowed), dtype=np.int64)
+        if len(matched) == 0:
+            return [], []
+        k = min(n_results, len(matched))
+        best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+        return best.tolist(), scores[best].tolist()
+
+    def rows(self, rows: list[int]) -> dict:
+        """ids, documents and metadatas of the given rows, in that order."""
+        found = {row: (doc_id, document, json.loads(metadata)) for row, doc_id, document, metadata
+                 in self._select("SELECT row, id, document, metadata FROM docs WHERE row IN ({})", rows)}
+        return {
+            "ids": [found[row][0] for row in rows],
+            "documents": [found[row][1] for row in rows],
+            "metadatas": [found[row][2] for row in rows],
+        }
+
+    def get(self, ids: list[str]) -> dict[str, tuple[str, dict]]:
+        """id -> (document, metadata) for the ids present in the index."""
+        return {doc_id: (document, json.loads(metadata)) for doc_id, document, metadata
+                in self._select("SELECT id, document, metadata FROM docs WHERE id IN ({})", ids)}
+
+    def iter_metadata(self) -> Iterator[tuple[str, dict]]:
+        """(id, metadata) for every document, read in batches by row number."""
+        last = -1
+        while True:
+            with self._lock:
+                batch = self._db.execute(
+                    "SELECT row, id, metadata FROM docs WHERE row > ? ORDER BY row LIMIT ?", (last, _ITER_BATCH)
+                ).fetchall()
+            if not batch:
+                return
+            for _, doc_id, metadata in batch:
+                yield doc_id, json.loads(metadata)
+            last = batch[-1][0]
+
+
+class BM25Builder:
+    """
+    Writes documents and postings to a temporary SQLite file as ingestion
+    streams them, so memory stays flat; finish() indexes it and swaps it in.
+    """
+
+    def __init__(self, path: Path = BM25_INDEX_PATH):
+        self.path = path
+        self._tmp = path.with_suffix(".tmp")
+        self._tmp.unlink(missing_ok=True)
+        self._db = sqlite3.connect(self._tmp)
+        self._db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE docs (row INTEGER PRIMARY KEY, id TEXT NOT NULL, document TEXT NOT NULL,
+                               metadata TEXT NOT NULL, length INTEGER NOT NULL);
+            CREATE TABLE postings (term TEXT NOT NULL, row INTEGER NOT NULL, tf INTEGER NOT NULL);
+        """)
+        self._rows = 0
+
+    def add(self, doc_id: str, document: str, metadata: dict) -> None:
+        row = self._rows
+        # Policy titles are short and precise; index them with the body
+        tokens = tokenize(f"{metadata.get('policy_name', '')} {document}")
+        self._db.execute("INSERT INTO docs VALUES (?, ?, ?, ?, ?)",
+                         (row, doc_id, document, json.dumps(metadata), len(tokens)))
+        self._db.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                             [(term, row, tf) for term, tf in Counter(tokens).items()])
+        self._rows += 1
+
+    def finish(self) -> None:
+        # Indexes are built once at the end; cheaper than maintaining them per insert
+        self._db.executescript("""
+            CREATE INDEX idx_postings_term ON postings(term, row, tf);
+            CREATE UNIQUE INDEX idx_docs_id ON docs(id);
+        """)
+        self._db.commit()
+        self._db.close()
+        os.replace(self._tmp, self.path)
+
+
+_index: BM25Index | None = None
+_loaded_mtime = None
+_lock = threading.Lock()
+
+
+def _release(index: BM25Index) -> None:
+    with _lock:
+        index._refs -= 1
+        if index._retired and index._refs == 0:
+            index.close()
+
+
+@contextmanager
+def bm25_index() -> Iterator[BM25Index | None]:
+    """
+    The on-disk index, None if never built. Reopened after ingestion rewrites
+    the file; the replaced one is closed once the last search using it exits.
+    """
+    global _index, _loaded_mtime
+    try:
+        mtime = BM25_INDEX_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _lock:
+        if mtime is not None and mtime != _loaded_mtime:
+            if _index is not None:
+                _index._retired = True
+                if _index._refs == 0:
+                    _index.close()
+            _index = BM25Index()
+            _loaded_mtime = mtime
+        index = _index if mtime is not None else None
+        if index is not None:
+            index._refs += 1
+    try:
+        yield index
+    finally:
+        if index is not None:
+            _release(index)
@@ -1,5 +1,8 @@
 import os
+import time
+import asyncio
 from pathlib import Path
+from typing import AsyncIterator
 from dotenv import load_dotenv
 
 load_dotenv(Path(__file__).parent / ".env")
@@ -9,71 +12,42 @@ os.environ["LANGSMITH_API_KEY"] = os.getenv("LANGSMITH_API_KEY")
 os.environ["LANGSMITH_PROJECT"] = os.getenv("LANGSMITH_PROJECT", "chatgpt-clone")
 os.environ["LANGSMITH_TRACING"] = os.getenv("LANGSMITH_TRACING", "false")
 
-SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
-
-from .chroma_setup import collection
-from .tools import search_policies
+from .db import open_async_pool, close_async_pool, get_async_pool
+from .retrieval import RetrievalTurn, retrieve
+from .response_cache import response_cache, RESPONSE_CACHE_ENABLED
+from .tools import search_policies, search_within_policy, read_adjacent_chunks
+from .history import make_pre_model_hook, stores_context
+from .metrics import begin_turn, span, timed, llm_span_handler
+from .routing import choose_route, route_stats, turn_tokens
 
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import (
+    SystemMessage,
+    AIMessage,
+    AIMessageChunk,
+    HumanMessage,
+    ToolMessage,
+    message_chunk_to_message,
+)
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.postgres import PostgresSaver
-from psycopg_pool import ConnectionPool
-import psycopg
-
-with psycopg.connect(SUPABASE_DB_URL, autocommit=True) as setup_conn:
-    PostgresSaver(setup_conn).setup()
-    setup_conn.execute("""
-        CREATE TABLE IF NOT EXISTS feedback (
-            id SERIAL PRIMARY KEY,
-            message_id TEXT NOT NULL UNIQUE,
-            thread_id TEXT,
-            feedback TEXT,
-            message_content TEXT,
-            created_at TIMESTAMP DEFAULT NOW()
-        )
-    """)
-    setup_conn.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            id TEXT PRIMARY KEY,
-            title TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW(),
-            updated_at TIMESTAMP DEFAULT NOW()
-        )
-    """)
-    setup_conn.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id TEXT PRIMARY KEY,
-            chat_id TEXT NOT NULL,
-            role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
-            content TEXT NOT NULL,
-            response_time_ms INTEGER,
-            context_used BOOLEAN,
-            tool_calls TEXT,
-            error_occurred BOOLEAN DEFAULT FALSE,
-            error_type TEXT,
-            created_at TIMESTAMP DEFAULT NOW(),
-            CONSTRAINT fk_chat FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
-        )
-    """)
-    setup_conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id)")
-    setup_conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)")
-    setup_conn.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS session_id TEXT")
-    setup_conn.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS response_time_ms INTEGER")
-    setup_conn.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS context_used BOOLEAN")
-    setup_conn.execute("ALTER TABLE feedback DROP COLUMN IF EXISTS tool_calls")
-    setup_conn.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS tool_calls TEXT")
-    setup_conn.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS error_occurred BOOLEAN DEFAULT FALSE")
-    setup_conn.execute("ALTER TABLE feedback ADD COLUMN IF NOT EXISTS error_type TEXT")
-    setup_conn.execute("""
-        DO $$ BEGIN
-            ALTER TABLE feedback ADD CONSTRAINT feedback_message_id_key UNIQUE (message_id);
-        EXCEPTION WHEN duplicate_table THEN NULL;
-        END $$;
-    """)
-
-pool = ConnectionPool(conninfo=SUPABASE_DB_URL, max_size=5)
-checkpointer = PostgresSaver(pool)
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+class _TimedAsyncPostgresSaver(AsyncPostgresSaver):
+    async def aget_tuple(self, config):
+        with span("checkpoint.read"):
+            return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with span("checkpoint.write"):
+            return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with span("checkpoint.write"):
+            return await super().aput_writes(config, writes, task_id, task_path)
+
+
+# The schema is managed by `python -m agent.migrations`; nothing here touches
+# the database until the first request.
 
 llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
@@ -84,87 +58,425 @@ If the context is insufficient or missing, say so and suggest what additional in
 Keep answers concise, professional, and focused on the user's question about university policies.
 Remember previous messages in our conversation and refer back to them when relevant."""
 
-agent = create_react_agent(
-    model=llm,
-    tools=[search_policies],
-    checkpointer=checkpointer,
-    prompt=SystemMessage(content=SYSTEM_PROMPT),
-)
+# Injects this turn's retrieved context and trims/summarizes earlier turns; the
+# model is looked up per call so a replacement assigned to `llm` is used
+pre_model_hook = make_pre_model_hook(lambda: llm)
+
+TOOLS = [search_policies, search_within_policy, read_adjacent_chunks]
+
+
+def _build_agent(checkpointer):
+    # version="v2" dispatches each tool call of a model turn as its own task,
+    # so parallel tool calls run concurrently instead of one after another
+    return create_react_agent(
+        model=llm.bind_tools(TOOLS, parallel_tool_calls=True),
+        tools=TOOLS,
+        checkpointer=checkpointer,
+        prompt=SystemMessage(content=SYSTEM_PROMPT),
+        pre_model_hook=pre_model_hook,
+        version="v2",
+    )
+
+
+# AsyncPostgresSaver on the shared AsyncConnectionPool. The pool has
+# to be opened inside the running event loop, so it is created by
+# open_async_resources() (called from the API lifespan) rather than at import time.
+async_agent = None
+
+
+async def open_async_resources() -> None:
+    global async_agent
+    if async_agent is not None:
+        return
+    async_agent = _build_agent(_TimedAsyncPostgresSaver(await open_async_pool()))
+
+
+async def close_async_resources() -> None:
+    global async_agent
+    await close_async_pool()
+    async_agent = None
+
+
+def _require_async_agent():
+    if async_agent is None:
+        raise RuntimeError("Async agent not initialised; call open_async_resources() first")
+    return async_agent
+
 
-def get_relevant_context(query: str) -> str:
+def get_relevant_context(query: str, turn: RetrievalTurn | None = None) -> str:
     """Retrieve top 3 relevant chunks from ChromaDB"""
     try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=3
-        )
-        if results and results["documents"]:
-            return "\n\n".join(results["documents"][0])
-        return ""
+        with span("retrieval.context"):
+            results = retrieve(query, n_results=3, caller="context", turn=turn)
+        if turn is not None:
+            turn.injected_ids.update(results["ids"])
+            turn.context = results
+        return "\n\n".join(results["documents"])
     except Exception as e:
         print(f"Error retrieving context: {e}")
         return ""
 
-def chat(user_input: str, thread_id: str = "default") -> dict:
-    import time
-    start_time = time.time()
-    
-    error_occurred = False
-    error_type = None
+def build_enriched_input(user_input: str, turn: RetrievalTurn | None = None) -> tuple[str, bool]:
+    """Prepend retrieved context to the user question. Returns (input, context_used)."""
+    context = get_relevant_context(user_input, turn)
+    if context:
+        return f"Context from knowledge base:\n{context}\n\nUser Question:\n{user_input}", True
+    return user_input, False
+
+
+def _turn_config(thread_id: str, turn: RetrievalTurn, enriched_input: str | None = None) -> dict:
+    return {
+        "configurable": {"thread_id": thread_id, "retrieval_turn": turn,
+                         # "__" keys are left out of checkpoint metadata, so the context is never stored
+                         "__enriched_input": enriched_input},
+        "callbacks": [llm_span_handler],
+    }
+
+
+def _turn_input(user_input: str, enriched_input: str) -> dict:
+    # The enriched input reaches the model through the pre_model_hook; the thread
+    # only keeps the question unless HISTORY_CONTEXT=stored
+    return {"messages": [("user", enriched_input if stores_context() else user_input)]}
+
+
+async def _afast_path_messages(history: list, user_input: str, enriched_input: str, config: dict) -> tuple[list, list]:
+    """
+    (model input, thread update) for a single-shot turn. The input goes through
+    the agent's own pre_model_hook, so history is trimmed the same way.
+    """
+    human = HumanMessage(content=enriched_input if stores_context() else user_input)
+    update = await pre_model_hook.ainvoke({"messages": [*history, human]}, config)
+    return [SystemMessage(content=SYSTEM_PROMPT), *update["llm_input_messages"]], update.get("messages", [human])
+
+
+def _current_turn(messages: list) -> list:
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i + 1:]
+    return messages
+
+
+def _route_fields(route: str, turn: RetrievalTurn, tokens: int | None, response_time_ms: int) -> dict:
+    return {
+        "route": route,
+        "route_distance": round(turn.route_distance, 4) if turn.route_distance is not None else None,
+        "tokens": tokens,
+        "tokens_saved": route_stats.record(route, response_time_ms, tokens),
+    }
+
+
+def _chat_result(result: dict, start_time: float, context_used: bool, turn: RetrievalTurn,
+                 stages: dict, route: str = "agent") -> dict:
     tool_calls = []
-    
+    for msg in result["messages"]:
+        if hasattr(msg, 'tool_calls') and msg.tool_calls:
+            tool_calls.extend([tc['name'] for tc in msg.tool_calls])
+
+    response_time_ms = int((time.monotonic() - start_time) * 1000)
+    tokens = turn_tokens(_current_turn(result["messages"]))
+    return {
+        "reply": result["messages"][-1].content,
+        "response_time_ms": response_time_ms,
+        # The blocking path delivers the whole reply at once
+        "time_to_first_token_ms": response_time_ms,
+        "context_used": context_used,
+        "tool_calls": tool_calls,
+        "retrievals": turn.records,
+        "stages": stages,
+        **_route_fields(route, turn, tokens, response_time_ms),
+        "cache_hit": False,
+        "error_occurred": False,
+        "error_type": None,
+    }
+
+
+async def _afast_path(agent, config: dict, user_input: str, enriched_input: str) -> dict:
+    """One direct LLM call over the pre-retrieved context; the turn is written to the thread."""
+    history = (await agent.aget_state(config)).values.get("messages", [])
+    llm_input, thread_update = await _afast_path_messages(history, user_input, enriched_input, config)
+    reply = await llm.ainvoke(llm_input, config={"callbacks": [llm_span_handler]})
+    await agent.aupdate_state(config, {"messages": [*thread_update, reply]}, as_node="agent")
+    return {"messages": [reply]}
+
+
+def _chat_error(e: Exception, start_time: float, stages: dict) -> dict:
+    return {
+        "reply": "",
+        "response_time_ms": int((time.monotonic() - start_time) * 1000),
+        "time_to_first_token_ms": None,
+        "context_used": False,
+        "tool_calls": [],
+        "retrievals": [],
+        "stages": stages,
+        "route": None,
+        "cache_hit": False,
+        "error_occurred": True,
+        "error_type": type(e).__name__,
+    }
+
+
+def _cache_hit_result(cached: dict, start_time: float, stages: dict) -> dict:
+    response_time_ms = int((time.monotonic() - start_time) * 1000)
+    response_cache.record_saved(cached["response_time_ms"] - response_time_ms)
+    return {
+        **cached,
+        "response_time_ms": response_time_ms,
+        "time_to_first_token_ms": response_time_ms,
+        "retrievals": [],
+        "stages": stages,
+        "route": "cache",
+        "tokens": 0,
+        "tokens_saved": None,
+        "cache_hit": True,
+    }
+
+
+def _cached_turn_update(user_input: str, reply: str) -> dict:
+    # Keep the thread history complete so follow-up questions still have it
+    return {"messages": [HumanMessage(content=user_input), AIMessage(content=reply)]}
+
+
+# Identical first-turn questions in flight at the same time share one agent run
+COALESCE_ENABLED = os.getenv("CHAT_COALESCE_ENABLED", "true").lower() == "true"
+_in_flight: dict[str, asyncio.Future] = {}
+coalesce_stats = {"leaders": 0, "followers": 0}
+
+
+def _coalesce_key(user_input: str) -> str:
+    return " ".join(user_input.lower().split()).rstrip("?!. ")
+
+
+async def _acoalesced(key: str, run) -> tuple[dict | None, bool]:
+    """Run `run()` once per key at a time. Returns (response, shared_from_leader)."""
+    leader = _in_flight.get(key)
+    if leader is not None:
+        coalesce_stats["followers"] += 1
+        return await asyncio.shield(leader), True
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    coalesce_stats["leaders"] += 1
     try:
-        context = get_relevant_context(user_input)
-        context_used = bool(context)
-        
-        if context:
-            enriched_input = f"Context from knowledge base:\n{context}\n\nUser Question:\n{user_input}"
-        else:
-            enriched_input = user_input
-            
-        config = {"configurable": {"thread_id": thread_id}}
-        result = agent.invoke(
-            {"messages": [("user", enriched_input)]},
-            config
+        response = await run()
+        future.set_result(response)
+        return response, False
+    finally:
+        _in_flight.pop(key, None)
+        if not future.done():
+            # Leader was cancelled; followers fall back to their own run
+            future.set_result(None)
+
+
+def _shared_result(shared: dict, start_time: float, stages: dict) -> dict:
+    response_time_ms = int((time.monotonic() - start_time) * 1000)
+    return {
+        **shared,
+        "response_time_ms": response_time_ms,
+        "time_to_first_token_ms": response_time_ms,
+        "retrievals": [],
+        "stages": stages,
+        "coalesced": True,
+    }
+
+
+async def achat(user_input: str, thread_id: str = "default") -> dict:
+    """Run one chat turn; requires open_async_resources() to have run."""
+    start_time = time.monotonic()
+    stages = begin_turn()
+    turn = RetrievalTurn()
+    try:
+        async_agent = _require_async_agent()
+        config = _turn_config(thread_id, turn)
+        shareable = False
+        if RESPONSE_CACHE_ENABLED or COALESCE_ENABLED:
+            # Only a thread's first turn is shared: however a later question is
+            # worded, it may lean on the history
+            shareable = not (await async_agent.aget_state(config)).values.get("messages")
+        embedding = None
+        if shareable and RESPONSE_CACHE_ENABLED:
+            embedding = await asyncio.to_thread(response_cache.embed, user_input)
+        if embedding is not None:
+            # lookup may poll Chroma for the collection version
+            cached = await asyncio.to_thread(response_cache.lookup, embedding)
+            # The answer is only stored if no ingestion has landed by the time it is ready
+            version = response_cache.version
+            if cached is not None:
+                await async_agent.aupdate_state(
+                    config, _cached_turn_update(user_input, cached["reply"]), as_node="agent"
+                )
+                return _cache_hit_result(cached, start_time, stages)
+
+        async def run() -> dict:
+            # Chroma's client is sync-only, keep it off the event loop
+            enriched_input, context_used = await asyncio.to_thread(build_enriched_input, user_input, turn)
+            config = _turn_config(thread_id, turn, enriched_input)
+            # May embed the top chunk locally when the vector search didn't return it
+            route = await asyncio.to_thread(choose_route, user_input, turn)
+            if route == "fast":
+                result = await _afast_path(async_agent, config, user_input, enriched_input)
+            else:
+                result = await async_agent.ainvoke(_turn_input(user_input, enriched_input), config)
+            response = _chat_result(result, start_time, context_used, turn, stages, route)
+            if embedding is not None:
+                response_cache.store(user_input, embedding, response, version)
+            return response
+
+        if not (shareable and COALESCE_ENABLED):
+            return await run()
+        response, shared = await _acoalesced(_coalesce_key(user_input), run)
+        if not shared:
+            return response
+        if response is None or response["error_occurred"]:
+            return await run()
+        await async_agent.aupdate_state(
+            config, _cached_turn_update(user_input, response["reply"]), as_node="agent"
         )
-        
-        for msg in result["messages"]:
-            if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                tool_calls.extend([tc['name'] for tc in msg.tool_calls])
-        
-        response_time_ms = int((time.time() - start_time) * 1000)
-        
-        return {
-            "reply": result["messages"][-1].content,
-            "response_time_ms": response_time_ms,
-            "context_used": context_used,
-            "tool_calls": tool_calls,
-            "error_occurred": False,
-            "error_type": None,
-        }
+        return _shared_result(response, start_time, stages)
     except Exception as e:
-        response_time_ms = int((time.time() - start_time) * 1000)
+        return _chat_error(e, start_time, stages)
+
+
+class _TurnStream:
+    """Translates LangGraph ("messages" | "updates") stream chunks into chat events."""
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.first_token_at = None
+        self.tool_calls = []
+        self.reply_parts = []
+        self.context_used = False
+        self.retrieval = RetrievalTurn()
+        self.stages = begin_turn()
+        self.route = "agent"
+        self.ai_messages = []
+
+    def token(self, msg: AIMessageChunk) -> list[dict]:
+        if not (isinstance(msg.content, str) and msg.content):
+            return []
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.reply_parts.append(msg.content)
+        return [{"type": "token", "content": msg.content}]
+
+    def feed(self, mode: str, chunk) -> list[dict]:
+        events = []
+        if mode == "messages":
+            msg, meta = chunk
+            if meta.get("langgraph_node") != "agent" or not isinstance(msg, AIMessageChunk):
+                return events
+            return self.token(msg)
+
+        for node, update in chunk.items():
+            for msg in (update or {}).get("messages", []):
+                if node == "agent" and isinstance(msg, AIMessage):
+                    self.ai_messages.append(msg)
+                if node == "agent" and getattr(msg, "tool_calls", None):
+                    # Text streamed before a tool call is not part of the final reply
+                    self.reply_parts = []
+                    for tc in msg.tool_calls:
+                        self.tool_calls.append(tc["name"])
+                        events.append({"type": "tool_start", "name": tc["name"], "id": tc["id"]})
+                elif node == "tools" and isinstance(msg, ToolMessage):
+                    events.append({"type": "tool_end", "name": msg.name, "id": msg.tool_call_id})
+        return events
+
+    def done(self, error: Exception | None = None) -> dict:
+        now = time.monotonic()
+        if self.first_token_at is not None:
+            ttft_ms = int((self.first_token_at - self.start_time) * 1000)
+        else:
+            ttft_ms = None if error else int((now - self.start_time) * 1000)
+        response_time_ms = int((now - self.start_time) * 1000)
+        if error is None:
+            route = _route_fields(self.route, self.retrieval, turn_tokens(self.ai_messages), response_time_ms)
+        else:
+            route = {"route": None}
         return {
-            "reply": "",
+            "type": "done",
+            "reply": "".join(self.reply_parts),
             "response_time_ms": response_time_ms,
-            "context_used": False,
-            "tool_calls": tool_calls,
-            "error_occurred": True,
-            "error_type": type(e).__name__,
+            "time_to_first_token_ms": ttft_ms,
+            "context_used": self.context_used,
+            "tool_calls": self.tool_calls,
+            "retrievals": self.retrieval.records,
+            "stages": self.stages,
+            **route,
+            "cache_hit": False,
+            "error_occurred": error is not None,
+            "error_type": type(error).__name__ if error else None,
         }
 
 
-def delete_thread(thread_id: str) -> None:
-    """Delete all checkpoints for a given thread_id from the database."""
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM checkpoints WHERE thread_id = %s", (thread_id,))
-            cur.execute("DELETE FROM checkpoint_writes WHERE thread_id = %s", (thread_id,))
-            cur.execute("DELETE FROM checkpoint_blobs WHERE thread_id = %s", (thread_id,))
-        conn.commit()
+async def astream_chat(user_input: str, thread_id: str = "default") -> AsyncIterator[dict]:
+    """
+    Stream a chat turn as events while the agent runs; requires
+    open_async_resources() to have run.
+
+    Yields dicts with a "type" key:
+      - "token": a piece of the assistant reply ({"content": ...})
+      - "tool_start": the agent requested a tool ({"name": ..., "id": ...})
+      - "tool_end": a tool finished ({"name": ..., "id": ...})
+      - "done": final metadata, same fields as achat() plus time_to_first_token_ms
+    """
+    turn = _TurnStream()
+    try:
+        enriched_input, turn.context_used = await asyncio.to_thread(
+            build_enriched_input, user_input, turn.retrieval
+        )
+        config = _turn_config(thread_id, turn.retrieval, enriched_input)
+        async_agent = _require_async_agent()
+        turn.route = await asyncio.to_thread(choose_route, user_input, turn.retrieval)
+        if turn.route == "fast":
+            history = (await async_agent.aget_state(config)).values.get("messages", [])
+            llm_input, thread_update = await _afast_path_messages(history, user_input, enriched_input, config)
+            reply = None
+            async for chunk in llm.astream(llm_input, config={"callbacks": [llm_span_handler]}):
+                for event in turn.token(chunk):
+                    yield event
+                reply = chunk if reply is None else reply + chunk
+            reply = message_chunk_to_message(reply)
+            turn.ai_messages.append(reply)
+            await async_agent.aupdate_state(config, {"messages": [*thread_update, reply]}, as_node="agent")
+        else:
+            async for mode, chunk in async_agent.astream(
+                _turn_input(user_input, enriched_input), config, stream_mode=["messages", "updates"],
+            ):
+                for event in turn.feed(mode, chunk):
+                    yield event
+        yield turn.done()
+    except Exception as e:
+        yield turn.done(e)
+
+
+_DELETE_THREAD_SQL = (
+    "DELETE FROM checkpoints WHERE thread_id = %s",
+    "DELETE FROM checkpoint_writes WHERE thread_id = %s",
+    "DELETE FROM checkpoint_blobs WHERE thread_id = %s",
+)
 
+_FEEDBACK_UPSERT_SQL = """
+    INSERT INTO feedback (
+        message_id, thread_id, feedback, message_content,
+        session_id, response_time_ms, context_used, tool_calls,
+        error_occurred, error_type
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (message_id) DO UPDATE SET
+        feedback = EXCLUDED.feedback,
+        thread_id = EXCLUDED.thread_id,
+        updated_at = NOW()
+"""
 
-def store_feedback(
+
+@timed("db.delete_thread")
+async def adelete_thread(thread_id: str) -> None:
+    async with get_async_pool().connection() as conn, conn.transaction():
+        async with conn.cursor() as cur:
+            for sql in _DELETE_THREAD_SQL:
+                await cur.execute(sql, (thread_id,))
+
+
+@timed("db.store_feedback")
+async def astore_feedback(
     message_id: str,
     thread_id: str | None,
     feedback: str | None,
@@ -176,39 +488,50 @@ def store_feedback(
     error_occurred: bool = False,
     error_type: str | None = None,
 ) -> None:
-    """Store user feedback with response metadata in Supabase."""
-    tool_calls_str = ",".join(tool_calls) if tool_calls else None
-    
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO feedback (
-                    message_id, thread_id, feedback, message_content,
-                    session_id, response_time_ms, context_used, tool_calls,
-                    error_occurred, error_type
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (message_id) DO UPDATE SET
-                    feedback = EXCLUDED.feedback,
-                    thread_id = EXCLUDED.thread_id
-            """, (
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_FEEDBACK_UPSERT_SQL, (
                 message_id, thread_id, feedback, message_content,
-                session_id, response_time_ms, context_used, tool_calls_str,
+                session_id, response_time_ms, context_used,
+                ",".join(tool_calls) if tool_calls else None,
                 error_occurred, error_type
             ))
-        conn.commit()
+        await conn.commit()
+
+
+@timed("db.store_feedback_many")
+async def astore_feedback_many(items: list[dict]) -> None:
+    """Upsert many feedback rows (FeedbackRequest fields) in one transaction."""
+    params = [
+        (
+            item["message_id"], item.get("thread_id"), item.get("feedback"), item["message_content"],
+            item.get("session_id"), item.get("response_time_ms"), item.get("context_used"),
+            ",".join(item["tool_calls"]) if item.get("tool_calls") else None,
+            item.get("error_occurred", False), item.get("error_type")
+        )
+        for item in items
+    ]
+    async with get_async_pool().connection() as conn, conn.transaction():
+        async with conn.cursor() as cur:
+            await cur.executemany(_FEEDBACK_UPSERT_SQL, params)
+
+async def _repl(thread_id: str = "session_1") -> None:
+    await open_async_resources()
+    try:
+        while True:
+            user_input = (await asyncio.to_thread(input, "You: ")).strip()
+            if user_input.lower() == "quit":
+                print("Goodbye!")
+                break
+            if not user_input:
+                continue
+
+            result = await achat(user_input, thread_id)
+            print(f"AI: {result['reply']}\n")
+    finally:
+        await close_async_resources()
+
 
 if __name__ == "__main__":
     print("ChatGPT Clone - Type 'quit' to exit\n")
-    thread_id = "session_1"
-    
-    while True:
-        user_input = input("You: ").strip()
-        if user_input.lower() == "quit":
-            print("Goodbye!")
-            break
-        if not user_input:
-            continue
-        
-        result = chat(user_input, thread_id)
-        print(f"AI: {result['reply']}\n")
+    asyncio.run(_repl())
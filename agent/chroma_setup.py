@@ -1,4 +1,7 @@
 import os
+import time
+import threading
+from pathlib import Path
 from dotenv import load_dotenv
 import traceback
 
@@ -8,38 +11,119 @@ CHROMA_API_KEY = os.getenv("CHROMA_API_KEY")
 CHROMA_TENANT = os.getenv("CHROMA_TENANT")
 CHROMA_DATABASE = os.getenv("CHROMA_DATABASE")
 
-if not all([CHROMA_API_KEY, CHROMA_TENANT, CHROMA_DATABASE]):
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2048"))
+# Optional on-disk tier that survives restarts, e.g. /tmp/chroma_query_cache.sqlite
+QUERY_CACHE_SQLITE_PATH = os.getenv("QUERY_CACHE_SQLITE_PATH")
+QUERY_CACHE_VERSION_CHECK_S = float(os.getenv("QUERY_CACHE_VERSION_CHECK_S", "60"))
+# Embed query text in-process (same MiniLM model as ingestion) instead of sending raw text
+CHROMA_LOCAL_EMBEDDINGS = os.getenv("CHROMA_LOCAL_EMBEDDINGS", "false").lower() == "true"
+
+# "chroma" (Chroma Cloud) or "local" (NumPy index built by ingest_policies)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", str(Path(__file__).parent / "local_index"))
+
+_client = None
+_collection = None
+_lock = threading.Lock()
+
+
+def _connect():
+    if RETRIEVAL_BACKEND == "local":
+        from .local_index import LocalCollection
+
+        return None, LocalCollection(LOCAL_INDEX_DIR)
+
     missing = [name for name, value in [
         ("CHROMA_API_KEY", CHROMA_API_KEY),
         ("CHROMA_TENANT", CHROMA_TENANT),
         ("CHROMA_DATABASE", CHROMA_DATABASE)
     ] if not value]
-    print(f"Error: Missing environment variables: {', '.join(missing)}")
-    exit(1)
+    if missing:
+        raise RuntimeError(f"Missing environment variables: {', '.join(missing)}")
 
-try:
     import chromadb
-    
+
     client = chromadb.CloudClient(
         tenant=CHROMA_TENANT,
         database=CHROMA_DATABASE,
         api_key=CHROMA_API_KEY,
     )
-    
     collection = client.get_or_create_collection(
         name="richmond_policies",
         metadata={"description": "Richmond University policies chunked documents"}
     )
-    
-except Exception as e:
-    print(f"Error during initialization: {e}")
-    print(f"Error type: {type(e).__name__}")
-    traceback.print_exc()
-    raise
+    return client, collection
+
+
+def get_collection():
+    """The (cached) policy collection, connecting on first use."""
+    global _client, _collection
+    with _lock:
+        if _collection is not None:
+            return _collection
+        try:
+            client, collection = _connect()
+            if QUERY_CACHE_ENABLED:
+                from .query_cache import CachedCollection
+                collection = CachedCollection(
+                    collection,
+                    version_fn=get_collection_version,
+                    max_entries=QUERY_CACHE_MAX_ENTRIES,
+                    sqlite_path=QUERY_CACHE_SQLITE_PATH,
+                    version_check_s=QUERY_CACHE_VERSION_CHECK_S,
+                    local_embeddings=CHROMA_LOCAL_EMBEDDINGS,
+                )
+        except Exception as e:
+            print(f"Error during initialization: {e}")
+            print(f"Error type: {type(e).__name__}")
+            traceback.print_exc()
+            raise
+        _client, _collection = client, collection
+        return _collection
+
+
+def use_collection(collection, client=None) -> None:
+    """Replace the collection (and client) returned from now on; for offline benchmarks."""
+    global _client, _collection
+    with _lock:
+        _client, _collection = client, collection
+
+
+def get_client():
+    """Chroma client, or None for the local backend."""
+    get_collection()
+    return _client
+
+
+def get_collection_version() -> str | None:
+    """Current content version of the collection, bumped by every ingestion run."""
+    collection = get_collection()
+    if _client is None:
+        # The local index re-reads its manifest on every access
+        return collection.metadata.get("version")
+    return (_client.get_collection(name=collection.name).metadata or {}).get("version")
+
+
+def bump_collection_version() -> str:
+    collection = get_collection()
+    version = str(time.time_ns())
+    metadata = dict(collection.metadata or {})
+    metadata["version"] = version
+    collection.modify(metadata=metadata)
+    return version
+
+
+def collection_stats() -> dict:
+    if _collection is None:
+        return {"enabled": QUERY_CACHE_ENABLED, "connected": False}
+    return _collection.stats() if hasattr(_collection, "stats") else {"enabled": False}
 
 if __name__ == "__main__":
+    collection = get_collection()
     print("ChromaDB client initialized successfully!")
+    print(f"Backend: {RETRIEVAL_BACKEND}")
     print(f"Tenant: {CHROMA_TENANT}")
     print(f"Database: {CHROMA_DATABASE}")
     print(f"Collection: {collection.name}")
-    print(f"Collection count: {collection.count()}")
\ No newline at end of file
+    print(f"Collection count: {collection.count()}")
@@ -0,0 +1,150 @@
+"""
+Postgres connection pools. The async pool, shared by the checkpointer,
+feedback writes and AsyncChatDBService, opens in the API lifespan (it must
+live in the running loop); the sync pool, used only by maintenance commands,
+opens on first use. Nothing connects at import time.
+
+Every pool comes from the same env-driven settings, so a deployment can size
+the total against Supabase's connection limit: roughly
+workers * ASYNC_POOL_MAX_SIZE, plus DB_POOL_MAX_SIZE per maintenance process.
+"""
+import os
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+
+load_dotenv(Path(__file__).parent / ".env")
+
+SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+ASYNC_POOL_MAX_SIZE = int(os.getenv("ASYNC_POOL_MAX_SIZE", "20"))
+# Idle connections above min_size are closed after this long
+DB_POOL_MAX_IDLE_S = float(os.getenv("DB_POOL_MAX_IDLE_S", "300"))
+# How long a request waits for a free connection before PoolTimeout
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "10"))
+# 0 disables. Applied per connection with SET; behind pgbouncer in transaction
+# mode set it on the database role instead.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# "none" never prepares statements, which pgbouncer in transaction mode
+# requires; a number prepares a query after that many executions.
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "none").lower()
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+_async_pool: AsyncConnectionPool | None = None
+
+
+def _connection_kwargs() -> dict:
+    # autocommit is what the LangGraph Postgres checkpointers expect
+    return {
+        "autocommit": True,
+        "prepare_threshold": None if DB_PREPARE_THRESHOLD == "none" else int(DB_PREPARE_THRESHOLD),
+    }
+
+
+def _configure(conn) -> None:
+    if DB_STATEMENT_TIMEOUT_MS:
+        conn.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+
+
+async def _aconfigure(conn) -> None:
+    if DB_STATEMENT_TIMEOUT_MS:
+        await conn.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+
+
+def _pool_kwargs(max_size: int) -> dict:
+    return {
+        "conninfo": SUPABASE_DB_URL,
+        "min_size": min(DB_POOL_MIN_SIZE, max_size),
+        "max_size": max_size,
+        "max_idle": DB_POOL_MAX_IDLE_S,
+        "timeout": DB_POOL_TIMEOUT_S,
+        "kwargs": _connection_kwargs(),
+        "open": False,
+    }
+
+
+def create_pool(max_size: int = DB_POOL_MAX_SIZE) -> ConnectionPool:
+    """A configured, unopened sync pool; connections are health-checked on checkout."""
+    return ConnectionPool(**_pool_kwargs(max_size), configure=_configure,
+                          check=ConnectionPool.check_connection, name="sync")
+
+
+def create_async_pool(max_size: int = ASYNC_POOL_MAX_SIZE) -> AsyncConnectionPool:
+    return AsyncConnectionPool(**_pool_kwargs(max_size), configure=_aconfigure,
+                               check=AsyncConnectionPool.check_connection, name="async")
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool()
+            _pool.open()
+        return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
+
+
+async def open_async_pool() -> AsyncConnectionPool:
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = create_async_pool()
+        await _async_pool.open()
+    return _async_pool
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+    _async_pool = None
+
+
+def get_async_pool() -> AsyncConnectionPool:
+    if _async_pool is None:
+        raise RuntimeError("Async pool not initialised; call open_async_pool() first")
+    return _async_pool
+
+
+def _stats(pool) -> dict:
+    raw = pool.get_stats()
+    requests = raw.get("requests_num", 0)
+    size = raw.get("pool_size", 0)
+    return {
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "size": size,
+        "in_use": size - raw.get("pool_available", 0),
+        "idle": raw.get("pool_available", 0),
+        "waiting": raw.get("requests_waiting", 0),
+        "requests": requests,
+        "queued_requests": raw.get("requests_queued", 0),
+        "timeouts": raw.get("requests_errors", 0),
+        "avg_acquire_ms": round(raw.get("requests_wait_ms", 0) / requests, 2) if requests else 0.0,
+        "connection_errors": raw.get("connections_errors", 0),
+        "connections_lost": raw.get("connections_lost", 0),
+    }
+
+
+def pool_stats() -> dict:
+    """Occupancy and acquire-latency counters for each pool that has been opened."""
+    return {
+        "sync": _stats(_pool) if _pool is not None else None,
+        "async": _stats(_async_pool) if _async_pool is not None else None,
+        "settings": {
+            "statement_timeout_ms": DB_STATEMENT_TIMEOUT_MS,
+            "prepare_threshold": DB_PREPARE_THRESHOLD,
+            "max_idle_s": DB_POOL_MAX_IDLE_S,
+            "timeout_s": DB_POOL_TIMEOUT_S,
+        },
+    }
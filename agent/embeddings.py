@@ -0,0 +1,39 @@
+import os
+import threading
+from functools import lru_cache
+import numpy as np
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+
+_embedding_function = None
+_lock = threading.Lock()
+
+
+def _get_embedding_function():
+    # Same local ONNX MiniLM model Chroma uses by default; loaded on first use
+    global _embedding_function
+    with _lock:
+        if _embedding_function is None:
+            from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+            _embedding_function = DefaultEmbeddingFunction()
+        return _embedding_function
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """Embed texts locally. Returns an L2-normalised float32 matrix, one row per text."""
+    vectors = np.asarray(_get_embedding_function()(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def embed_query(text: str) -> np.ndarray:
+    """Embed one query, memoised per string. The returned array is read-only."""
+    vector = embed_texts([text])[0]
+    vector.setflags(write=False)
+    return vector
+
+
+def warm_up() -> None:
+    """Load the model (downloading it on first run) so no request pays for it."""
+    embed_texts(["warm-up"])
@@ -0,0 +1,240 @@
+"""
+Thread history management for the LangGraph agent.
+
+- Retrieved context is injected into the model input for the current turn only;
+  the checkpoint keeps the raw user question (HISTORY_CONTEXT=ephemeral).
+- Earlier turns are trimmed to HISTORY_TOKEN_BUDGET before each model call.
+- With HISTORY_SUMMARY_ENABLED, turns that fall outside the budget are folded
+  into a rolling summary message and removed from the checkpoint.
+- prune_checkpoints() deletes superseded checkpoints, writes and blobs;
+  run it with `python -m agent.history` or from the API's background task.
+"""
+import os
+import asyncio
+import argparse
+from typing import Callable
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    trim_messages,
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from .db import get_pool, get_async_pool
+
+# "ephemeral" stores the raw question; "stored" keeps the legacy behaviour of
+# saving the context-enriched input in the thread
+HISTORY_CONTEXT = os.getenv("HISTORY_CONTEXT", "ephemeral").lower()
+# Approximate tokens of earlier turns sent to the model; 0 disables trimming
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY_ENABLED", "false").lower() == "true"
+# Checkpoints kept per thread by the pruning job; the latest holds the full state
+HISTORY_KEEP_CHECKPOINTS = int(os.getenv("HISTORY_KEEP_CHECKPOINTS", "1"))
+# Seconds between pruning runs in the API process; 0 disables the background job
+HISTORY_PRUNE_INTERVAL_S = float(os.getenv("HISTORY_PRUNE_INTERVAL_S", "3600"))
+HISTORY_PRUNE_BATCH = int(os.getenv("HISTORY_PRUNE_BATCH", "500"))
+
+SUMMARY_ID = "history-summary"
+_SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+_SUMMARY_PROMPT = (
+    "Summarize the conversation below in a few sentences for an assistant that will "
+    "continue it. Keep the policies, facts and open questions that were discussed; "
+    "drop pleasantries.\n\n{previous}{transcript}"
+)
+
+
+def stores_context() -> bool:
+    return HISTORY_CONTEXT == "stored"
+
+
+def _split_current_turn(messages: list) -> tuple[list, list]:
+    """(earlier turns, current turn) where the current turn starts at the last human message."""
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[:i], messages[i:]
+    return [], messages
+
+
+def _trim(history: list, budget: int) -> list:
+    return trim_messages(
+        history,
+        max_tokens=max(budget, 0),
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        start_on="human",
+        include_system=True,
+    )
+
+
+def _transcript(messages: list) -> str:
+    lines = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            lines.append(f"User: {msg.content}")
+        elif isinstance(msg, AIMessage) and msg.content:
+            lines.append(f"Assistant: {msg.content}")
+    return "\n".join(lines)
+
+
+def _summary_prompt(summary: SystemMessage | None, dropped: list) -> str:
+    previous = ""
+    if summary is not None:
+        previous = f"{summary.content}\n\n"
+    return _SUMMARY_PROMPT.format(previous=previous, transcript=_transcript(dropped))
+
+
+def _with_context(current: list, config: RunnableConfig) -> list:
+    """The current turn as sent to the model: the question replaced by the enriched input."""
+    enriched_input = config.get("configurable", {}).get("__enriched_input")
+    if enriched_input and not stores_context():
+        return [current[0].model_copy(update={"content": enriched_input}), *current[1:]]
+    return current
+
+
+def make_pre_model_hook(get_llm: Callable[[], BaseChatModel]) -> RunnableLambda:
+    """
+    Build the create_react_agent pre_model_hook.
+
+    Returns llm_input_messages so the stored thread is untouched, except when a
+    summary is taken: then the thread is rewritten to summary + kept turns.
+    get_llm is resolved on every summary, and the async graph summarizes with ainvoke.
+    """
+
+    def plan(state: dict, config: RunnableConfig) -> tuple[list, list, list, str | None]:
+        """(earlier turns to send, current turn as stored, as sent, summary prompt or None)"""
+        history, current = _split_current_turn(state["messages"])
+        sent = _with_context(current, config)
+        if not HISTORY_TOKEN_BUDGET:
+            return history, current, sent, None
+        # The budget covers the current turn as sent, injected context included
+        kept = _trim(history, HISTORY_TOKEN_BUDGET - count_tokens_approximately(sent))
+        at_turn_start = len(current) == 1
+        if HISTORY_SUMMARY_ENABLED and at_turn_start and len(kept) < len(history):
+            summary = history[0] if history and history[0].id == SUMMARY_ID else None
+            kept_turns = [m for m in kept if m.id != SUMMARY_ID]
+            dropped = [m for m in history[:len(history) - len(kept_turns)] if m.id != SUMMARY_ID]
+            return kept_turns, current, sent, _summary_prompt(summary, dropped)
+        return kept, current, sent, None
+
+    def finish(kept: list, current: list, sent: list, reply=None) -> dict:
+        if reply is None:
+            return {"llm_input_messages": [*kept, *sent]}
+        kept = [SystemMessage(content=f"{_SUMMARY_PREFIX}{reply.content}", id=SUMMARY_ID), *kept]
+        return {
+            "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *kept, *current],
+            "llm_input_messages": [*kept, *sent],
+        }
+
+    def pre_model_hook(state: dict, config: RunnableConfig) -> dict:
+        kept, current, sent, prompt = plan(state, config)
+        return finish(kept, current, sent, get_llm().invoke(prompt) if prompt else None)
+
+    async def apre_model_hook(state: dict, config: RunnableConfig) -> dict:
+        kept, current, sent, prompt = plan(state, config)
+        return finish(kept, current, sent, await get_llm().ainvoke(prompt) if prompt else None)
+
+    return RunnableLambda(pre_model_hook, afunc=apre_model_hook, name="pre_model_hook")
+
+
+# -- checkpoint pruning -------------------------------------------------------
+
+_THREADS_TO_PRUNE_SQL = """
+    SELECT thread_id FROM checkpoints
+    GROUP BY thread_id
+    HAVING count(*) > %s
+    LIMIT %s
+"""
+
+_SUPERSEDED = """
+    SELECT checkpoint_ns, checkpoint_id FROM (
+        SELECT checkpoint_ns, checkpoint_id,
+               row_number() OVER (PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+        FROM checkpoints WHERE thread_id = %(thread_id)s
+    ) ranked WHERE rn > %(keep)s
+"""
+
+# Order matters: writes are found through the checkpoints they belong to, and a
+# blob is only dropped once a surviving checkpoint references a newer version
+# of its channel (so blobs of a checkpoint being written are never touched).
+_PRUNE_THREAD_SQL = (
+    f"""
+    DELETE FROM checkpoint_writes w USING ({_SUPERSEDED}) old
+    WHERE w.thread_id = %(thread_id)s
+      AND w.checkpoint_ns = old.checkpoint_ns AND w.checkpoint_id = old.checkpoint_id
+    """,
+    f"""
+    DELETE FROM checkpoints c USING ({_SUPERSEDED}) old
+    WHERE c.thread_id = %(thread_id)s
+      AND c.checkpoint_ns = old.checkpoint_ns AND c.checkpoint_id = old.checkpoint_id
+    """,
+    """
+    DELETE FROM checkpoint_blobs b
+    WHERE b.thread_id = %(thread_id)s
+      AND NOT EXISTS (
+          SELECT 1 FROM checkpoints c
+          WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+            AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+      )
+      AND EXISTS (
+          SELECT 1 FROM checkpoints c
+          WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+            AND c.checkpoint -> 'channel_versions' ->> b.channel > b.version
+      )
+    """,
+)
+
+
+def prune_checkpoints(keep: int = HISTORY_KEEP_CHECKPOINTS, batch: int = HISTORY_PRUNE_BATCH) -> int:
+    """Prune up to `batch` threads, one transaction each. Returns the number of rows deleted."""
+    deleted = 0
+    with get_pool().connection() as conn:
+        thread_ids = [row[0] for row in conn.execute(_THREADS_TO_PRUNE_SQL, (keep, batch))]
+        for thread_id in thread_ids:
+            with conn.transaction():
+                for sql in _PRUNE_THREAD_SQL:
+                    deleted += conn.execute(sql, {"thread_id": thread_id, "keep": keep}).rowcount
+    return deleted
+
+
+async def aprune_checkpoints(keep: int = HISTORY_KEEP_CHECKPOINTS, batch: int = HISTORY_PRUNE_BATCH) -> int:
+    deleted = 0
+    async with get_async_pool().connection() as conn:
+        cur = await conn.execute(_THREADS_TO_PRUNE_SQL, (keep, batch))
+        thread_ids = [row[0] for row in await cur.fetchall()]
+        for thread_id in thread_ids:
+            async with conn.transaction():
+                for sql in _PRUNE_THREAD_SQL:
+                    cur = await conn.execute(sql, {"thread_id": thread_id, "keep": keep})
+                    deleted += cur.rowcount
+    return deleted
+
+
+async def prune_forever(interval_s: float = HISTORY_PRUNE_INTERVAL_S) -> None:
+    """Background task for the API lifespan."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            deleted = await aprune_checkpoints()
+            if deleted:
+                print(f"Pruned {deleted} superseded checkpoint rows")
+        except Exception as e:
+            print(f"Error pruning checkpoints: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete superseded LangGraph checkpoints")
+    parser.add_argument("--keep", type=int, default=HISTORY_KEEP_CHECKPOINTS, help="checkpoints kept per thread")
+    args = parser.parse_args()
+    total = 0
+    while True:
+        deleted = prune_checkpoints(keep=args.keep)
+        total += deleted
+        if not deleted:
+            break
+    print(f"Pruned {total} rows")
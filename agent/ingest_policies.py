@@ -1,53 +1,236 @@
 import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
 from pathlib import Path
-from .chroma_setup import client, collection
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from .bm25 import BM25Builder, BM25Index
+from .policy_catalog import CatalogBuilder, CATALOG_PATH
+from .chroma_setup import get_collection, bump_collection_version
 
 CHUNKS_DIR = Path("Richmond_Policies_Cleaned/chunked")
 MAX_DOCUMENT_BYTES = 16000  # leave headroom under 16,384-byte Chroma limit
+# Oversized documents are split into windows that repeat this much trailing text
+CHUNK_OVERLAP_BYTES = int(os.getenv("CHUNK_OVERLAP_BYTES", "800"))
+# Ids already in the collection, so re-runs only send what changed
+MANIFEST_PATH = Path(os.getenv("INGEST_MANIFEST_PATH", str(Path(__file__).parent / "ingest_manifest.json")))
+BATCH_SIZE = 100
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
 
-def ingest_policies():
-    documents = []
-    metadatas = []
-    ids = []
-    
-    chunk_files = list(CHUNKS_DIR.glob("*.txt"))
+
+def chunk_id(source: str, content: str) -> str:
+    """Stable id: the same file with the same text always maps to the same id."""
+    digest = hashlib.sha256(f"{source}\0{content}".encode("utf-8")).hexdigest()
+    return f"{Path(source).stem}_{digest[:16]}"
+
+
+def load_manifest() -> dict:
+    """id -> source for everything ingested so far."""
+    if MANIFEST_PATH.exists():
+        return json.loads(MANIFEST_PATH.read_text())["ids"]
+    # First incremental run: whatever is already in the collection is known,
+    # so legacy position-based ids get deleted and replaced.
+    existing = get_collection().get(include=[])
+    return {doc_id: None for doc_id in existing["ids"]}
+
+
+def save_manifest(ids: dict) -> None:
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"ids": ids}, sort_keys=True))
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def _batches(items: list, size: int = BATCH_SIZE) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def _byte_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def _hard_split(text: str, max_bytes: int) -> Iterator[str]:
+    """Split one over-long sentence at whitespace (or anywhere) under max_bytes."""
+    while _byte_len(text) > max_bytes:
+        cut = len(text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore"))
+        space = text.rfind(" ", 0, cut)
+        cut = space if space > 0 else cut
+        yield text[:cut]
+        text = text[cut:].lstrip()
+    if text:
+        yield text
+
+
+def split_document(text: str, max_bytes: int = MAX_DOCUMENT_BYTES,
+                   overlap_bytes: int = CHUNK_OVERLAP_BYTES) -> Iterator[str]:
+    """
+    Yield sentence-bounded windows of at most max_bytes. Each window after the
+    first starts with trailing sentences of the previous one, up to overlap_bytes.
+    """
+    sentences = (piece for s in _SENTENCE_RE.split(text) if s.strip()
+                 for piece in _hard_split(s.strip(), max_bytes))
+    window, size = [], 0
+    for sentence in sentences:
+        n = _byte_len(sentence) + 1
+        if window and size + n > max_bytes:
+            yield " ".join(window)
+            overlap, overlap_size = [], 0
+            for prev in reversed(window):
+                prev_n = _byte_len(prev) + 1
+                if overlap_size + prev_n > overlap_bytes or overlap_size + prev_n + n > max_bytes:
+                    break
+                overlap.insert(0, prev)
+                overlap_size += prev_n
+            window, size = overlap, overlap_size
+        window.append(sentence)
+        size += n
+    if window:
+        yield " ".join(window)
+
+
+def iter_chunks(stats: dict) -> Iterator[tuple[str, str, dict]]:
+    """
+    Yield (id, document, metadata) one file at a time so memory stays flat.
+    Files over MAX_DOCUMENT_BYTES are re-chunked instead of skipped; stats
+    collects how much text that recovers.
+    """
+    chunk_files = sorted(CHUNKS_DIR.glob("*.txt"))
     print(f"Found {len(chunk_files)} chunk files")
-    
+
     for i, filepath in enumerate(chunk_files):
         content = filepath.read_text()
-        
-        # Skip documents that exceed Chroma's per-document size limit
-        if len(content.encode("utf-8")) > MAX_DOCUMENT_BYTES:
-            print(f"Skipping {filepath.name}: {len(content.encode('utf-8'))} bytes (exceeds {MAX_DOCUMENT_BYTES})")
-            continue
-        
         filename = filepath.stem
-        
+
         # Extract policy name from filename (e.g., "ch1-academic_credit_policy-len477")
         parts = filename.split("-", 1)
         chunk_num = parts[0] if parts else f"ch{i}"
         policy_name = parts[1].rsplit("-len", 1)[0] if len(parts) > 1 else filename
-        
-        documents.append(content)
-        metadatas.append({
+        metadata = {
             "source": filepath.name,
             "policy_name": policy_name.replace("_", " "),
             "chunk": chunk_num,
-        })
-        ids.append(f"{filename}_{i}")
-    
-    # Add in batches (ChromaDB has limits)
-    batch_size = 100
-    for i in range(0, len(documents), batch_size):
-        batch_end = min(i + batch_size, len(documents))
-        collection.upsert(
-            documents=documents[i:batch_end],
-            metadatas=metadatas[i:batch_end],
-            ids=ids[i:batch_end],
-        )
-        print(f"Added batch {i//batch_size + 1}: {i} to {batch_end}")
-    
-    print(f"Ingestion complete! Total documents: {collection.count()}")
+            "sub_chunk": 0,
+        }
+
+        size = _byte_len(content)
+        if size <= MAX_DOCUMENT_BYTES:
+            yield chunk_id(filepath.name, content), content, metadata
+            continue
+
+        # Over Chroma's per-document size limit: split into overlapping windows
+        stats["split_files"] += 1
+        stats["recovered_bytes"] += size
+        for sub, window in enumerate(split_document(content)):
+            stats["sub_chunks"] += 1
+            yield chunk_id(f"{filepath.name}#{sub}", window), window, {**metadata, "sub_chunk": sub}
+
+
+def ingest_policies(full: bool = False) -> dict:
+    """
+    Incrementally sync the chunk directory into the collection.
+
+    Chunks are streamed from disk; only those whose content hash is new are
+    upserted and ids that no longer exist on disk are deleted. Batches are sent
+    INGEST_CONCURRENCY at a time. Returns the per-run diff with counts and timings.
+    """
+    timings = {}
+    start = time.perf_counter()
+    collection = get_collection()
+    known = load_manifest()
+    stats = {"split_files": 0, "sub_chunks": 0, "recovered_bytes": 0}
+
+    current = {}
+    changed_sources = set()
+    known_sources = set(known.values())
+    upserted = 0
+    # The lexical index always covers the whole corpus, so it sees unchanged chunks too.
+    # It is written to disk as the scan goes.
+    bm25 = BM25Builder()
+    batch = ([], [], [])
+    # Bounded in-flight batches: backpressure on the file scan keeps memory flat
+    slots = threading.BoundedSemaphore(INGEST_CONCURRENCY * 2)
+    futures = []
+
+    def submit(batch):
+        slots.acquire()
+        future = executor.submit(collection.upsert, ids=batch[0], documents=batch[1], metadatas=batch[2])
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+        print(f"Submitted upsert batch {len(futures)}")
+
+    with ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY) as executor:
+        for doc_id, document, metadata in iter_chunks(stats):
+            current[doc_id] = metadata["source"]
+            bm25.add(doc_id, document, metadata)
+            if not full and doc_id in known:
+                continue
+            upserted += 1
+            if metadata["source"] in known_sources:
+                changed_sources.add(metadata["source"])
+            for column, value in zip(batch, (doc_id, document, metadata)):
+                column.append(value)
+            if len(batch[0]) >= BATCH_SIZE:
+                submit(batch)
+                batch = ([], [], [])
+        if batch[0]:
+            submit(batch)
+        for future in futures:
+            future.result()
+    timings["upsert_s"] = time.perf_counter() - start
+
+    phase_start = time.perf_counter()
+    to_delete = [doc_id for doc_id in known if doc_id not in current]
+    if to_delete:
+        with ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY) as executor:
+            for future in [executor.submit(collection.delete, ids=batch) for batch in _batches(to_delete)]:
+                future.result()
+    timings["delete_s"] = time.perf_counter() - phase_start
+
+    # The local backend buffers upserts and writes its memory-mapped index here
+    if hasattr(collection, "persist"):
+        collection.persist()
+
+    phase_start = time.perf_counter()
+    bm25.finish()
+    # The catalog is read back from the finished index rather than collected during the scan
+    index = BM25Index()
+    catalog = CatalogBuilder()
+    for doc_id, metadata in index.iter_metadata():
+        catalog.add(doc_id, metadata)
+    index.close()
+    catalog.build().save(CATALOG_PATH)
+    timings["bm25_s"] = time.perf_counter() - phase_start
+
+    save_manifest(current)
+
+    if upserted or to_delete:
+        # Signals caches in running API workers that stored answers may be stale
+        version = bump_collection_version()
+        print(f"Collection version bumped to {version}")
+
+    timings["total_s"] = time.perf_counter() - start
+    report = {
+        "scanned": len(current),
+        "upserted": upserted,
+        "changed_sources": len(changed_sources),
+        "unchanged": len(current) - upserted,
+        "deleted": len(to_delete),
+        # Bytes that the old skip-oversized behaviour never made searchable
+        **stats,
+        "timings": {name: round(value, 3) for name, value in timings.items()},
+    }
+    print(f"Ingestion complete! {json.dumps(report)}")
+    print(f"Total documents: {collection.count()}")
+    return report
+
 
 if __name__ == "__main__":
-    ingest_policies()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sync policy chunks into the vector store")
+    parser.add_argument("--full", action="store_true", help="re-upsert every chunk regardless of the manifest")
+    ingest_policies(full=parser.parse_args().full)
@@ -0,0 +1,340 @@
+"""
+Embedded vector index with the same query() contract as a Chroma collection.
+
+Chunk embeddings live in an L2-normalised float32 matrix saved as .npy and
+memory-mapped on load. Exact search is one matmul over the matrix; when an
+IVF index has been built, queries score only the nprobe closest clusters.
+Distances are cosine distances (1 - cosine similarity).
+"""
+import os
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .embeddings import embed_texts, embed_query
+
+IVF_MIN_ROWS = int(os.getenv("LOCAL_INDEX_IVF_MIN_ROWS", "5000"))
+IVF_NPROBE = int(os.getenv("LOCAL_INDEX_IVF_NPROBE", "8"))
+# Exact search unless LOCAL_INDEX_SEARCH=ivf and an IVF index exists
+LOCAL_INDEX_SEARCH = os.getenv("LOCAL_INDEX_SEARCH", "exact")
+
+_EMBEDDINGS_FILE = "embeddings.npy"
+_RECORDS_FILE = "records.json"
+_CENTROIDS_FILE = "ivf_centroids.npy"
+_ASSIGNMENTS_FILE = "ivf_assignments.npy"
+_MANIFEST_FILE = "manifest.json"
+
+
+def _matches(metadata: dict, where: dict | None) -> bool:
+    """Subset of Chroma's where syntax: equality, $eq, $ne, $in, $nin, $and, $or."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means. Returns (centroids, assignment per row)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int32)
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+        for c in range(n_clusters):
+            members = vectors[assignments == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids, assignments
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = centroids
+        self.assignments = assignments
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(centroids))]
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_clusters: int | None = None) -> "IVFIndex":
+        n_clusters = n_clusters or max(1, int(np.sqrt(len(vectors))))
+        return cls(*kmeans(np.asarray(vectors), n_clusters))
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, len(self.centroids))
+        nearest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[c] for c in nearest])
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+class _Snapshot:
+    """Consistent view for one query; arrays are replaced, never written in place."""
+
+    def __init__(self, embeddings: np.ndarray, ids: list[str], documents: list[str],
+                 metadatas: list[dict], ivf: "IVFIndex | None"):
+        self.embeddings = embeddings
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.ivf = ivf
+
+
+class LocalCollection:
+    """
+    Drop-in replacement for the Chroma collection backed by files in index_dir.
+
+    Upserts and deletes are buffered: new rows are appended to a list, changed
+    rows and deletions are recorded, and the matrix is rebuilt once, by
+    persist() or the next read, instead of being copied on every batch.
+    """
+
+    def __init__(self, index_dir: str | Path, name: str = "richmond_policies"):
+        self.name = name
+        self.index_dir = Path(index_dir)
+        self._lock = threading.RLock()
+        self._loaded_mtime = None
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._ids: list[str] = []
+        self._documents: list[str] = []
+        self._metadatas: list[dict] = []
+        self._positions: dict[str, int] = {}
+        self._ivf: IVFIndex | None = None
+        # Buffered writes: vectors for rows past the matrix, replacements for rows
+        # in it, and rows to drop
+        self._appended: list[np.ndarray] = []
+        self._replaced: dict[int, np.ndarray] = {}
+        self._deleted: set[int] = set()
+        self._dirty = False
+
+    # -- persistence -------------------------------------------------------
+
+    def _manifest(self) -> dict:
+        path = self.index_dir / _MANIFEST_FILE
+        return json.loads(path.read_text()) if path.exists() else {}
+
+    def _write_manifest(self, manifest: dict) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_dir / f"{_MANIFEST_FILE}.tmp"
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, self.index_dir / _MANIFEST_FILE)
+
+    def _ensure_loaded(self) -> None:
+        """(Re)load the index when ingestion has rewritten it."""
+        manifest_path = self.index_dir / _MANIFEST_FILE
+        mtime = manifest_path.stat().st_mtime_ns if manifest_path.exists() else None
+        with self._lock:
+            if mtime == self._loaded_mtime or self._dirty:
+                return
+            self._loaded_mtime = mtime
+            embeddings_path = self.index_dir / _EMBEDDINGS_FILE
+            if not embeddings_path.exists():
+                return
+            self._embeddings = np.load(embeddings_path, mmap_mode="r")
+            records = json.loads((self.index_dir / _RECORDS_FILE).read_text())
+            self._ids = records["ids"]
+            self._documents = records["documents"]
+            self._metadatas = records["metadatas"]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._ivf = None
+            if (self.index_dir / _CENTROIDS_FILE).exists():
+                self._ivf = IVFIndex(
+                    np.load(self.index_dir / _CENTROIDS_FILE),
+                    np.load(self.index_dir / _ASSIGNMENTS_FILE),
+                )
+
+    def _consolidate(self) -> None:
+        """Fold buffered writes into a new matrix and record lists; caller holds the lock."""
+        if not (self._appended or self._replaced or self._deleted):
+            return
+        dim = self._appended[0].shape[0] if self._appended else self._embeddings.shape[1]
+        base = self._embeddings if self._embeddings.size else np.zeros((0, dim), dtype=np.float32)
+        parts = [np.asarray(base, dtype=np.float32)]
+        if self._appended:
+            parts.append(np.stack(self._appended).astype(np.float32, copy=False))
+        embeddings = np.concatenate(parts) if len(parts) > 1 else parts[0].copy()
+        for i, vector in self._replaced.items():
+            embeddings[i] = vector
+        if self._deleted:
+            keep = [i for i in range(len(self._ids)) if i not in self._deleted]
+            embeddings = embeddings[keep]
+            self._ids = [self._ids[i] for i in keep]
+            self._documents = [self._documents[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._embeddings = embeddings
+        self._appended, self._replaced, self._deleted = [], {}, set()
+        # Row numbers changed, so the on-disk IVF lists no longer apply
+        self._ivf = None
+
+    def _snapshot(self) -> _Snapshot:
+        self._ensure_loaded()
+        with self._lock:
+            self._consolidate()
+            return _Snapshot(self._embeddings, self._ids, self._documents, self._metadatas, self._ivf)
+
+    def persist(self) -> None:
+        """Write pending upserts/deletes to disk, rebuilding the IVF index when large enough."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._consolidate()
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            embeddings = np.ascontiguousarray(self._embeddings, dtype=np.float32)
+            np.save(self.index_dir / f"{_EMBEDDINGS_FILE}.tmp.npy", embeddings)
+            os.replace(self.index_dir / f"{_EMBEDDINGS_FILE}.tmp.npy", self.index_dir / _EMBEDDINGS_FILE)
+            records_tmp = self.index_dir / f"{_RECORDS_FILE}.tmp"
+            records_tmp.write_text(json.dumps({
+                "ids": self._ids, "documents": self._documents, "metadatas": self._metadatas,
+            }))
+            os.replace(records_tmp, self.index_dir / _RECORDS_FILE)
+            for stale in (_CENTROIDS_FILE, _ASSIGNMENTS_FILE):
+                (self.index_dir / stale).unlink(missing_ok=True)
+            if len(embeddings) >= IVF_MIN_ROWS:
+                ivf = IVFIndex.build(embeddings)
+                np.save(self.index_dir / _CENTROIDS_FILE, ivf.centroids)
+                np.save(self.index_dir / _ASSIGNMENTS_FILE, ivf.assignments)
+            manifest = self._manifest()
+            manifest["count"] = len(self._ids)
+            self._write_manifest(manifest)
+            self._dirty = False
+            self._loaded_mtime = None
+        self._ensure_loaded()
+
+    # -- Chroma collection contract -----------------------------------------
+
+    @property
+    def metadata(self) -> dict:
+        return self._manifest().get("metadata", {})
+
+    def modify(self, metadata: dict | None = None, **kwargs) -> None:
+        if metadata is not None:
+            manifest = self._manifest()
+            manifest["metadata"] = metadata
+            self._write_manifest(manifest)
+
+    def count(self) -> int:
+        return len(self._snapshot().ids)
+
+    def upsert(self, ids: list[str], documents: list[str], metadatas: list[dict] | None = None, **kwargs) -> None:
+        self._ensure_loaded()
+        metadatas = metadatas or [{} for _ in ids]
+        # Embedding is the slow part and runs outside the lock, so ingest threads overlap
+        vectors = np.asarray(embed_texts(documents), dtype=np.float32)
+        with self._lock:
+            matrix_rows = len(self._embeddings)
+            for doc_id, doc, meta, vector in zip(ids, documents, metadatas, vectors):
+                i = self._positions.get(doc_id)
+                if i is None:
+                    self._positions[doc_id] = len(self._ids)
+                    self._ids.append(doc_id)
+                    self._documents.append(doc)
+                    self._metadatas.append(meta)
+                    self._appended.append(vector)
+                    continue
+                if i < matrix_rows:
+                    self._replaced[i] = vector
+                else:
+                    self._appended[i - matrix_rows] = vector
+                self._documents[i] = doc
+                self._metadatas[i] = meta
+            self._dirty = True
+
+    def delete(self, ids: list[str] | None = None, **kwargs) -> None:
+        self._ensure_loaded()
+        with self._lock:
+            for doc_id in ids or []:
+                i = self._positions.pop(doc_id, None)
+                if i is not None:
+                    self._deleted.add(i)
+            self._dirty = True
+
+    def get(self, ids: list[str] | None = None, where: dict | None = None,
+            include=("metadatas", "documents"), **kwargs) -> dict:
+        self._ensure_loaded()
+        with self._lock:
+            self._consolidate()
+            if ids is not None:
+                rows = [self._positions[doc_id] for doc_id in ids if doc_id in self._positions]
+            else:
+                rows = list(range(len(self._ids)))
+            rows = [i for i in rows if _matches(self._metadatas[i], where)]
+            return {
+                "ids": [self._ids[i] for i in rows],
+                "documents": [self._documents[i] for i in rows] if "documents" in include else None,
+                "metadatas": [self._metadatas[i] for i in rows] if "metadatas" in include else None,
+                "included": list(include),
+            }
+
+    def _search(self, snapshot: _Snapshot, query: np.ndarray, n_results: int, where: dict | None = None,
+                mode: str | None = None) -> tuple[np.ndarray, np.ndarray]:
+        mode = mode or LOCAL_INDEX_SEARCH
+        n_rows = len(snapshot.embeddings)
+        if mode == "ivf" and snapshot.ivf is not None:
+            rows = snapshot.ivf.candidates(query, IVF_NPROBE)
+        else:
+            rows = np.arange(n_rows)
+        if where:
+            rows = np.array([i for i in rows if _matches(snapshot.metadatas[i], where)], dtype=np.int64)
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        scores = snapshot.embeddings[rows] @ query if len(rows) < n_rows else snapshot.embeddings @ query
+        best = top_k(scores, n_results)
+        return rows[best], scores[best]
+
+    def search(self, query: np.ndarray, n_results: int, where: dict | None = None,
+               mode: str | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, cosine similarities) for one normalised query vector."""
+        return self._search(self._snapshot(), query, n_results, where, mode)
+
+    def query(self, query_texts=None, query_embeddings=None, n_results: int = 10, where=None,
+              include=("metadatas", "documents", "distances"), **kwargs) -> dict:
+        if query_embeddings is not None:
+            queries = np.asarray(query_embeddings, dtype=np.float32)
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        else:
+            if isinstance(query_texts, str):
+                query_texts = [query_texts]
+            queries = np.stack([embed_query(text) for text in query_texts])
+
+        snapshot = self._snapshot()
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": [], "included": list(include)}
+        for query in queries:
+            rows, scores = self._search(snapshot, query, n_results, where)
+            result["ids"].append([snapshot.ids[i] for i in rows])
+            result["documents"].append([snapshot.documents[i] for i in rows])
+            result["metadatas"].append([snapshot.metadatas[i] for i in rows])
+            result["distances"].append([float(1 - s) for s in scores])
+        for field in ("documents", "metadatas", "distances"):
+            if field not in include:
+                result[field] = None
+        return result
@@ -0,0 +1,172 @@
+"""
+Per-stage latency spans.
+
+span("retrieval.vector") times a block with the monotonic clock, adds it to a
+process-wide Prometheus histogram and to the current turn's breakdown. A turn
+starts with begin_turn(); the breakdown lives in a ContextVar, so it follows
+the turn through asyncio.to_thread and LangGraph's executor threads.
+"""
+import os
+import time
+import bisect
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Seconds; covers sub-millisecond cache hits up to slow multi-tool turns
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Item counts, e.g. queries per batched retrieval call
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_turn_stages: ContextVar[dict | None] = ContextVar("turn_stages", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_histograms: dict[str, Histogram] = {}
+_size_histograms: dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+
+def observe(stage: str, seconds: float) -> None:
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+    stages = _turn_stages.get()
+    if stages is not None:
+        stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 1)
+
+
+def observe_size(name: str, value: int) -> None:
+    """Record a count (not a latency) in its own histogram, exported as `name`."""
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        histogram = _size_histograms.get(name)
+        if histogram is None:
+            histogram = _size_histograms[name] = Histogram(SIZE_BUCKETS)
+        histogram.observe(value)
+
+
+def begin_turn() -> dict:
+    """Start collecting the stage breakdown (stage -> total ms) for this turn."""
+    stages = {}
+    _turn_stages.set(stages)
+    return stages
+
+
+@contextmanager
+def span(stage: str):
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(stage, time.monotonic() - start)
+
+
+def timed(stage: str):
+    """Decorator form of span() for sync and async functions."""
+
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+class LLMSpanHandler(BaseCallbackHandler):
+    """Times chat model calls as the "llm" stage."""
+
+    def __init__(self):
+        self._started: dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        self._started[run_id] = time.monotonic()
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        self._finish(run_id)
+
+    def _finish(self, run_id: UUID) -> None:
+        start = self._started.pop(run_id, None)
+        if start is not None and METRICS_ENABLED:
+            observe("llm", time.monotonic() - start)
+
+
+llm_span_handler = LLMSpanHandler()
+
+
+def stage_counts() -> dict[str, int]:
+    """Observations per stage since the process started."""
+    with _lock:
+        return {stage: histogram.count for stage, histogram in _histograms.items()}
+
+
+def _histogram_lines(metric: str, labels: str, histogram: Histogram) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*histogram.buckets, float("inf")), histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{metric}_bucket{{{labels}le="{le}"}} {cumulative}')
+    suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+    lines.append(f"{metric}_count{suffix} {histogram.count}")
+    return lines
+
+
+def render_prometheus(gauges: dict[str, float] | None = None) -> str:
+    """
+    Text exposition of every stage histogram as stage_latency_seconds{stage=...},
+    then the count histograms from observe_size(), then any point-in-time gauges
+    the caller passes in.
+    """
+    lines = [
+        "# HELP stage_latency_seconds Latency of each request stage.",
+        "# TYPE stage_latency_seconds histogram",
+    ]
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            lines.extend(_histogram_lines("stage_latency_seconds", f'stage="{stage}",', histogram))
+        for name, histogram in sorted(_size_histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(_histogram_lines(name, "", histogram))
+    for name, value in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
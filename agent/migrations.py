@@ -0,0 +1,201 @@
+"""
+Versioned schema migrations. Run once per deploy, not from every worker:
+
+    python -m agent.migrations
+
+Applied versions are recorded in schema_migrations; an advisory lock keeps
+concurrent runs from racing. Migration 1 is the schema the app used to create
+at import time and is idempotent, so it is safe on existing databases.
+"""
+import psycopg
+from langgraph.checkpoint.postgres import PostgresSaver
+
+from .db import SUPABASE_DB_URL
+
+_LOCK_KEY = 727_001
+
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (1, "chats, messages and feedback tables", [
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id SERIAL PRIMARY KEY,
+            message_id TEXT NOT NULL UNIQUE,
+            thread_id TEXT,
+            feedback TEXT,
+            message_content TEXT,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('user', 'assistant')),
+            content TEXT NOT NULL,
+            response_time_ms INTEGER,
+            context_used BOOLEAN,
+            tool_calls TEXT,
+            error_occurred BOOLEAN DEFAULT FALSE,
+            error_type TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            CONSTRAINT fk_chat FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at)",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS session_id TEXT",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS response_time_ms INTEGER",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS context_used BOOLEAN",
+        "ALTER TABLE feedback DROP COLUMN IF EXISTS tool_calls",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS tool_calls TEXT",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS error_occurred BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS error_type TEXT",
+        """
+        DO $$ BEGIN
+            ALTER TABLE feedback ADD CONSTRAINT feedback_message_id_key UNIQUE (message_id);
+        EXCEPTION WHEN duplicate_table THEN NULL;
+        END $$;
+        """,
+    ]),
+    (2, "keyset pagination indexes for chats and messages", [
+        "CREATE INDEX IF NOT EXISTS idx_chats_updated_at_id ON chats(updated_at DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_created_id ON messages(chat_id, created_at, id)",
+    ]),
+    (3, "full-text search over message content and chat titles", [
+        # Rewrites messages once; afterwards Postgres keeps the column current on every write
+        """
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_messages_content_tsv ON messages USING GIN (content_tsv)",
+        "CREATE INDEX IF NOT EXISTS idx_chats_title_tsv ON chats USING GIN (to_tsvector('english', title))",
+    ]),
+    (4, "tool_names arrays and hourly analytics rollups", [
+        # Writers keep sending the comma-joined tool_calls string; the array follows it
+        """
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS tool_names TEXT[]
+            GENERATED ALWAYS AS (string_to_array(tool_calls, ',')) STORED
+        """,
+        """
+        ALTER TABLE feedback ADD COLUMN IF NOT EXISTS tool_names TEXT[]
+            GENERATED ALWAYS AS (string_to_array(tool_calls, ',')) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_messages_tool_names ON messages USING GIN (tool_names)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_tool_names ON feedback USING GIN (tool_names)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS analytics_hourly (
+            source TEXT NOT NULL CHECK (source IN ('messages', 'feedback')),
+            bucket TIMESTAMP NOT NULL,
+            row_count INTEGER NOT NULL,
+            latency_count INTEGER NOT NULL,
+            latency_sum BIGINT NOT NULL,
+            latency_max INTEGER,
+            latency_hist INTEGER[] NOT NULL,
+            context_used INTEGER NOT NULL,
+            context_known INTEGER NOT NULL,
+            thumbs_up INTEGER NOT NULL,
+            thumbs_down INTEGER NOT NULL,
+            errors INTEGER NOT NULL,
+            error_types JSONB NOT NULL,
+            tool_counts JSONB NOT NULL,
+            PRIMARY KEY (source, bucket)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS analytics_state (
+            name TEXT PRIMARY KEY,
+            refreshed_through TIMESTAMP NOT NULL
+        )
+        """,
+    ]),
+    (5, "per-chat message version for transcript ETags", [
+        "ALTER TABLE chats ADD COLUMN IF NOT EXISTS message_version BIGINT NOT NULL DEFAULT 0",
+        "UPDATE chats c SET message_version = (SELECT count(*) FROM messages m WHERE m.chat_id = c.id)",
+    ]),
+    (6, "updated_at on messages and feedback for incremental analytics", [
+        # No default while adding, so existing rows stay NULL instead of all looking changed now
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+        "ALTER TABLE messages ALTER COLUMN updated_at SET DEFAULT NOW()",
+        "ALTER TABLE feedback ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP",
+        "ALTER TABLE feedback ALTER COLUMN updated_at SET DEFAULT NOW()",
+        "CREATE INDEX IF NOT EXISTS idx_messages_updated_at ON messages(updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_feedback_updated_at ON feedback(updated_at)",
+    ]),
+    (7, "tombstones for the analytics hours of deleted rows", [
+        """
+        CREATE TABLE IF NOT EXISTS analytics_deleted_hours (
+            bucket TIMESTAMP NOT NULL,
+            deleted_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_analytics_deleted_hours_deleted_at ON analytics_deleted_hours(deleted_at)",
+        # Statement-level, so deleting a chat records each hour once however many rows cascade
+        """
+        CREATE OR REPLACE FUNCTION analytics_record_deleted_hours() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO analytics_deleted_hours (bucket)
+            SELECT DISTINCT date_trunc('hour', created_at) FROM deleted_rows;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS messages_analytics_deleted ON messages",
+        """
+        CREATE TRIGGER messages_analytics_deleted AFTER DELETE ON messages
+        REFERENCING OLD TABLE AS deleted_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_record_deleted_hours()
+        """,
+        "DROP TRIGGER IF EXISTS feedback_analytics_deleted ON feedback",
+        """
+        CREATE TRIGGER feedback_analytics_deleted AFTER DELETE ON feedback
+        REFERENCING OLD TABLE AS deleted_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION analytics_record_deleted_hours()
+        """,
+    ]),
+]
+
+
+def migrate(conninfo: str | None = None) -> list[int]:
+    """Apply pending migrations. Returns the versions applied by this run."""
+    applied_now = []
+    with psycopg.connect(conninfo or SUPABASE_DB_URL, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (_LOCK_KEY,))
+        try:
+            PostgresSaver(conn).setup()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                )
+            """)
+            applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                with conn.transaction():
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (version, description),
+                    )
+                print(f"Applied migration {version}: {description}")
+                applied_now.append(version)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+    return applied_now
+
+
+if __name__ == "__main__":
+    applied = migrate()
+    print(f"Database is up to date ({len(applied)} migration(s) applied)")
@@ -0,0 +1,136 @@
+"""
+Catalog of ingested policies: name, aliases, source files and chunk ids in
+document order. Built by ingest_policies from the finished BM25 index and used to
+resolve a policy the user names into a metadata filter, and to find a
+chunk's neighbours without another similarity search.
+"""
+import os
+import re
+import json
+import difflib
+import threading
+from pathlib import Path
+
+CATALOG_PATH = Path(os.getenv("POLICY_CATALOG_PATH", str(Path(__file__).parent / "policy_catalog.json")))
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_ACRONYM_SKIP = frozenset({"and", "of", "the", "for", "on", "in", "to", "a", "an"})
+_CHUNK_NUM_RE = re.compile(r"(\d+)")
+
+
+def _normalize(name: str) -> str:
+    return " ".join(_WORD_RE.findall(name.lower()))
+
+
+def aliases_for(policy_name: str) -> list[str]:
+    """Lowercase name, name without "policy", and an acronym for multi-word names."""
+    name = _normalize(policy_name)
+    aliases = [name]
+    short = re.sub(r"\s*\b(policy|policies|procedures?|guidelines?)\b\s*", " ", name).strip()
+    if short and short != name:
+        aliases.append(short)
+    words = [w for w in short.split() if w not in _ACRONYM_SKIP]
+    if len(words) >= 2:
+        aliases.append("".join(w[0] for w in words))
+    return list(dict.fromkeys(aliases))
+
+
+def _chunk_order(meta: dict) -> tuple[int, int]:
+    match = _CHUNK_NUM_RE.search(str(meta.get("chunk", "")))
+    return int(match.group(1)) if match else 0, int(meta.get("sub_chunk", 0))
+
+
+class PolicyCatalog:
+    def __init__(self, policies: dict[str, dict]):
+        self.policies = policies
+        self._alias_index = {}
+        self._positions = {}
+        for name, entry in policies.items():
+            for alias in entry["aliases"]:
+                self._alias_index.setdefault(alias, name)
+            for i, chunk_id in enumerate(entry["chunk_ids"]):
+                self._positions[chunk_id] = (name, i)
+
+    def names(self) -> list[str]:
+        return sorted(self.policies)
+
+    def resolve(self, name: str, limit: int = 3) -> list[str]:
+        """Catalog names for what the user called a policy, best first; [] if nothing is close."""
+        query = _normalize(name)
+        if query in self._alias_index:
+            return [self._alias_index[query]]
+        terms = set(query.split())
+        scored = []
+        for alias, policy in self._alias_index.items():
+            alias_terms = set(alias.split())
+            overlap = len(terms & alias_terms) / len(terms | alias_terms) if terms else 0.0
+            if overlap >= 0.5:
+                scored.append((overlap, policy))
+        if not scored:
+            close = difflib.get_close_matches(query, list(self._alias_index), n=limit, cutoff=0.6)
+            return list(dict.fromkeys(self._alias_index[alias] for alias in close))
+        scored.sort(key=lambda item: -item[0])
+        return list(dict.fromkeys(policy for _, policy in scored))[:limit]
+
+    def neighbors(self, chunk_id: str, before: int = 1, after: int = 1) -> list[str]:
+        """Ids of the chunks around chunk_id in document order, including chunk_id."""
+        if chunk_id not in self._positions:
+            return []
+        name, i = self._positions[chunk_id]
+        chunk_ids = self.policies[name]["chunk_ids"]
+        return chunk_ids[max(0, i - before):i + after + 1]
+
+    def policy_of(self, chunk_id: str) -> str | None:
+        position = self._positions.get(chunk_id)
+        return position[0] if position else None
+
+    def save(self, path: Path = CATALOG_PATH) -> None:
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"policies": self.policies}, sort_keys=True))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path = CATALOG_PATH) -> "PolicyCatalog":
+        return cls(json.loads(path.read_text())["policies"])
+
+
+class CatalogBuilder:
+    def __init__(self):
+        self._chunks: dict[str, list[tuple[tuple[int, int], str]]] = {}
+        self._sources: dict[str, set[str]] = {}
+
+    def add(self, doc_id: str, metadata: dict) -> None:
+        name = metadata.get("policy_name", "")
+        self._chunks.setdefault(name, []).append((_chunk_order(metadata), doc_id))
+        self._sources.setdefault(name, set()).add(metadata.get("source", ""))
+
+    def build(self) -> PolicyCatalog:
+        policies = {}
+        for name, chunks in self._chunks.items():
+            chunk_ids = [doc_id for _, doc_id in sorted(chunks)]
+            policies[name] = {
+                "aliases": aliases_for(name),
+                "sources": sorted(self._sources[name]),
+                "chunk_count": len(chunk_ids),
+                "chunk_ids": chunk_ids,
+            }
+        return PolicyCatalog(policies)
+
+
+_catalog: PolicyCatalog | None = None
+_loaded_mtime = None
+_lock = threading.Lock()
+
+
+def get_catalog() -> PolicyCatalog | None:
+    """The on-disk catalog, reloaded after ingestion rewrites it; None if never built."""
+    global _catalog, _loaded_mtime
+    try:
+        mtime = CATALOG_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if mtime != _loaded_mtime:
+            _catalog = PolicyCatalog.load()
+            _loaded_mtime = mtime
+        return _catalog
@@ -0,0 +1,163 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from .embeddings import embed_query
+
+DEFAULT_INCLUDE = ("metadatas", "documents", "distances")
+
+
+class CachedCollection:
+    """
+    Wraps a Chroma collection and caches query() results per query text.
+
+    Results are kept in an in-process LRU and, when sqlite_path is set, in an
+    on-disk SQLite table that survives restarts. Every key is scoped to the
+    collection version returned by version_fn (bumped by ingest_policies), so
+    a new ingestion makes all earlier entries unreachable. Anything other
+    than query() is passed straight through to the wrapped collection.
+    """
+
+    def __init__(
+        self,
+        inner,
+        version_fn: Callable[[], str | None],
+        max_entries: int = 2048,
+        sqlite_path: str | None = None,
+        version_check_s: float = 60.0,
+        local_embeddings: bool = False,
+    ):
+        self._inner = inner
+        self._version_fn = version_fn
+        self._max_entries = max_entries
+        self._version_check_s = version_check_s
+        self._local_embeddings = local_embeddings
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = float("-inf")
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    key TEXT PRIMARY KEY,
+                    version TEXT,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _current_version(self) -> str:
+        now = time.monotonic()
+        if now - self._version_checked_at >= self._version_check_s:
+            self._version_checked_at = now
+            try:
+                version = self._version_fn()
+            except Exception as e:
+                print(f"Error reading collection version: {e}")
+                version = self._version
+            if version != self._version:
+                self.invalidate(keep_version=str(version))
+            self._version = version
+        return str(self._version)
+
+    def invalidate(self, keep_version: str | None = None) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM query_cache WHERE version IS NOT ?", (keep_version,))
+                self._db.commit()
+
+    def _get(self, key: str) -> dict | None:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM query_cache WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self.disk_hits += 1
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    return value
+            self.misses += 1
+            return None
+
+    def _remember(self, key: str, value: dict) -> None:
+        self._memory[key] = value
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    def _put(self, key: str, version: str, value: dict) -> None:
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, version, value, created_at) VALUES (?, ?, ?, ?)",
+                    (key, version, json.dumps(value), time.time()),
+                )
+                self._db.commit()
+
+    def query(self, query_texts=None, n_results: int = 10, where=None, where_document=None,
+              include=DEFAULT_INCLUDE, **kwargs):
+        if query_texts is None or kwargs:
+            # Embedding queries and extra options are not cached
+            return self._inner.query(query_texts=query_texts, n_results=n_results, where=where,
+                                     where_document=where_document, include=list(include), **kwargs)
+        if isinstance(query_texts, str):
+            query_texts = [query_texts]
+
+        version = self._current_version()
+        include = list(include)
+        keys = [
+            json.dumps([version, text, n_results, sorted(include), where, where_document], sort_keys=True)
+            for text in query_texts
+        ]
+        rows = [self._get(key) for key in keys]
+
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            query_args = {"n_results": n_results, "where": where,
+                          "where_document": where_document, "include": include}
+            if self._local_embeddings:
+                query_args["query_embeddings"] = [embed_query(query_texts[i]).tolist() for i in missing]
+            else:
+                query_args["query_texts"] = [query_texts[i] for i in missing]
+            results = self._inner.query(**query_args)
+            for j, i in enumerate(missing):
+                row = {"ids": results["ids"][j]}
+                for field in include:
+                    row[field] = results[field][j] if results.get(field) is not None else None
+                rows[i] = row
+                self._put(keys[i], version, row)
+
+        merged = {"ids": [row["ids"] for row in rows], "included": include}
+        for field in include:
+            merged[field] = [row[field] for row in rows]
+        return merged
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "version": self._version,
+                "entries": len(self._memory),
+                "disk_enabled": self._db is not None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,152 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from .chroma_setup import get_collection_version
+from .embeddings import embed_query
+
+# Opt-in: a hit replays an answer to a different, merely similar question
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# How often to poll the collection version bumped by ingest_policies
+RESPONSE_CACHE_VERSION_CHECK_S = float(os.getenv("RESPONSE_CACHE_VERSION_CHECK_S", "60"))
+
+# Words that usually point back at earlier turns ("what about it?", "and that one?")
+_REFERENTIAL_RE = re.compile(
+    r"\b(it|its|that|this|those|these|they|them|their|he|she|above|previous|earlier|"
+    r"again|same|also|else|more|instead|what about|how about)\b",
+    re.IGNORECASE,
+)
+
+
+def is_history_independent(user_input: str) -> bool:
+    """Heuristic: a question with no back-references can be answered without history."""
+    return not _REFERENTIAL_RE.search(user_input)
+
+
+@dataclass
+class _Entry:
+    query: str
+    embedding: np.ndarray
+    response: dict
+    created_at: float
+
+
+class SemanticResponseCache:
+    """
+    LRU + TTL cache of chat responses keyed on the query embedding.
+
+    A lookup hits when cosine similarity to a stored query is at least the
+    threshold. The whole cache is dropped when the collection version changes,
+    and an answer computed under an older version than the cache's is not stored.
+    """
+
+    def __init__(self, threshold: float, ttl_s: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0
+
+    def embed(self, query: str) -> np.ndarray | None:
+        try:
+            return embed_query(query)
+        except Exception as e:
+            print(f"Error embedding query for response cache: {e}")
+            return None
+
+    def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._version_checked_at < RESPONSE_CACHE_VERSION_CHECK_S:
+            return
+        self._version_checked_at = now
+        try:
+            version = get_collection_version()
+        except Exception as e:
+            print(f"Error reading collection version: {e}")
+            return
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+            self._version = version
+
+    @property
+    def version(self):
+        """Collection version the cache currently holds answers for."""
+        return self._version
+
+    def lookup(self, embedding: np.ndarray) -> dict | None:
+        self._check_version()
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if now - e.created_at > self.ttl_s]
+            for key in expired:
+                del self._entries[key]
+
+            if not self._entries:
+                self.misses += 1
+                return None
+            keys = list(self._entries)
+            matrix = np.stack([self._entries[k].embedding for k in keys])
+            scores = matrix @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            best_key = keys[best]
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key].response
+
+    def store(self, query: str, embedding: np.ndarray, response: dict, version) -> None:
+        """
+        Store an answer computed under `version`, unless a lookup has seen the
+        collection move on since. A bump nobody has polled yet clears it later.
+        """
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[self._next_key] = _Entry(query, embedding, response, time.monotonic())
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_saved(self, ms: int) -> None:
+        with self._lock:
+            self.saved_ms += max(ms, 0)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_ms_total": self.saved_ms,
+            }
+
+
+response_cache = SemanticResponseCache(
+    threshold=RESPONSE_CACHE_THRESHOLD,
+    ttl_s=RESPONSE_CACHE_TTL_S,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+)
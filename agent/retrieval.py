@@ -0,0 +1,267 @@
+import os
+import re
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from .batching import QueryBatcher
+from .bm25 import bm25_index
+from .chroma_setup import get_collection
+from .metrics import timed
+
+# One query per turn fetches enough results for every caller
+SHARED_TOP_K = int(os.getenv("RETRIEVAL_SHARED_TOP_K", "5"))
+# Token-set Jaccard similarity above which a later query reuses the shared result
+REUSE_THRESHOLD = float(os.getenv("RETRIEVAL_REUSE_THRESHOLD", "0.8"))
+# "vector", "lexical" (BM25) or "hybrid" (both, fused with reciprocal-rank fusion).
+# Lexical and hybrid fall back to vector search until ingestion has built the BM25 index.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Candidates taken from each retriever before fusion
+FUSION_DEPTH = int(os.getenv("RETRIEVAL_FUSION_DEPTH", "20"))
+RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+# Re-order fused candidates by local MiniLM similarity to the query
+RERANK_ENABLED = os.getenv("RETRIEVAL_RERANK", "false").lower() == "true"
+# Vector queries from concurrent requests arriving within this window go to the
+# collection as one call (or sooner, once BATCH_MAX_QUERIES texts are waiting).
+# Off by default: every lone query would pay the whole window
+BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "0"))
+BATCH_MAX_QUERIES = int(os.getenv("RETRIEVAL_BATCH_MAX", "16"))
+
+# Every result also carries "vector_distances": the vector search distance of each
+# chunk, None for chunks only BM25 found. "distances" is the retriever's own scale.
+_EMPTY = {"ids": [], "documents": [], "metadatas": [], "distances": [], "vector_distances": []}
+# Vector queries wait on the network; lexical search runs alongside on the caller's thread
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_WORKERS", "8")))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _normalize(query: str) -> frozenset[str]:
+    return frozenset(_WORD_RE.findall(query.lower()))
+
+
+def _similar(a: frozenset[str], b: frozenset[str]) -> bool:
+    if a == b:
+        return True
+    if not a or not b:
+        return False
+    return len(a & b) / len(a | b) >= REUSE_THRESHOLD
+
+
+@timed("retrieval.vector")
+def _collection_query(queries: list[str], n_results: int, where: dict | None = None) -> list[dict]:
+    """One collection.query round-trip for every query text."""
+    results = get_collection().query(
+        query_texts=queries,
+        n_results=n_results,
+        where=where,
+        include=["documents", "metadatas", "distances"],
+    )
+    if not results or not results["documents"]:
+        return [dict(_EMPTY) for _ in queries]
+    return [
+        {
+            "ids": results["ids"][i],
+            "documents": results["documents"][i],
+            "metadatas": results["metadatas"][i],
+            "distances": results["distances"][i],
+            "vector_distances": results["distances"][i],
+        }
+        for i in range(len(queries))
+    ]
+
+
+_batcher = QueryBatcher(_collection_query, BATCH_WINDOW_MS / 1000, BATCH_MAX_QUERIES) if BATCH_WINDOW_MS > 0 else None
+
+
+def _vector_query_many(queries: list[str], n_results: int, where: dict | None = None) -> list[dict]:
+    if _batcher is None:
+        return _collection_query(queries, n_results, where)
+    return _batcher.query(queries, n_results, where)
+
+
+@timed("retrieval.lexical")
+def _lexical_query(index, query: str, n_results: int, where: dict | None = None) -> dict:
+    rows, scores = index.search(query, n_results, where)
+    top = scores[0] if scores else 1.0
+    return {
+        **index.rows(rows),
+        # BM25 scores are unbounded; report distance relative to the best hit
+        "distances": [1 - score / top for score in scores],
+        "vector_distances": [None] * len(scores),
+    }
+
+
+def fuse(result_lists: list[dict], n_results: int, k: int = RRF_K) -> dict:
+    """
+    Reciprocal-rank fusion. Distances are 1 - the fused score normalised by the
+    best possible score (rank 1 in every list), so they stay in [0, 1).
+    """
+    scores, rows, vector_distances = {}, {}, {}
+    for results in result_lists:
+        for rank, doc_id in enumerate(results["ids"], start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (k + rank)
+            rows.setdefault(doc_id, (results["documents"][rank - 1], results["metadatas"][rank - 1]))
+            if results["vector_distances"][rank - 1] is not None:
+                vector_distances.setdefault(doc_id, results["vector_distances"][rank - 1])
+    best = sorted(scores, key=scores.get, reverse=True)[:n_results]
+    max_score = len(result_lists) / (k + 1)
+    return {
+        "ids": best,
+        "documents": [rows[doc_id][0] for doc_id in best],
+        "metadatas": [rows[doc_id][1] for doc_id in best],
+        "distances": [1 - scores[doc_id] / max_score for doc_id in best],
+        "vector_distances": [vector_distances.get(doc_id) for doc_id in best],
+    }
+
+
+@timed("retrieval.rerank")
+def rerank(query: str, results: dict) -> dict:
+    """Order candidates by cosine similarity of local query and document embeddings."""
+    if not results["ids"]:
+        return results
+    from .embeddings import embed_query, embed_texts
+
+    similarities = embed_texts(results["documents"]) @ embed_query(query)
+    order = sorted(range(len(results["ids"])), key=lambda i: -similarities[i])
+    reranked = {key: [values[i] for i in order] for key, values in results.items()}
+    reranked["distances"] = [float(1 - similarities[i]) for i in order]
+    return reranked
+
+
+def top_vector_distance(query: str, results: dict) -> float | None:
+    """
+    Vector distance of the top result: from the vector search when it found the
+    chunk, else from local embeddings of the query and chunk (the reranker's measure).
+    """
+    if not results["ids"]:
+        return None
+    if results["vector_distances"][0] is not None:
+        return results["vector_distances"][0]
+    from .embeddings import embed_query, embed_texts
+
+    return float(1 - embed_texts(results["documents"][:1])[0] @ embed_query(query))
+
+
+def _query_collection_many(queries: list[str], n_results: int, mode: str | None = None,
+                           rerank_results: bool | None = None, where: dict | None = None) -> list[dict]:
+    mode = mode or RETRIEVAL_MODE
+    if mode not in ("lexical", "hybrid"):
+        return _vector_query_many(queries, n_results, where)
+    with bm25_index() as index:
+        if index is None or not len(index):
+            return _vector_query_many(queries, n_results, where)
+        return _lexical_or_hybrid(index, queries, n_results, mode, rerank_results, where)
+
+
+def _lexical_or_hybrid(index, queries: list[str], n_results: int, mode: str,
+                       rerank_results: bool | None, where: dict | None) -> list[dict]:
+    if mode == "lexical":
+        return [_lexical_query(index, query, n_results, where) for query in queries]
+
+    depth = max(n_results, FUSION_DEPTH)
+    # The executor doesn't carry ContextVars; copy them so retrieval.vector lands in the turn's stages
+    vector = _executor.submit(contextvars.copy_context().run, _vector_query_many, queries, depth, where)
+    lexical = [_lexical_query(index, query, depth, where) for query in queries]
+    results = []
+    for query, vector_results, lexical_results in zip(queries, vector.result(), lexical):
+        fused = fuse([vector_results, lexical_results], depth)
+        if RERANK_ENABLED if rerank_results is None else rerank_results:
+            fused = rerank(query, fused)
+        results.append(_head(fused, n_results))
+    return results
+
+
+def _query_collection(query: str, n_results: int, mode: str | None = None,
+                      rerank_results: bool | None = None) -> dict:
+    return _query_collection_many([query], n_results, mode, rerank_results)[0]
+
+
+def _head(results: dict, n_results: int) -> dict:
+    return {key: values[:n_results] for key, values in results.items()}
+
+
+class RetrievalTurn:
+    """
+    Retrieval state for a single chat turn.
+
+    The first query runs once at SHARED_TOP_K; later queries in the same turn
+    that match it (exactly or above REUSE_THRESHOLD) are served from that result.
+    Passed to tools through config["configurable"]["retrieval_turn"]; parallel
+    tool calls share it from different threads.
+    """
+
+    def __init__(self):
+        self._shared_terms = None
+        self._shared = None
+        self._lock = threading.Lock()
+        self.injected_ids: set[str] = set()
+        # The context retrieved before the turn, and the distance the route was chosen on
+        self.context: dict | None = None
+        self.route_distance: float | None = None
+        self.records: list[dict] = []
+
+    def query(self, query: str, n_results: int, caller: str) -> dict:
+        return self.query_many([query], n_results, caller)[0]
+
+    def query_many(self, queries: list[str], n_results: int, caller: str) -> list[dict]:
+        """Serve what the shared result covers; batch the rest into one round-trip."""
+        terms = [_normalize(query) for query in queries]
+        results: list[dict | None] = [None] * len(queries)
+        with self._lock:
+            for i, query in enumerate(queries):
+                if self._shared is not None and _similar(terms[i], self._shared_terms):
+                    self.records.append({"caller": caller, "query": query, "shared": True})
+                    results[i] = _head(self._shared, n_results)
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            fetched = _query_collection_many([queries[i] for i in pending], max(n_results, SHARED_TOP_K))
+            with self._lock:
+                for i, fetched_results in zip(pending, fetched):
+                    if self._shared is None:
+                        self._shared_terms = terms[i]
+                        self._shared = fetched_results
+                    self.records.append({"caller": caller, "query": queries[i], "shared": False})
+                    results[i] = _head(fetched_results, n_results)
+        return results
+
+
+def retrieve(query: str, n_results: int, caller: str, turn: RetrievalTurn | None = None) -> dict:
+    """Run a top-k query, through the turn's shared result when one is given."""
+    return retrieve_many([query], n_results, caller, turn)[0]
+
+
+def retrieve_many(queries: list[str], n_results: int, caller: str,
+                  turn: RetrievalTurn | None = None, where: dict | None = None) -> list[dict]:
+    """
+    Top-k results for each query from a single batched collection query.
+    Filtered queries bypass the turn's shared (unfiltered) result.
+    """
+    if where is not None:
+        results = _query_collection_many(queries, n_results, where=where)
+        if turn is not None:
+            with turn._lock:
+                turn.records.extend({"caller": caller, "query": query, "shared": False} for query in queries)
+        return results
+    if turn is None:
+        return _query_collection_many(queries, n_results)
+    return turn.query_many(queries, n_results, caller)
+
+
+@timed("retrieval.fetch")
+def fetch_chunks(ids: list[str]) -> dict:
+    """Documents and metadata for ids, in the given order; served from the local BM25 copy when present."""
+    with bm25_index() as index:
+        found = index.get(ids) if index is not None else {}
+    missing = [doc_id for doc_id in ids if doc_id not in found]
+    if missing:
+        results = get_collection().get(ids=missing, include=["documents", "metadatas"])
+        for doc_id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+            found[doc_id] = (doc, meta)
+    ordered = [doc_id for doc_id in ids if doc_id in found]
+    return {
+        "ids": ordered,
+        "documents": [found[doc_id][0] for doc_id in ordered],
+        "metadatas": [found[doc_id][1] for doc_id in ordered],
+    }
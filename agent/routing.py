@@ -0,0 +1,88 @@
+"""
+Routing between the single-shot fast path and the ReAct agent loop.
+
+The context retrieved before every turn already carries distances. When the
+best chunk's vector distance to the question is small enough, the answer comes from one direct LLM call over
+that context, with no tool definitions and no chance of a second retrieval.
+Otherwise the turn goes through the agent, which may call search tools.
+"""
+import os
+import threading
+
+from .retrieval import RetrievalTurn, top_vector_distance
+from .response_cache import is_history_independent
+
+# Off until benchmarks/retrieval_eval.py has measured the threshold's precision
+# on this corpus
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "false").lower() == "true"
+# Compared with the vector distance of the top context chunk in every retrieval
+# mode; RRF and BM25 distances are rank-relative and say nothing about relevance
+FAST_PATH_MAX_DISTANCE = float(os.getenv("FAST_PATH_MAX_DISTANCE", "0.35"))
+
+
+def choose_route(user_input: str, turn: RetrievalTurn) -> str:
+    """ "fast" when the pre-retrieved context confidently covers a self-contained question, else "agent"."""
+    if not FAST_PATH_ENABLED or not turn.context or not turn.context["ids"]:
+        return "agent"
+    # Questions that point back at earlier turns retrieve poorly on their own words
+    if not is_history_independent(user_input):
+        return "agent"
+    turn.route_distance = top_vector_distance(user_input, turn.context)
+    return "fast" if turn.route_distance <= FAST_PATH_MAX_DISTANCE else "agent"
+
+
+def turn_tokens(messages: list) -> int | None:
+    """Total tokens reported by the model for these AI messages; None if none reported usage."""
+    usages = [m.usage_metadata for m in messages if getattr(m, "usage_metadata", None)]
+    return sum(u.get("total_tokens", 0) for u in usages) if usages else None
+
+
+class RouteStats:
+    """Per-route turn counts, latency and token totals, for /stats and per-turn savings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {route: {"turns": 0, "total_ms": 0, "token_turns": 0, "tokens": 0}
+                        for route in ("fast", "agent")}
+        self.tokens_saved = 0
+
+    def _avg_tokens(self, route: str) -> float | None:
+        stats = self._routes[route]
+        return stats["tokens"] / stats["token_turns"] if stats["token_turns"] else None
+
+    def record(self, route: str, response_time_ms: int, tokens: int | None) -> int | None:
+        """Record a turn; for fast turns, returns tokens saved against the average agent turn."""
+        with self._lock:
+            stats = self._routes[route]
+            stats["turns"] += 1
+            stats["total_ms"] += response_time_ms
+            if tokens is not None:
+                stats["token_turns"] += 1
+                stats["tokens"] += tokens
+            agent_avg = self._avg_tokens("agent")
+            if route != "fast" or tokens is None or agent_avg is None:
+                return None
+            saved = max(int(agent_avg - tokens), 0)
+            self.tokens_saved += saved
+            return saved
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            turns = sum(stats["turns"] for stats in self._routes.values())
+            return {
+                "enabled": FAST_PATH_ENABLED,
+                "max_distance": FAST_PATH_MAX_DISTANCE,
+                "fast_path_rate": round(self._routes["fast"]["turns"] / turns, 4) if turns else 0.0,
+                "tokens_saved_total": self.tokens_saved,
+                **{
+                    route: {
+                        "turns": stats["turns"],
+                        "avg_ms": round(stats["total_ms"] / stats["turns"], 1) if stats["turns"] else None,
+                        "avg_tokens": round(self._avg_tokens(route), 1) if stats["token_turns"] else None,
+                    }
+                    for route, stats in self._routes.items()
+                },
+            }
+
+
+route_stats = RouteStats()
@@ -1,54 +1,195 @@
 from langchain_core.tools import tool
-from .chroma_setup import collection
+from langchain_core.runnables import RunnableConfig
+from .retrieval import retrieve_many, fetch_chunks
+from .policy_catalog import get_catalog
+from .metrics import span
+
+
+# Upper bound on queries per call, so one tool call stays one modest batch
+MAX_QUERIES = 5
+# Upper bound on chunks read either side of a chunk by read_adjacent_chunks
+MAX_ADJACENT = 3
 
 
 @tool
-def search_policies(query: str) -> str:
+def search_policies(queries: list[str], config: RunnableConfig) -> str:
     """
     Search across all policies using semantic similarity.
-    Given a topic or question, return the most relevant policy excerpts
-    with their titles and relevance scores.
-    Use this when the specific policy is not known.
+    Given one or more topics or questions, return the most relevant policy
+    excerpts with their titles and vector distances (lower is closer).
+    Use this when the specific policy is not known. For a question with several
+    aspects, pass one query per aspect in a single call rather than calling
+    this tool repeatedly.
 
     Args:
-        query: The topic or question to search for in the policy database.
+        queries: Topics or questions to search for in the policy database (up to 5).
 
     Returns:
         A formatted string containing the top matching policy excerpts,
-        their titles, and relevance scores.
+        their titles, and vector distances, without duplicates across queries.
     """
-    try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=5,
-            include=["documents", "metadatas", "distances"]
+    with span("tool.search_policies"):
+        return _search_policies(queries, config)
+
+
+def _merge_results(queries: list[str], batch: list[dict]) -> list[dict]:
+    """Dedupe chunks returned for several queries, keeping each at its best distance."""
+    merged = {}
+    for query, results in zip(queries, batch):
+        for doc_id, doc, meta, distance, vector_distance in zip(
+            results["ids"], results["documents"], results["metadatas"], results["distances"],
+            results["vector_distances"],
+        ):
+            entry = merged.get(doc_id)
+            if entry is None:
+                merged[doc_id] = {"id": doc_id, "document": doc, "metadata": meta, "distance": distance,
+                                  "vector_distance": vector_distance, "queries": [query]}
+            else:
+                entry["distance"] = min(entry["distance"], distance)
+                if entry["vector_distance"] is None or (
+                    vector_distance is not None and vector_distance < entry["vector_distance"]
+                ):
+                    entry["vector_distance"] = vector_distance
+                entry["queries"].append(query)
+    return sorted(merged.values(), key=lambda entry: entry["distance"])
+
+
+def _clean_queries(queries: list[str]) -> list[str]:
+    if isinstance(queries, str):
+        queries = [queries]
+    return list(dict.fromkeys(q for q in queries if q.strip()))[:MAX_QUERIES]
+
+
+def _format_results(queries: list[str], merged: list[dict], injected_ids: set[str]) -> str:
+    output_parts = []
+    for i, entry in enumerate(merged, start=1):
+        doc, meta = entry["document"], entry["metadata"]
+        # The retriever's own distance is rank-relative in hybrid and lexical
+        # mode; only the vector search distance says how close the chunk is
+        if entry["vector_distance"] is None:
+            vector_distance = "n/a (keyword match only)"
+        else:
+            vector_distance = round(entry["vector_distance"], 3)
+        policy_name = meta.get("policy_name", "Unknown Policy")
+        source = meta.get("source", "Unknown Source")
+
+        # Excerpts already injected into the prompt this turn are referenced, not repeated
+        if entry["id"] in injected_ids:
+            excerpt = " already provided in the context above."
+        else:
+            excerpt = f"\n{doc[:500]}{'...' if len(doc) > 500 else ''}"
+
+        matched = f"Matched: {'; '.join(entry['queries'])}\n" if len(queries) > 1 else ""
+        output_parts.append(
+            f"**Result {i}**\n"
+            f"Policy: {policy_name}\n"
+            f"Source: {source}\n"
+            f"Id: {entry['id']}\n"
+            f"Vector distance: {vector_distance}\n"
+            f"{matched}"
+            f"Excerpt:{excerpt}\n"
         )
+    return "\n---\n".join(output_parts)
+
+
+def _search_policies(queries: list[str], config: RunnableConfig) -> str:
+    try:
+        queries = _clean_queries(queries)
+        if not queries:
+            return "No query given."
+        turn = config.get("configurable", {}).get("retrieval_turn")
+        batch = retrieve_many(queries, n_results=5, caller="search_policies", turn=turn)
+        merged = _merge_results(queries, batch)
 
-        if not results or not results["documents"] or not results["documents"][0]:
+        if not merged:
             return "No relevant policies found for your query."
 
-        output_parts = []
-        for i, (doc, meta, distance) in enumerate(
-            zip(
-                results["documents"][0],
-                results["metadatas"][0],
-                results["distances"][0]
-            ),
-            start=1
-        ):
-            relevance_score = round(1 - distance, 3)
-            policy_name = meta.get("policy_name", "Unknown Policy")
-            source = meta.get("source", "Unknown Source")
-
-            output_parts.append(
-                f"**Result {i}**\n"
-                f"Policy: {policy_name}\n"
-                f"Source: {source}\n"
-                f"Relevance: {relevance_score}\n"
-                f"Excerpt:\n{doc[:500]}{'...' if len(doc) > 500 else ''}\n"
-            )
-        print("search_policies: Tool Used")
-        return "\n---\n".join(output_parts)
+        print(f"search_policies: Tool Used ({len(queries)} queries)")
+        return _format_results(queries, merged, turn.injected_ids if turn else set())
 
     except Exception as e:
         return f"Error searching policies: {e}"
+
+
+@tool
+def search_within_policy(policy_name: str, queries: list[str], config: RunnableConfig) -> str:
+    """
+    Search inside one named policy only.
+    Use this when the user names a policy (e.g. "the FERPA policy" or
+    "Academic Integrity Policy"): results come only from that policy's text,
+    so unrelated policies cannot crowd out the relevant passages.
+
+    Args:
+        policy_name: The policy's title, a shortened title or its acronym.
+        queries: Topics or questions to search for within that policy (up to 5).
+
+    Returns:
+        The top matching excerpts from that policy, or the closest known
+        policy titles if the name was not recognised.
+    """
+    with span("tool.search_within_policy"):
+        return _search_within_policy(policy_name, queries, config)
+
+
+def _search_within_policy(policy_name: str, queries: list[str], config: RunnableConfig) -> str:
+    try:
+        catalog = get_catalog()
+        if catalog is None:
+            return "The policy catalog has not been built yet; use search_policies instead."
+        names = catalog.resolve(policy_name)
+        if not names:
+            return (f"No policy named '{policy_name}' was found. "
+                    f"Use search_policies, or one of these titles: {'; '.join(catalog.names()[:20])}")
+        queries = _clean_queries(queries) or [policy_name]
+        where = {"policy_name": names[0]} if len(names) == 1 else {"policy_name": {"$in": names}}
+        turn = config.get("configurable", {}).get("retrieval_turn")
+        batch = retrieve_many(queries, n_results=5, caller="search_within_policy", turn=turn, where=where)
+        merged = _merge_results(queries, batch)
+
+        if not merged:
+            return f"No matching passages found in {'; '.join(names)}."
+
+        print(f"search_within_policy: Tool Used ({names[0]}, {len(queries)} queries)")
+        return _format_results(queries, merged, turn.injected_ids if turn else set())
+
+    except Exception as e:
+        return f"Error searching policy: {e}"
+
+
+@tool
+def read_adjacent_chunks(chunk_id: str, before: int = 1, after: int = 1) -> str:
+    """
+    Read the text just before and after a search result, in document order.
+    Use this when an excerpt is cut off or refers to the surrounding section;
+    it is much cheaper than another search.
+
+    Args:
+        chunk_id: The "Id" of a result returned by search_policies or search_within_policy.
+        before: Number of preceding chunks to include (up to 3).
+        after: Number of following chunks to include (up to 3).
+
+    Returns:
+        The full text of the chunk and its neighbours, labelled by Id.
+    """
+    with span("tool.read_adjacent_chunks"):
+        try:
+            catalog = get_catalog()
+            if catalog is None:
+                return "The policy catalog has not been built yet."
+            before = max(0, min(int(before), MAX_ADJACENT))
+            after = max(0, min(int(after), MAX_ADJACENT))
+            ids = catalog.neighbors(chunk_id, before, after)
+            if not ids:
+                return f"Unknown chunk id '{chunk_id}'."
+            chunks = fetch_chunks(ids)
+            policy_name = catalog.policy_of(chunk_id)
+
+            output_parts = [
+                f"Id: {doc_id}{' (requested)' if doc_id == chunk_id else ''}\n{doc}"
+                for doc_id, doc in zip(chunks["ids"], chunks["documents"])
+            ]
+            print(f"read_adjacent_chunks: Tool Used ({len(ids)} chunks)")
+            return f"Policy: {policy_name}\n\n" + "\n---\n".join(output_parts)
+
+        except Exception as e:
+            return f"Error reading chunks: {e}"
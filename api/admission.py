@@ -0,0 +1,82 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "200"))
+# How long a request may wait for a slot before it is turned away
+CHAT_QUEUE_TIMEOUT_S = float(os.getenv("CHAT_QUEUE_TIMEOUT_S", "15"))
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after_s: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a bounded FIFO wait queue.
+
+    acquire() either returns once a slot is free or raises Overloaded when the
+    queue is full or the wait exceeds queue_timeout_s. Retry-After is estimated
+    from the recent service time and the number of requests ahead.
+    """
+
+    def __init__(self, max_concurrency: int = CHAT_MAX_CONCURRENCY, max_queue: int = CHAT_MAX_QUEUE,
+                 queue_timeout_s: float = CHAT_QUEUE_TIMEOUT_S):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+        self._service_times = deque(maxlen=100)
+        self._wait_times = deque(maxlen=1000)
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "rate_limited": 0}
+
+    def retry_after_s(self) -> int:
+        service_s = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        return max(1, round(service_s * (self._waiting + 1) / self.max_concurrency))
+
+    def queue_full(self) -> bool:
+        return self._semaphore.locked() and self._waiting >= self.max_queue
+
+    async def acquire(self) -> float:
+        """Wait for a slot. Returns the admission time to pass back to release()."""
+        if self.queue_full():
+            self.stats["rejected_queue_full"] += 1
+            raise Overloaded("queue full", self.retry_after_s())
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self.stats["rejected_timeout"] += 1
+            raise Overloaded("queue timeout", self.retry_after_s())
+        finally:
+            self._waiting -= 1
+        admitted_at = time.monotonic()
+        self._wait_times.append(admitted_at - start)
+        self._in_flight += 1
+        self.stats["admitted"] += 1
+        return admitted_at
+
+    def release(self, admitted_at: float) -> None:
+        self._service_times.append(time.monotonic() - admitted_at)
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        waits = sorted(self._wait_times)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queue_depth": self._waiting,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p99_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 1) if waits else 0.0,
+            **self.stats,
+        }
@@ -1,31 +1,331 @@
-import os
-from typing import Optional, List
-from psycopg_pool import ConnectionPool
-from dotenv import load_dotenv
-from pathlib import Path
+import json
+import base64
+import hashlib
+from datetime import datetime
+from typing import AsyncIterator, Optional, List
 
-load_dotenv(Path(__file__).parent.parent / "agent" / ".env")
+from agent.db import get_async_pool
+from agent.metrics import span, timed
+from .transcript_cache import transcript_cache
 
-SUPABASE_DB_URL = os.getenv("SUPABASE_DB_URL")
-pool = ConnectionPool(conninfo=SUPABASE_DB_URL, max_size=5)
+# The pool is shared with the agent (agent/db.py) and opened in the API lifespan
 
 
-class ChatDBService:
+CREATE_CHAT_SQL = """
+    INSERT INTO chats (id, title, created_at, updated_at)
+    VALUES (%s, %s, NOW(), NOW())
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        updated_at = NOW()
+"""
+
+# Every insert or edit bumps the chat's message_version, which feeds its ETag
+SAVE_MESSAGE_SQL = """
+    WITH saved AS (
+    INSERT INTO messages (
+        id, chat_id, role, content, response_time_ms,
+        context_used, tool_calls, error_occurred, error_type
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (id) DO UPDATE SET
+        content = EXCLUDED.content,
+        response_time_ms = EXCLUDED.response_time_ms,
+        context_used = EXCLUDED.context_used,
+        tool_calls = EXCLUDED.tool_calls,
+        error_occurred = EXCLUDED.error_occurred,
+        error_type = EXCLUDED.error_type,
+        updated_at = NOW()
+    RETURNING chat_id
+    )
+    UPDATE chats SET message_version = message_version + 1
+    WHERE id IN (SELECT chat_id FROM saved)
+"""
+
+_MESSAGE_JSON = """
+    json_build_object(
+        'id', m.id, 'role', m.role, 'content', m.content,
+        'response_time_ms', m.response_time_ms, 'context_used', m.context_used,
+        'tool_calls', m.tool_calls, 'error_occurred', m.error_occurred,
+        'error_type', m.error_type, 'created_at', m.created_at
+    )
+"""
+
+# One round-trip per page: chats plus (optionally) every message as a JSON array.
+# Keyset on (updated_at, id) so deep pages cost the same as the first.
+SELECT_CHATS_PAGE_SQL = """
+    SELECT c.id, c.title, c.created_at, c.updated_at, {messages}
+    FROM chats c
+    WHERE %(cursor_ts)s::timestamp IS NULL OR (c.updated_at, c.id) < (%(cursor_ts)s::timestamp, %(cursor_id)s)
+    ORDER BY c.updated_at DESC, c.id DESC
+    LIMIT %(limit)s
+"""
+
+_CHAT_MESSAGES_SUBQUERY = f"""
+    (SELECT COALESCE(json_agg({_MESSAGE_JSON} ORDER BY m.created_at, m.id), '[]'::json)
+     FROM messages m WHERE m.chat_id = c.id)
+"""
+
+# Just enough to build the ETags, so a 304 never reads a message
+SELECT_CHATS_VERSIONS_SQL = """
+    SELECT c.id, c.updated_at, c.message_version
+    FROM chats c
+    WHERE %(cursor_ts)s::timestamp IS NULL OR (c.updated_at, c.id) < (%(cursor_ts)s::timestamp, %(cursor_id)s)
+    ORDER BY c.updated_at DESC, c.id DESC
+    LIMIT %(limit)s
+"""
+
+SELECT_CHAT_VERSION_SQL = "SELECT updated_at, message_version FROM chats WHERE id = %s"
+
+SELECT_CHAT_SQL = """
+    SELECT id, title, created_at, updated_at
+    FROM chats WHERE id = %s
+"""
+
+SELECT_MESSAGES_PAGE_SQL = """
+    SELECT id, role, content, response_time_ms, context_used,
+           tool_calls, error_occurred, error_type, created_at
+    FROM messages
+    WHERE chat_id = %(chat_id)s
+      AND (%(cursor_ts)s::timestamp IS NULL OR (created_at, id) > (%(cursor_ts)s::timestamp, %(cursor_id)s))
+    ORDER BY created_at ASC, id ASC
+    LIMIT %(limit)s
+"""
+
+# Chats whose messages or title match a websearch-style query, best first. Each
+# chat is ranked by its best message (plus a bonus for a title match); snippets
+# are built only for the page being returned, since ts_headline re-parses text.
+SEARCH_CHATS_SQL = """
+    WITH q AS (SELECT websearch_to_tsquery('english', %(query)s) AS query),
+    message_hits AS (
+        SELECT DISTINCT ON (m.chat_id) m.chat_id, m.id AS message_id, m.content,
+               ts_rank(m.content_tsv, q.query)::float8 AS rank
+        FROM messages m, q
+        WHERE m.content_tsv @@ q.query
+        ORDER BY m.chat_id, rank DESC, m.created_at DESC
+    ),
+    title_hits AS (
+        SELECT c.id AS chat_id
+        FROM chats c, q
+        WHERE to_tsvector('english', c.title) @@ q.query
+    ),
+    hits AS (
+        SELECT c.id, c.title, c.updated_at, h.message_id, h.content,
+               (COALESCE(h.rank, 0) + CASE WHEN t.chat_id IS NULL THEN 0 ELSE %(title_weight)s END)::float8 AS rank,
+               t.chat_id IS NOT NULL AS title_match
+        FROM message_hits h
+        FULL JOIN title_hits t ON t.chat_id = h.chat_id
+        JOIN chats c ON c.id = COALESCE(h.chat_id, t.chat_id)
+    ),
+    page AS (
+        SELECT * FROM hits
+        WHERE %(cursor_rank)s::float8 IS NULL OR (rank, id) < (%(cursor_rank)s::float8, %(cursor_id)s)
+        ORDER BY rank DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT p.id, p.title, p.updated_at, p.rank, p.title_match, p.message_id,
+           CASE WHEN p.message_id IS NOT NULL THEN
+               ts_headline('english', p.content, q.query, %(headline_options)s)
+           END
+    FROM page p, q
+    ORDER BY p.rank DESC, p.id DESC
+"""
+
+# Added to a chat's rank when its title matches; ts_rank scores are mostly well below 1
+SEARCH_TITLE_WEIGHT = 1.0
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2"
+
+# Every matching message with its chat's title, in transcript order (walks
+# idx_messages_chat_created_id). Read through a named server-side cursor, so the
+# client holds one fetch of rows at a time.
+EXPORT_MESSAGES_SQL = """
+    SELECT m.chat_id, c.title, m.id, m.role, m.content, m.response_time_ms, m.context_used,
+           m.tool_calls, m.error_occurred, m.error_type, m.created_at
+    FROM messages m
+    JOIN chats c ON c.id = m.chat_id
+    WHERE (%(chat_ids)s::text[] IS NULL OR m.chat_id = ANY(%(chat_ids)s::text[]))
+      AND (%(since)s::timestamp IS NULL OR m.created_at >= %(since)s::timestamp)
+      AND (%(until)s::timestamp IS NULL OR m.created_at < %(until)s::timestamp)
+    ORDER BY m.chat_id, m.created_at, m.id
+"""
+
+UPDATE_CHAT_TITLE_SQL = """
+    UPDATE chats SET title = %s, updated_at = NOW() WHERE id = %s
+"""
+
+DELETE_CHAT_SQL = "DELETE FROM chats WHERE id = %s"
+
+
+def chat_etag(updated_at, message_version: int) -> str:
+    return f'W/"{message_version}-{_iso(updated_at)}"'
+
+
+def chats_page_etag(rows, include_messages: bool) -> str:
+    """ETag of a /chats page from its (id, updated_at, message_version) rows."""
+    digest = hashlib.sha1(str(include_messages).encode())
+    for chat_id, updated_at, message_version in rows:
+        versions = f"{message_version}" if include_messages else ""
+        digest.update(f"|{chat_id}:{_iso(updated_at)}:{versions}".encode())
+    return f'W/"{digest.hexdigest()[:20]}"'
+
+
+def _message_params(
+    message_id: str,
+    chat_id: str,
+    role: str,
+    content: str,
+    response_time_ms: Optional[int],
+    context_used: Optional[bool],
+    tool_calls: Optional[List[str]],
+    error_occurred: bool,
+    error_type: Optional[str],
+) -> tuple:
+    tool_calls_str = ",".join(tool_calls) if tool_calls else None
+    return (
+        message_id, chat_id, role, content, response_time_ms,
+        context_used, tool_calls_str, error_occurred, error_type
+    )
+
+
+def encode_cursor(ts, row_id: str) -> str:
+    """Opaque keyset cursor for a (timestamp, id) position."""
+    raw = json.dumps([ts.isoformat() if hasattr(ts, "isoformat") else ts, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+    if not cursor:
+        return None, None
+    try:
+        ts, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return ts, row_id
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def _iso(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _message_from_row(row) -> dict:
+    tool_calls = row[5].split(",") if row[5] else []
+    return {
+        "id": row[0],
+        "role": row[1],
+        "content": row[2],
+        "metadata": {
+            "response_time_ms": row[3],
+            "context_used": row[4],
+            "tool_calls": tool_calls if tool_calls else None,
+            "error_occurred": row[6],
+            "error_type": row[7],
+        },
+        "created_at": _iso(row[8]),
+    }
+
+
+_MESSAGE_JSON_FIELDS = (
+    "id", "role", "content", "response_time_ms", "context_used",
+    "tool_calls", "error_occurred", "error_type", "created_at",
+)
+
+
+def _message_from_json(m: dict) -> dict:
+    return _message_from_row([m[field] for field in _MESSAGE_JSON_FIELDS])
+
+
+def _chat_from_row(row, messages: Optional[List[dict]]) -> dict:
+    chat = {
+        "id": row[0],
+        "title": row[1],
+        "created_at": _iso(row[2]),
+        "updated_at": _iso(row[3]),
+    }
+    if messages is not None:
+        chat["messages"] = messages
+    return chat
+
+
+def _chats_page_query(limit: Optional[int], cursor: Optional[str], include_messages: bool) -> tuple[str, dict]:
+    cursor_ts, cursor_id = decode_cursor(cursor)
+    sql = SELECT_CHATS_PAGE_SQL.format(
+        messages=_CHAT_MESSAGES_SUBQUERY if include_messages else "NULL"
+    )
+    return sql, {"cursor_ts": cursor_ts, "cursor_id": cursor_id, "limit": limit}
+
+
+def _chats_page(rows, limit: Optional[int], include_messages: bool) -> tuple[List[dict], Optional[str]]:
+    chats = [
+        _chat_from_row(row, [_message_from_json(m) for m in row[4]] if include_messages else None)
+        for row in rows
+    ]
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+    return chats, next_cursor
+
+
+def _messages_page_params(chat_id: str, limit: Optional[int], cursor: Optional[str]) -> dict:
+    cursor_ts, cursor_id = decode_cursor(cursor)
+    return {"chat_id": chat_id, "cursor_ts": cursor_ts, "cursor_id": cursor_id, "limit": limit}
+
+
+def _messages_page(rows, limit: Optional[int]) -> tuple[List[dict], Optional[str]]:
+    messages = [_message_from_row(m) for m in rows]
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1][8], rows[-1][0])
+    return messages, next_cursor
+
+
+def _search_params(query: str, limit: int, cursor: Optional[str]) -> dict:
+    cursor_rank, cursor_id = decode_cursor(cursor)
+    if cursor_rank is not None and not isinstance(cursor_rank, (int, float)):
+        raise ValueError("Invalid cursor")
+    return {
+        "query": query, "limit": limit, "cursor_rank": cursor_rank, "cursor_id": cursor_id,
+        "title_weight": SEARCH_TITLE_WEIGHT, "headline_options": SEARCH_HEADLINE_OPTIONS,
+    }
+
+
+def _search_page(rows, limit: int) -> tuple[List[dict], Optional[str]]:
+    results = [
+        {
+            "chat_id": row[0],
+            "title": row[1],
+            "updated_at": _iso(row[2]),
+            "rank": round(row[3], 4),
+            "title_match": row[4],
+            "message_id": row[5],
+            "snippet": row[6],
+        }
+        for row in rows
+    ]
+    # Keyset on the exact float8 rank, so the cursor compares equal on the next page
+    next_cursor = encode_cursor(rows[-1][3], rows[-1][0]) if len(rows) == limit else None
+    return results, next_cursor
+
+
+def _export_params(chat_ids: Optional[List[str]], since: Optional[datetime], until: Optional[datetime]) -> dict:
+    return {"chat_ids": chat_ids or None, "since": since, "until": until}
+
+
+class AsyncChatDBService:
+    """Chat, message and search queries on the shared AsyncConnectionPool."""
+
     @staticmethod
-    def create_chat(chat_id: str, title: str) -> None:
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO chats (id, title, created_at, updated_at)
-                    VALUES (%s, %s, NOW(), NOW())
-                    ON CONFLICT (id) DO UPDATE SET
-                        title = EXCLUDED.title,
-                        updated_at = NOW()
-                """, (chat_id, title))
-            conn.commit()
+    @timed("db.create_chat")
+    async def create_chat(chat_id: str, title: str) -> None:
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(CREATE_CHAT_SQL, (chat_id, title))
+            await conn.commit()
+        transcript_cache.invalidate(chat_id)
 
     @staticmethod
-    def save_message(
+    @timed("db.save_message")
+    async def save_message(
         message_id: str,
         chat_id: str,
         role: str,
@@ -36,130 +336,123 @@ class ChatDBService:
         error_occurred: bool = False,
         error_type: Optional[str] = None
     ) -> None:
-        tool_calls_str = ",".join(tool_calls) if tool_calls else None
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO messages (
-                        id, chat_id, role, content, response_time_ms,
-                        context_used, tool_calls, error_occurred, error_type
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        content = EXCLUDED.content,
-                        response_time_ms = EXCLUDED.response_time_ms,
-                        context_used = EXCLUDED.context_used,
-                        tool_calls = EXCLUDED.tool_calls,
-                        error_occurred = EXCLUDED.error_occurred,
-                        error_type = EXCLUDED.error_type
-                """, (
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SAVE_MESSAGE_SQL, _message_params(
                     message_id, chat_id, role, content, response_time_ms,
-                    context_used, tool_calls_str, error_occurred, error_type
+                    context_used, tool_calls, error_occurred, error_type
                 ))
-            conn.commit()
+            await conn.commit()
+        transcript_cache.invalidate(chat_id)
+
+    @staticmethod
+    @timed("db.save_messages")
+    async def save_messages(items: List[dict]) -> None:
+        """Upsert many messages (MessageRequest fields) in one transaction."""
+        params = [
+            _message_params(
+                item["message_id"], item["chat_id"], item["role"], item["content"],
+                item.get("response_time_ms"), item.get("context_used"), item.get("tool_calls"),
+                item.get("error_occurred", False), item.get("error_type"),
+            )
+            for item in items
+        ]
+        async with get_async_pool().connection() as conn, conn.transaction():
+            async with conn.cursor() as cur:
+                await cur.executemany(SAVE_MESSAGE_SQL, params)
+        for chat_id in {item["chat_id"] for item in items}:
+            transcript_cache.invalidate(chat_id)
 
     @staticmethod
-    def get_chats() -> List[dict]:
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, title, created_at, updated_at
-                    FROM chats
-                    ORDER BY updated_at DESC
-                """)
-                chats = []
-                for row in cur.fetchall():
-                    chat_id = row[0]
-                    cur.execute("""
-                        SELECT id, role, content, response_time_ms, context_used,
-                               tool_calls, error_occurred, error_type, created_at
-                        FROM messages
-                        WHERE chat_id = %s
-                        ORDER BY created_at ASC
-                    """, (chat_id,))
-                    
-                    messages = []
-                    for msg_row in cur.fetchall():
-                        tool_calls = msg_row[5].split(",") if msg_row[5] else []
-                        messages.append({
-                            "id": msg_row[0],
-                            "role": msg_row[1],
-                            "content": msg_row[2],
-                            "metadata": {
-                                "response_time_ms": msg_row[3],
-                                "context_used": msg_row[4],
-                                "tool_calls": tool_calls if tool_calls else None,
-                                "error_occurred": msg_row[6],
-                                "error_type": msg_row[7],
-                            },
-                        })
-                    
-                    chats.append({
-                        "id": chat_id,
-                        "title": row[1],
-                        "created_at": row[2].isoformat() if row[2] else None,
-                        "updated_at": row[3].isoformat() if row[3] else None,
-                        "messages": messages,
-                    })
-                return chats
+    @timed("db.get_chats")
+    async def get_chats(
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        include_messages: bool = True,
+    ) -> tuple[List[dict], Optional[str]]:
+        sql, params = _chats_page_query(limit, cursor, include_messages)
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                return _chats_page(await cur.fetchall(), limit, include_messages)
 
     @staticmethod
-    def get_chat_with_messages(chat_id: str) -> Optional[dict]:
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, title, created_at, updated_at
-                    FROM chats WHERE id = %s
-                """, (chat_id,))
-                chat_row = cur.fetchone()
+    @timed("db.get_chat_with_messages")
+    async def get_chat_with_messages(
+        chat_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> tuple[Optional[dict], Optional[str]]:
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT_CHAT_SQL, (chat_id,))
+                chat_row = await cur.fetchone()
                 if not chat_row:
-                    return None
-
-                cur.execute("""
-                    SELECT id, role, content, response_time_ms, context_used,
-                           tool_calls, error_occurred, error_type, created_at
-                    FROM messages
-                    WHERE chat_id = %s
-                    ORDER BY created_at ASC
-                """, (chat_id,))
-
-                messages = []
-                for row in cur.fetchall():
-                    tool_calls = row[5].split(",") if row[5] else []
-                    messages.append({
-                        "id": row[0],
-                        "role": row[1],
-                        "content": row[2],
-                        "metadata": {
-                            "response_time_ms": row[3],
-                            "context_used": row[4],
-                            "tool_calls": tool_calls if tool_calls else None,
-                            "error_occurred": row[6],
-                            "error_type": row[7],
-                        },
-                        "created_at": row[8].isoformat() if row[8] else None,
-                    })
-
-                return {
-                    "id": chat_row[0],
-                    "title": chat_row[1],
-                    "created_at": chat_row[2].isoformat() if chat_row[2] else None,
-                    "updated_at": chat_row[3].isoformat() if chat_row[3] else None,
-                    "messages": messages,
-                }
+                    return None, None
+
+                await cur.execute(SELECT_MESSAGES_PAGE_SQL, _messages_page_params(chat_id, limit, cursor))
+                messages, next_cursor = _messages_page(await cur.fetchall(), limit)
+                return _chat_from_row(chat_row, messages), next_cursor
+
+    @staticmethod
+    @timed("db.get_chats_etag")
+    async def get_chats_etag(limit: Optional[int] = None, cursor: Optional[str] = None, include_messages: bool = True) -> str:
+        cursor_ts, cursor_id = decode_cursor(cursor)
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT_CHATS_VERSIONS_SQL,
+                                  {"cursor_ts": cursor_ts, "cursor_id": cursor_id, "limit": limit})
+                return chats_page_etag(await cur.fetchall(), include_messages)
+
+    @staticmethod
+    @timed("db.get_chat_etag")
+    async def get_chat_etag(chat_id: str) -> Optional[str]:
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT_CHAT_VERSION_SQL, (chat_id,))
+                row = await cur.fetchone()
+                return chat_etag(*row) if row else None
+
+    @staticmethod
+    @timed("db.search_chats")
+    async def search_chats(
+        query: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> tuple[List[dict], Optional[str]]:
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SEARCH_CHATS_SQL, _search_params(query, limit, cursor))
+                return _search_page(await cur.fetchall(), limit)
+
+    @staticmethod
+    async def export_messages(
+        chat_ids: Optional[List[str]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_rows: int = 2000,
+    ) -> AsyncIterator[list[tuple]]:
+        with span("db.export_messages"):
+            async with get_async_pool().connection() as conn, conn.transaction():
+                async with conn.cursor(name="chat_export") as cur:
+                    await cur.execute(EXPORT_MESSAGES_SQL, _export_params(chat_ids, since, until))
+                    while rows := await cur.fetchmany(batch_rows):
+                        yield rows
 
     @staticmethod
-    def update_chat_title(chat_id: str, title: str) -> None:
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE chats SET title = %s, updated_at = NOW() WHERE id = %s
-                """, (title, chat_id))
-            conn.commit()
+    @timed("db.update_chat_title")
+    async def update_chat_title(chat_id: str, title: str) -> None:
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(UPDATE_CHAT_TITLE_SQL, (title, chat_id))
+            await conn.commit()
+        transcript_cache.invalidate(chat_id)
 
     @staticmethod
-    def delete_chat(chat_id: str) -> None:
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
-            conn.commit()
+    @timed("db.delete_chat")
+    async def delete_chat(chat_id: str) -> None:
+        async with get_async_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(DELETE_CHAT_SQL, (chat_id,))
+            await conn.commit()
+        transcript_cache.invalidate(chat_id)
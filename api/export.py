@@ -0,0 +1,156 @@
+"""
+Bulk export of chat messages for GET /chats/export.
+
+Rows arrive from AsyncChatDBService.export_messages in batches of
+EXPORT_FETCH_ROWS and each batch is encoded and sent before the next is
+fetched, so memory stays flat however many messages match. NDJSON is encoded
+with orjson when it is installed. Parquet needs pyarrow and gets one row group
+per batch.
+"""
+import io
+import os
+import csv
+import json
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from .db_service import _iso
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "2000"))
+# Each running export holds a pooled connection until it finishes
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+EXPORT_MAX_CHAT_IDS = 1000
+
+# Order of the EXPORT_MESSAGES_SQL columns
+EXPORT_COLUMNS = (
+    "chat_id", "chat_title", "message_id", "role", "content", "response_time_ms",
+    "context_used", "tool_calls", "error_occurred", "error_type", "created_at",
+)
+_TOOL_CALLS = EXPORT_COLUMNS.index("tool_calls")
+_CREATED_AT = EXPORT_COLUMNS.index("created_at")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def check_format(fmt: str) -> None:
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet export needs pyarrow installed")
+
+
+def export_filename(fmt: str) -> str:
+    return f"chats-export-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.{fmt}"
+
+
+def _tool_calls(value: str | None) -> list[str] | None:
+    return value.split(",") if value else None
+
+
+def _ndjson_lines(rows: list[tuple]) -> bytes:
+    if orjson is not None:
+        # orjson writes naive datetimes as ISO 8601, same as isoformat()
+        return b"".join(
+            orjson.dumps(
+                {**dict(zip(EXPORT_COLUMNS, row)), "tool_calls": _tool_calls(row[_TOOL_CALLS])},
+                option=orjson.OPT_APPEND_NEWLINE,
+            )
+            for row in rows
+        )
+    return "".join(
+        json.dumps(
+            {**dict(zip(EXPORT_COLUMNS, row)), "tool_calls": _tool_calls(row[_TOOL_CALLS]),
+             "created_at": _iso(row[_CREATED_AT])},
+            separators=(",", ":"),
+        ) + "\n"
+        for row in rows
+    ).encode()
+
+
+async def _ndjson(batches: AsyncIterator[list[tuple]]) -> AsyncIterator[bytes]:
+    async for rows in batches:
+        yield _ndjson_lines(rows)
+
+
+async def _csv(batches: AsyncIterator[list[tuple]]) -> AsyncIterator[bytes]:
+    # tool_calls stays comma-separated, as stored
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode()
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(row[:_CREATED_AT] + (_iso(row[_CREATED_AT]),) for row in rows)
+        yield buffer.getvalue().encode()
+
+
+class _DrainedSink(io.RawIOBase):
+    """Write-only file for ParquetWriter whose bytes are taken after each row group; tell() keeps counting."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._written
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("chat_id", pa.string()), ("chat_title", pa.string()), ("message_id", pa.string()),
+        ("role", pa.string()), ("content", pa.string()), ("response_time_ms", pa.int64()),
+        ("context_used", pa.bool_()), ("tool_calls", pa.list_(pa.string())),
+        ("error_occurred", pa.bool_()), ("error_type", pa.string()), ("created_at", pa.timestamp("us")),
+    ])
+
+
+async def _parquet(batches: AsyncIterator[list[tuple]]) -> AsyncIterator[bytes]:
+    schema = _parquet_schema()
+    sink = _DrainedSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        async for rows in batches:
+            columns = [list(column) for column in zip(*rows)]
+            columns[_TOOL_CALLS] = [_tool_calls(value) for value in columns[_TOOL_CALLS]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema,
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    # The footer, written by close()
+    yield sink.drain()
+
+
+ENCODERS = {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet}
+
+
+def encode(fmt: str, batches: AsyncIterator[list[tuple]]) -> AsyncIterator[bytes]:
+    return ENCODERS[fmt](batches)
@@ -1,13 +1,105 @@
 import os
-from fastapi import FastAPI, HTTPException
+import json
+import asyncio
+import psycopg
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Literal, Optional
 
-from agent.chat_agent import chat, delete_thread, store_feedback
-from .schemas import ChatRequest, ChatResponse, FeedbackRequest, CreateChatRequest, MessageRequest
-from .db_service import ChatDBService
+from agent.chat_agent import (
+    achat,
+    astream_chat,
+    adelete_thread,
+    astore_feedback_many,
+    coalesce_stats,
+    route_stats,
+    open_async_resources,
+    close_async_resources,
+)
+from agent.response_cache import response_cache, RESPONSE_CACHE_ENABLED
+from agent.retrieval import RERANK_ENABLED
+from agent.embeddings import warm_up as warm_up_embeddings
+from agent.chroma_setup import collection_stats, get_collection
+from agent.migrations import migrate
+from agent.db import pool_stats
+from agent.metrics import render_prometheus
+from agent.history import prune_forever, HISTORY_PRUNE_INTERVAL_S
+from agent.analytics import aget_rollups, refresh_forever, resolve_range, ANALYTICS_REFRESH_INTERVAL_S, naive_utc
+from .schemas import (
+    ChatRequest,
+    ChatResponse,
+    FeedbackRequest,
+    CreateChatRequest,
+    MessageRequest,
+    BulkWriteRequest,
+)
+from .db_service import AsyncChatDBService
+from .write_behind import WriteBehindQueue, durability_for
+from .admission import AdmissionController, Overloaded
+from .transcript_cache import transcript_cache, negotiate, CachedBody
+from .export import (
+    encode, check_format, export_filename, MEDIA_TYPES,
+    EXPORT_FETCH_ROWS, EXPORT_MAX_CONCURRENT, EXPORT_MAX_CHAT_IDS,
+)
+
+WRITERS = {
+    "messages": AsyncChatDBService.save_messages,
+    "feedback": astore_feedback_many,
+}
+# Failures of the connection rather than of the rows (PoolTimeout is an OperationalError)
+BATCH_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError)
+# Off by default: migrations run once per deploy via `python -m agent.migrations`
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "false").lower() == "true"
+DURABILITY = {endpoint: durability_for(endpoint) for endpoint in ("messages", "feedback", "bulk")}
+write_queue: Optional[WriteBehindQueue] = None
+admission: Optional[AdmissionController] = None
 
-app = FastAPI(title="ChatGPT Clone API")
+
+async def persist(kind: str, key: str, item: dict, durability: str) -> None:
+    if durability == "sync":
+        await WRITERS[kind]([item])
+        return
+    waiter = write_queue.put(kind, key, item)
+    if durability == "group":
+        await waiter
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global write_queue, admission
+    if RUN_MIGRATIONS_ON_STARTUP:
+        await asyncio.to_thread(migrate)
+    await open_async_resources()
+    # Connect to the vector store now so the first request doesn't pay for it
+    await asyncio.to_thread(get_collection)
+    if RESPONSE_CACHE_ENABLED or RERANK_ENABLED:
+        # The local embedding model is downloaded and loaded on first use
+        await asyncio.to_thread(warm_up_embeddings)
+    write_queue = WriteBehindQueue(WRITERS, batch_errors=BATCH_ERRORS)
+    await write_queue.start()
+    admission = AdmissionController()
+    pruner = asyncio.create_task(prune_forever()) if HISTORY_PRUNE_INTERVAL_S > 0 else None
+    rollups = asyncio.create_task(refresh_forever()) if ANALYTICS_REFRESH_INTERVAL_S > 0 else None
+    try:
+        yield
+    finally:
+        for task in (pruner, rollups):
+            if task is not None:
+                task.cancel()
+        # Drain queued writes before the pools go away
+        await write_queue.stop()
+        await close_async_resources()
+
+
+app = FastAPI(title="ChatGPT Clone API", lifespan=lifespan)
+
+
+def _too_many_requests(detail: str, retry_after_s: int) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"detail": detail},
+                        headers={"Retry-After": str(retry_after_s)})
 
 allowed_origins = [origin.strip() for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")]
 
@@ -17,18 +109,81 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/stats")
+async def stats():
+    return {
+        "response_cache": response_cache.stats(),
+        "query_cache": collection_stats(),
+        "write_behind": {"durability": DURABILITY, **write_queue.stats},
+        "db_pool": pool_stats(),
+        "admission": {**admission.snapshot(), "coalesced": coalesce_stats},
+        "transcript_cache": transcript_cache.stats(),
+        "routing": route_stats.snapshot(),
+    }
+
+
+def _gauges() -> dict[str, float]:
+    snapshot = admission.snapshot()
+    gauges = {f"chat_admission_{key}": snapshot[key]
+              for key in ("in_flight", "queue_depth", "avg_wait_ms", "p99_wait_ms")}
+    for name, pool in pool_stats().items():
+        if name in ("sync", "async") and pool is not None:
+            for key in ("size", "in_use", "waiting", "avg_acquire_ms"):
+                gauges[f"db_pool_{name}_{key}"] = pool[key]
+    return gauges
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text format: per-stage latency histograms plus queue and pool gauges."""
+    return PlainTextResponse(render_prometheus(_gauges()), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats/db")
+async def db_pool_stats():
+    return pool_stats()
+
+
+@app.get("/analytics")
+async def analytics(
+    granularity: Literal["hour", "day"] = "day",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Latency percentiles, thumbs-up rate, context-hit rate, tool usage and errors per
+    hour or day, served from the hourly rollups (see agent/analytics.py).
+    """
+    try:
+        since, until = resolve_range(granularity, since, until)
+        return await aget_rollups(since, until, granularity)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(payload: ChatRequest):
+async def chat_endpoint(payload: ChatRequest):
+    try:
+        admitted_at = await admission.acquire()
+    except Overloaded as exc:
+        return _too_many_requests(exc.reason, exc.retry_after_s)
     try:
-        result = chat(payload.message, thread_id=payload.thread_id)
+        result = await achat(payload.message, thread_id=payload.thread_id)
+        if result["error_type"] == "RateLimitError":
+            # Upstream LLM rate limit: tell the client to back off rather than fail
+            admission.stats["rate_limited"] += 1
+            return _too_many_requests(result["error_type"], admission.retry_after_s())
         if result["error_occurred"]:
             raise HTTPException(status_code=500, detail=result["error_type"])
         return ChatResponse(**result)
@@ -36,32 +191,56 @@ def chat_endpoint(payload: ChatRequest):
         raise
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
+    finally:
+        admission.release(admitted_at)
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(payload: ChatRequest):
+    """
+    Server-sent events: token, tool_start, tool_end, then a final done event; a
+    single error event instead when no slot frees up in time.
+    """
+    if admission.queue_full():
+        admission.stats["rejected_queue_full"] += 1
+        return _too_many_requests("queue full", admission.retry_after_s())
+
+    async def event_source():
+        # Taken once streaming starts, so a client that goes away before the
+        # first read cannot leak a slot; held until the stream finishes
+        try:
+            admitted_at = await admission.acquire()
+        except Overloaded as exc:
+            event = {"type": "error", "error_type": "Overloaded", "detail": exc.reason,
+                     "retry_after_s": exc.retry_after_s}
+            yield f"event: error\ndata: {json.dumps(event)}\n\n"
+            return
+        try:
+            async for event in astream_chat(payload.message, thread_id=payload.thread_id):
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            admission.release(admitted_at)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.delete("/chat/{thread_id}")
-def delete_chat_endpoint(thread_id: str):
+async def delete_chat_endpoint(thread_id: str):
     try:
-        delete_thread(thread_id)
+        await adelete_thread(thread_id)
         return {"status": "deleted", "thread_id": thread_id}
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
 @app.post("/feedback")
-def feedback_endpoint(payload: FeedbackRequest):
+async def feedback_endpoint(payload: FeedbackRequest):
     try:
-        store_feedback(
-            message_id=payload.message_id,
-            thread_id=payload.thread_id,
-            feedback=payload.feedback,
-            message_content=payload.message_content,
-            session_id=payload.session_id,
-            response_time_ms=payload.response_time_ms,
-            context_used=payload.context_used,
-            tool_calls=payload.tool_calls,
-            error_occurred=payload.error_occurred,
-            error_type=payload.error_type,
-        )
+        await persist("feedback", payload.message_id, payload.model_dump(), DURABILITY["feedback"])
         return {"status": "ok", "feedback": payload.feedback}
     except Exception as exc:
         import traceback
@@ -69,60 +248,195 @@ def feedback_endpoint(payload: FeedbackRequest):
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@app.post("/bulk")
+async def bulk_write(payload: BulkWriteRequest):
+    """Persist arrays of messages and feedback with one round-trip per table."""
+    try:
+        durability = DURABILITY["bulk"]
+        if durability == "sync":
+            if payload.messages:
+                await WRITERS["messages"]([m.model_dump() for m in payload.messages])
+            if payload.feedback:
+                await WRITERS["feedback"]([f.model_dump() for f in payload.feedback])
+        else:
+            waiters = [write_queue.put("messages", m.message_id, m.model_dump()) for m in payload.messages]
+            waiters += [write_queue.put("feedback", f.message_id, f.model_dump()) for f in payload.feedback]
+            if durability == "group":
+                await asyncio.gather(*waiters)
+        return {"status": "ok", "messages": len(payload.messages), "feedback": len(payload.feedback)}
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Weak comparison against If-None-Match, as RFC 9110 requires for GET."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def _versioned_response(request: Request, entry: CachedBody) -> Response:
+    body, encoding = transcript_cache.body(entry, negotiate(request.headers.get("accept-encoding", "")))
+    headers = {**entry.headers, "ETag": entry.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def _conditional_get(request: Request, key: tuple, etag: str, load) -> Response:
+    """
+    304 when the client already has `etag`; otherwise the cached serialized body,
+    or `load()` -> (data, next_cursor) serialized and cached under `etag`.
+    """
+    if _not_modified(request, etag):
+        transcript_cache.record_not_modified()
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    entry = transcript_cache.get(key, etag)
+    if entry is None:
+        data, next_cursor = await load()
+        if data is None:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        body = json.dumps(data, separators=(",", ":")).encode()
+        entry = transcript_cache.put(key, etag, body, {"X-Next-Cursor": next_cursor} if next_cursor else {})
+    return _versioned_response(request, entry)
+
+
 @app.get("/chats")
-def get_chats():
+async def get_chats(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    messages: bool = True,
+):
+    """
+    Chats, newest first: all of them unless ?limit= asks for a page. Pass
+    X-Next-Cursor back as ?cursor= for the next page.
+    Send the ETag back as If-None-Match to get a 304 when nothing on the page changed.
+    """
     try:
-        return ChatDBService.get_chats()
+        etag = await AsyncChatDBService.get_chats_etag(limit=limit, cursor=cursor, include_messages=messages)
+        return await _conditional_get(
+            request, ("chats", limit, cursor, messages), etag,
+            lambda: AsyncChatDBService.get_chats(limit=limit, cursor=cursor, include_messages=messages),
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@app.get("/chats/search")
+async def search_chats(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """
+    Chats whose messages or title match q (websearch syntax: "quoted phrase", or, -term),
+    best first, with a highlighted snippet instead of the transcript.
+    """
+    try:
+        results, next_cursor = await AsyncChatDBService.search_chats(q, limit=limit, cursor=cursor)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return results
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+@app.get("/chats/export")
+async def export_chats(
+    format: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chat_id: Optional[List[str]] = Query(None),
+):
+    """
+    Every message matching the filters (created in [since, until), in the given
+    chats), one row per message with its chat's title, grouped by chat in
+    transcript order. Streamed from a server-side cursor; memory stays flat.
+    """
+    try:
+        check_format(format)
+        since = naive_utc(since) if since else None
+        until = naive_utc(until) if until else None
+        if since and until and since >= until:
+            raise ValueError("since must be before until")
+        if chat_id and len(chat_id) > EXPORT_MAX_CHAT_IDS:
+            raise ValueError(f"At most {EXPORT_MAX_CHAT_IDS} chat_id filters")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if export_slots.locked():
+        return _too_many_requests("Too many exports running", 30)
+
+    async def body():
+        # Taken once streaming starts, so a client that never reads cannot leak a slot
+        async with export_slots:
+            batches = AsyncChatDBService.export_messages(chat_id, since, until, batch_rows=EXPORT_FETCH_ROWS)
+            async for chunk in encode(format, batches):
+                yield chunk
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format)}"'},
+    )
+
+
 @app.get("/chats/{chat_id}")
-def get_chat(chat_id: str):
+async def get_chat(
+    chat_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
     try:
-        chat_data = ChatDBService.get_chat_with_messages(chat_id)
-        if not chat_data:
+        etag = await AsyncChatDBService.get_chat_etag(chat_id)
+        if etag is None:
             raise HTTPException(status_code=404, detail="Chat not found")
-        return chat_data
+        return await _conditional_get(
+            request, ("chat", chat_id, limit, cursor), etag,
+            lambda: AsyncChatDBService.get_chat_with_messages(chat_id, limit=limit, cursor=cursor),
+        )
     except HTTPException:
         raise
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
 @app.post("/chats")
-def create_chat(payload: CreateChatRequest):
+async def create_chat(payload: CreateChatRequest):
     try:
-        ChatDBService.create_chat(payload.chat_id, payload.title)
+        await AsyncChatDBService.create_chat(payload.chat_id, payload.title)
         return {"status": "ok", "chat_id": payload.chat_id}
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
 @app.delete("/chats/{chat_id}")
-def delete_chat_db(chat_id: str):
+async def delete_chat_db(chat_id: str):
     try:
-        ChatDBService.delete_chat(chat_id)
-        delete_thread(chat_id)
+        await AsyncChatDBService.delete_chat(chat_id)
+        await adelete_thread(chat_id)
         return {"status": "deleted", "chat_id": chat_id}
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
 @app.post("/messages")
-def save_message(payload: MessageRequest):
+async def save_message(payload: MessageRequest):
     try:
-        ChatDBService.save_message(
-            message_id=payload.message_id,
-            chat_id=payload.chat_id,
-            role=payload.role,
-            content=payload.content,
-            response_time_ms=payload.response_time_ms,
-            context_used=payload.context_used,
-            tool_calls=payload.tool_calls,
-            error_occurred=payload.error_occurred,
-            error_type=payload.error_type,
-        )
+        await persist("messages", payload.message_id, payload.model_dump(), DURABILITY["messages"])
         return {"status": "ok"}
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
@@ -7,11 +7,32 @@ class ChatRequest(BaseModel):
     thread_id: Optional[str] = "default"
 
 
+class RetrievalRecord(BaseModel):
+    caller: str
+    query: str
+    shared: bool
+
+
 class ChatResponse(BaseModel):
     reply: str
     response_time_ms: int
+    time_to_first_token_ms: Optional[int] = None
     context_used: bool
     tool_calls: list[str]
+    retrievals: list[RetrievalRecord] = []
+    # Milliseconds spent per stage this turn (llm, retrieval.*, checkpoint.*, ...)
+    stages: dict[str, float] = {}
+    # "fast" (one direct LLM call over the pre-retrieved context), "agent", or "cache"
+    route: Optional[str] = None
+    # Distance of the best pre-retrieved chunk, which decided the route
+    route_distance: Optional[float] = None
+    # Tokens the model reported for this turn, and for fast turns the saving
+    # against the average agent turn
+    tokens: Optional[int] = None
+    tokens_saved: Optional[int] = None
+    cache_hit: bool = False
+    # Answer shared with an identical question that was already in flight
+    coalesced: bool = False
     error_occurred: bool
     error_type: Optional[str] = None
 
@@ -44,3 +65,8 @@ class MessageRequest(BaseModel):
     tool_calls: Optional[list[str]] = None
     error_occurred: bool = False
     error_type: Optional[str] = None
+
+
+class BulkWriteRequest(BaseModel):
+    messages: list[MessageRequest] = []
+    feedback: list[FeedbackRequest] = []
@@ -0,0 +1,145 @@
+"""
+Serialized /chats and /chats/{chat_id} responses, keyed by request and
+validated by ETag.
+
+An entry is served only while its ETag still matches the chat's current one,
+so a write from any worker makes it stale. Writes in this process also evict
+the chat's entries straight away. Compressed bodies are built on first use and
+kept next to the JSON.
+"""
+import os
+import gzip
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "256"))
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Smaller bodies are sent as-is; compressing them costs more than it saves
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+
+@dataclass
+class CachedBody:
+    etag: str
+    headers: dict[str, str]
+    bodies: dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+
+def negotiate(accept_encoding: str) -> str:
+    """Best supported coding in an Accept-Encoding header; q-values of 0 exclude it."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if offered.get(encoding, 0.0) > 0:
+            return encoding
+    return "identity"
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class TranscriptCache:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, CachedBody] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: tuple, etag: str) -> CachedBody | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, etag: str, body: bytes, headers: dict[str, str]) -> CachedBody:
+        entry = CachedBody(etag, headers, {"identity": body})
+        with self._lock:
+            self._drop(key)
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.size
+                self._evict()
+        return entry
+
+    def body(self, entry: CachedBody, encoding: str) -> tuple[bytes, str]:
+        """The entry's body in `encoding`, or uncompressed when it is too small to bother."""
+        identity = entry.bodies["identity"]
+        if encoding == "identity" or len(identity) < COMPRESS_MIN_BYTES:
+            return identity, "identity"
+        body = entry.bodies.get(encoding)
+        if body is None:
+            body = _compress(identity, encoding)
+            with self._lock:
+                if encoding not in entry.bodies:
+                    entry.bodies[encoding] = body
+                    if any(cached is entry for cached in self._entries.values()):
+                        self._bytes += len(body)
+                        self._evict()
+        return body, encoding
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def invalidate(self, chat_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == "chat" and k[1] == chat_id]:
+                self._drop(key)
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "not_modified": self.not_modified,
+                "brotli": brotli is not None,
+            }
+
+
+transcript_cache = TranscriptCache(
+    max_entries=TRANSCRIPT_CACHE_MAX_ENTRIES,
+    max_bytes=TRANSCRIPT_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,215 @@
+import os
+import json
+import asyncio
+import traceback
+from typing import Awaitable, Callable
+
+# Per-endpoint durability:
+#   sync  - write in the request, respond after commit (default)
+#   group - queue, respond after the batch containing the write has committed
+#   async - queue, respond immediately; queued writes are lost if the process dies
+DURABILITY_MODES = ("sync", "group", "async")
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "50"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+# Doubled after every consecutive failed flush
+WRITE_BEHIND_RETRY_DELAY_MS = float(os.getenv("WRITE_BEHIND_RETRY_DELAY_MS", "500"))
+# Items still failing after the retries are appended here as JSON lines
+WRITE_BEHIND_DEAD_LETTER_PATH = os.getenv("WRITE_BEHIND_DEAD_LETTER_PATH", "write_behind_dead_letter.jsonl")
+
+
+def durability_for(endpoint: str) -> str:
+    """Durability for an endpoint from e.g. MESSAGES_DURABILITY=group."""
+    mode = os.getenv(f"{endpoint.upper()}_DURABILITY", "sync").lower()
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"{endpoint.upper()}_DURABILITY must be one of {DURABILITY_MODES}, got {mode!r}")
+    return mode
+
+
+class WriteBehindQueue:
+    """
+    Coalesces writes by key and flushes them in bulk when the queue reaches
+    max_batch items or max_delay_s after the first pending write.
+
+    writers maps a kind ("messages", "feedback") to an async bulk writer that
+    receives the latest item for every pending key. A failed batch is split in
+    halves until the failing items are isolated, so one bad row (say, a message
+    for a chat deleted while it was queued) does not fail the rest. batch_errors
+    are errors that say nothing about the items, like a lost connection: the
+    whole batch is retried without splitting, after a backoff. Failed items are
+    re-queued up to max_retries times, unless a newer write for the key has
+    arrived, then appended to the dead-letter file; only their waiters fail.
+    stop() drains the queue.
+    """
+
+    def __init__(
+        self,
+        writers: dict[str, Callable[[list[dict]], Awaitable[None]]],
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        max_delay_s: float = WRITE_BEHIND_MAX_DELAY_MS / 1000,
+        max_retries: int = WRITE_BEHIND_MAX_RETRIES,
+        retry_delay_s: float = WRITE_BEHIND_RETRY_DELAY_MS / 1000,
+        dead_letter_path: str = WRITE_BEHIND_DEAD_LETTER_PATH,
+        batch_errors: tuple[type[Exception], ...] = (),
+    ):
+        self.writers = writers
+        self.max_batch = max_batch
+        self.max_delay_s = max_delay_s
+        self.max_retries = max_retries
+        self.retry_delay_s = retry_delay_s
+        self.dead_letter_path = dead_letter_path
+        self.batch_errors = batch_errors
+        self._pending: dict[str, dict[str, dict]] = {kind: {} for kind in writers}
+        # Failed attempts so far of pending items that are being retried
+        self._attempts: dict[str, dict[str, int]] = {kind: {} for kind in writers}
+        self._waiters: dict[str, dict[str, list[asyncio.Future]]] = {kind: {} for kind in writers}
+        self._failed_flushes = 0
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.stats = {"queued": 0, "coalesced": 0, "flushes": 0, "flushed_items": 0, "failed_items": 0,
+                      "retried_items": 0, "dead_lettered": 0}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        # Retries are bounded, so this ends with every item written or dead-lettered
+        while self._size:
+            await self.flush()
+
+    def put(self, kind: str, key: str, item: dict) -> asyncio.Future:
+        """Queue a write; the returned future resolves once its batch has committed."""
+        if self._closing:
+            raise RuntimeError("Write-behind queue is shut down")
+        pending = self._pending[kind]
+        if key in pending:
+            self.stats["coalesced"] += 1
+        else:
+            self._size += 1
+        pending[key] = item
+        # A newer item for the key starts over with a full set of retries
+        self._attempts[kind].pop(key, None)
+        self.stats["queued"] += 1
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[kind].setdefault(key, []).append(waiter)
+        if self._size == 1 or self._size >= self.max_batch:
+            self._wakeup.set()
+        return waiter
+
+    async def _run(self) -> None:
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._closing:
+                break
+            if self._size < self.max_batch:
+                # Time trigger: give the batch up to max_delay_s to fill
+                try:
+                    await asyncio.wait_for(self._full(), timeout=self.max_delay_s)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+            if self._failed_flushes:
+                # Back off before retrying against a failing database
+                backoff = 2 ** min(self._failed_flushes - 1, self.max_retries)
+                await asyncio.sleep(self.retry_delay_s * backoff)
+
+    async def _full(self) -> None:
+        while self._size < self.max_batch and not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+    async def flush(self) -> None:
+        if not self._size:
+            return
+        batches, self._pending = self._pending, {kind: {} for kind in self.writers}
+        attempts, self._attempts = self._attempts, {kind: {} for kind in self.writers}
+        waiters, self._waiters = self._waiters, {kind: {} for kind in self.writers}
+        self._size = 0
+
+        backoff = False
+        for kind, items in batches.items():
+            if not items:
+                continue
+            failed = await self._write(kind, items)
+            self.stats["flushed_items"] += len(items) - len(failed)
+            for key, futures in waiters[kind].items():
+                if key not in failed:
+                    _resolve(futures)
+            if not failed:
+                continue
+            self.stats["failed_items"] += len(failed)
+            dead = []
+            for key, exc in failed.items():
+                backoff = backoff or isinstance(exc, self.batch_errors)
+                tries = attempts[kind].get(key, 0) + 1
+                if tries <= self.max_retries:
+                    self._retry(kind, key, items[key], tries, waiters[kind].get(key, []))
+                else:
+                    dead.append((items[key], exc))
+                    _fail(waiters[kind].get(key, []), exc)
+            if dead:
+                self._dead_letter(kind, dead)
+        self.stats["flushes"] += 1
+        self._failed_flushes = self._failed_flushes + 1 if backoff else 0
+
+    async def _write(self, kind: str, items: dict[str, dict]) -> dict[str, Exception]:
+        """Write items, bisecting a failed batch. Returns the keys that failed with their errors."""
+        try:
+            await self.writers[kind](list(items.values()))
+            return {}
+        except Exception as exc:
+            if len(items) == 1 or isinstance(exc, self.batch_errors):
+                print(f"Write-behind write of {len(items)} {kind} failed: {exc}")
+                traceback.print_exc()
+                return {key: exc for key in items}
+        keys = list(items)
+        half = len(keys) // 2
+        failed = await self._write(kind, {key: items[key] for key in keys[:half]})
+        failed.update(await self._write(kind, {key: items[key] for key in keys[half:]}))
+        return failed
+
+    def _retry(self, kind: str, key: str, item: dict, tries: int, futures: list[asyncio.Future]) -> None:
+        pending = self._pending[kind]
+        # A write queued for the key during the flush supersedes the failed one
+        if key not in pending:
+            pending[key] = item
+            self._attempts[kind][key] = tries
+            self._size += 1
+            self.stats["retried_items"] += 1
+        self._waiters[kind].setdefault(key, []).extend(futures)
+        self._wakeup.set()
+
+    def _dead_letter(self, kind: str, items: list[tuple[dict, Exception]]) -> None:
+        self.stats["dead_lettered"] += len(items)
+        print(f"Write-behind gave up on {len(items)} {kind} after {self.max_retries} retries; "
+              f"appending them to {self.dead_letter_path}")
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                for item, exc in items:
+                    f.write(json.dumps({"kind": kind, "error": str(exc), "item": item}, default=str) + "\n")
+        except OSError as write_exc:
+            print(f"Could not write the dead-letter file: {write_exc}")
+
+
+def _resolve(futures: list[asyncio.Future]) -> None:
+    for waiter in futures:
+        if not waiter.done():
+            waiter.set_result(None)
+
+
+def _fail(futures: list[asyncio.Future], exc: Exception) -> None:
+    for waiter in futures:
+        if not waiter.done():
+            waiter.set_exception(exc)
+            # Nobody awaits async-mode futures; don't warn about unretrieved errors
+            waiter.exception()
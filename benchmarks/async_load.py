@@ -0,0 +1,118 @@
+"""
+Load test: concurrent /chat requests per worker, sync handlers vs async handlers.
+
+The LLM is a FakeChatModel with fixed latency and the DB write is a sleep, so the
+only variable is how the handler waits. Sync `def` handlers are capped by
+Starlette's threadpool (40 threads by default); async handlers are not.
+
+    python -m benchmarks.async_load --requests 200 --llm-latency 0.5
+"""
+import time
+import asyncio
+import argparse
+import threading
+
+import httpx
+from fastapi import FastAPI
+from langchain_core.messages import SystemMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from api.schemas import ChatRequest
+from .stubs import FakeChatModel
+
+
+class InFlight:
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def exit(self):
+        with self._lock:
+            self.current -= 1
+
+
+def build_agent(llm_latency: float):
+    return create_react_agent(
+        model=FakeChatModel(latency_s=llm_latency),
+        tools=[],
+        checkpointer=InMemorySaver(),
+        prompt=SystemMessage(content="stub"),
+    )
+
+
+def build_sync_app(llm_latency: float, db_latency: float, in_flight: InFlight) -> FastAPI:
+    app = FastAPI()
+    agent = build_agent(llm_latency)
+
+    @app.post("/chat")
+    def chat_endpoint(payload: ChatRequest):
+        in_flight.enter()
+        try:
+            config = {"configurable": {"thread_id": payload.thread_id}}
+            result = agent.invoke({"messages": [("user", payload.message)]}, config)
+            time.sleep(db_latency)
+            return {"reply": result["messages"][-1].content}
+        finally:
+            in_flight.exit()
+
+    return app
+
+
+def build_async_app(llm_latency: float, db_latency: float, in_flight: InFlight) -> FastAPI:
+    app = FastAPI()
+    agent = build_agent(llm_latency)
+
+    @app.post("/chat")
+    async def chat_endpoint(payload: ChatRequest):
+        in_flight.enter()
+        try:
+            config = {"configurable": {"thread_id": payload.thread_id}}
+            result = await agent.ainvoke({"messages": [("user", payload.message)]}, config)
+            await asyncio.sleep(db_latency)
+            return {"reply": result["messages"][-1].content}
+        finally:
+            in_flight.exit()
+
+    return app
+
+
+async def drive(app: FastAPI, n_requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/chat", json={"message": "What is the drop policy?", "thread_id": f"t{i}"})
+            for i in range(n_requests)
+        ])
+        elapsed = time.perf_counter() - start
+    failed = sum(1 for r in responses if r.status_code != 200)
+    if failed:
+        print(f"  {failed} requests failed")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(f"{args.requests} concurrent requests, LLM {args.llm_latency}s, DB {args.db_latency}s\n")
+    for label, factory in [("sync (before)", build_sync_app), ("async (after)", build_async_app)]:
+        in_flight = InFlight()
+        app = factory(args.llm_latency, args.db_latency, in_flight)
+        elapsed = asyncio.run(drive(app, args.requests))
+        print(f"{label:14} peak in-flight: {in_flight.peak:4d}   "
+              f"wall: {elapsed:6.2f}s   throughput: {args.requests / elapsed:7.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Bytes and DB queries per page load for /chats and /chats/{chat_id}.
+
+A page load is one GET /chats?limit=--page plus one GET /chats/{chat_id}. Each
+scenario runs --loads page loads against the in-process app on a seeded
+local schema (see benchmarks/fixtures.py):
+
+  unconditional     no If-None-Match, no compression (what the frontend does today)
+  gzip              no If-None-Match, Accept-Encoding: gzip
+  conditional       the client sends back the ETags it last saw
+  conditional+write as above, with a new message in the viewed chat before each load
+
+    python -m benchmarks.chats_etag --chats 200 --messages 40 --loads 50
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import httpx
+import psycopg
+
+from .fixtures import local_postgres, schema_conninfo
+from .load import _offline_env
+
+SCHEMA = "bench_etag"
+
+# Queries issued by each timed db_service call
+QUERIES_PER_CALL = {
+    "db.get_chats": 1,
+    "db.get_chat_with_messages": 2,
+    "db.get_chats_etag": 1,
+    "db.get_chat_etag": 1,
+    "db.save_messages": 1,
+    "db.save_message": 1,
+}
+# Before ETags a page load ran get_chats and get_chat_with_messages
+LEGACY_QUERIES_PER_LOAD = QUERIES_PER_CALL["db.get_chats"] + QUERIES_PER_CALL["db.get_chat_with_messages"]
+
+SEED_SQL = ["""
+    INSERT INTO chats (id, title, created_at, updated_at)
+    SELECT 'chat-' || c, 'Chat ' || c, NOW() - make_interval(mins => c), NOW() - make_interval(mins => c)
+    FROM generate_series(1, %(chats)s) AS c
+""", """
+    INSERT INTO messages (id, chat_id, role, content, response_time_ms, context_used, tool_calls, created_at)
+    SELECT 'msg-' || c || '-' || m, 'chat-' || c,
+           CASE WHEN m %% 2 = 0 THEN 'assistant' ELSE 'user' END,
+           repeat('According to the attendance policy, students must notify the instructor. ', 6),
+           1200, TRUE, 'search_policies',
+           NOW() - make_interval(mins => c) + make_interval(secs => m)
+    FROM generate_series(1, %(chats)s) AS c, generate_series(1, %(messages)s) AS m
+"""]
+
+
+def _db_queries(before: dict, after: dict) -> int:
+    return sum((after.get(stage, 0) - before.get(stage, 0)) * n for stage, n in QUERIES_PER_CALL.items())
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, args) -> dict:
+    from agent.metrics import stage_counts
+
+    conditional = name.startswith("conditional")
+    encoding = "identity" if name == "unconditional" else "gzip"
+    etags: dict[str, str] = {}
+    wire_bytes, statuses = 0, {}
+    counts_before = stage_counts()
+    start = time.perf_counter()
+    for i in range(args.loads):
+        chat_path = f"/chats/chat-{i % 5 + 1}"
+        if name == "conditional+write":
+            await client.post("/messages", json={"message_id": f"etag-{i}", "chat_id": f"chat-{i % 5 + 1}",
+                                                 "role": "user", "content": "One more question."})
+        for path in (f"/chats?limit={args.page}", chat_path):
+            headers = {"Accept-Encoding": encoding}
+            if conditional and path in etags:
+                headers["If-None-Match"] = etags[path]
+            response = await client.get(path, headers=headers)
+            wire_bytes += response.num_bytes_downloaded
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if "etag" in response.headers:
+                etags[path] = response.headers["etag"]
+    elapsed = time.perf_counter() - start
+    queries = _db_queries(counts_before, stage_counts())
+    if name == "conditional+write":
+        queries -= args.loads * QUERIES_PER_CALL["db.save_messages"]
+    return {
+        "scenario": name,
+        "kb_per_load": round(wire_bytes / args.loads / 1024, 1),
+        "queries_per_load": round(queries / args.loads, 2),
+        "ms_per_load": round(elapsed / args.loads * 1000, 1),
+        "statuses": statuses,
+    }
+
+
+async def drive(args) -> list[dict]:
+    from api.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            return [await run_scenario(client, name, args)
+                    for name in ("unconditional", "gzip", "conditional", "conditional+write")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--loads", type=int, default=50)
+    args = parser.parse_args()
+
+    _offline_env(schema_conninfo(SCHEMA))
+    os.environ["MESSAGES_DURABILITY"] = "sync"
+    with local_postgres(SCHEMA) as conninfo:
+        with psycopg.connect(conninfo, autocommit=True) as conn:
+            for statement in SEED_SQL:
+                conn.execute(statement, {"chats": args.chats, "messages": args.messages})
+        results = asyncio.run(drive(args))
+
+    print(f"{'scenario':18} {'KB/load':>9} {'queries/load':>13} {'ms/load':>9}   statuses")
+    for r in results:
+        print(f"{r['scenario']:18} {r['kb_per_load']:9.1f} {r['queries_per_load']:13.2f} {r['ms_per_load']:9.1f}   {r['statuses']}")
+    baseline = results[0]["kb_per_load"]
+    for r in results[1:]:
+        saved = 1 - r["kb_per_load"] / baseline if baseline else 0.0
+        print(f"{r['scenario']:18} saves {saved:6.1%} of bytes and "
+              f"{LEGACY_QUERIES_PER_LOAD - r['queries_per_load']:.2f} of {LEGACY_QUERIES_PER_LOAD} queries per load")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Peak Python memory and throughput of a full chat export at growing sizes.
+
+For each --sizes total message count, a migrated `bench_export` schema (see
+benchmarks/fixtures.py) is reseeded with chats of --per-chat messages and
+exported twice:
+
+  list    every chat with its transcript from one get_chats call, then json.dumps
+          (what exporting through GET /chats amounts to)
+  stream  the /chats/export path: server-side cursor batches through the encoder
+
+Memory is the tracemalloc peak while the export runs; bytes are discarded.
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres:16
+    python -m benchmarks.chats_export --sizes 1000,100000,1000000 --format ndjson
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+import psycopg
+
+from .fixtures import local_postgres, schema_conninfo
+
+SCHEMA = "bench_export"
+# agent.db builds its pools from this
+os.environ["SUPABASE_DB_URL"] = schema_conninfo(SCHEMA)
+
+SEED_SQL = ["TRUNCATE chats, messages", """
+    INSERT INTO chats (id, title, created_at, updated_at)
+    SELECT 'chat-' || c, 'Chat ' || c, NOW() - make_interval(mins => c), NOW() - make_interval(mins => c)
+    FROM generate_series(1, %(chats)s) AS c
+""", """
+    INSERT INTO messages (id, chat_id, role, content, response_time_ms, context_used, tool_calls, created_at)
+    SELECT 'msg-' || c || '-' || m, 'chat-' || c,
+           CASE WHEN m %% 2 = 0 THEN 'assistant' ELSE 'user' END,
+           repeat('According to the attendance policy, students must notify the instructor. ', 4),
+           1200, TRUE, 'search_policies',
+           NOW() - make_interval(mins => c) + make_interval(secs => m)
+    FROM generate_series(1, %(chats)s) AS c, generate_series(1, %(per_chat)s) AS m
+""", "ANALYZE chats", "ANALYZE messages"]
+
+
+async def export_list(chats: int) -> int:
+    from api.db_service import AsyncChatDBService
+
+    data, _ = await AsyncChatDBService.get_chats(limit=chats, include_messages=True)
+    return len(json.dumps(data, separators=(",", ":")).encode())
+
+
+async def export_stream(fmt: str) -> int:
+    from api.db_service import AsyncChatDBService
+    from api.export import encode, EXPORT_FETCH_ROWS
+
+    written = 0
+    async for chunk in encode(fmt, AsyncChatDBService.export_messages(batch_rows=EXPORT_FETCH_ROWS)):
+        written += len(chunk)
+    return written
+
+
+async def measure(name: str, run) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    written = await run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"method": name, "mb_out": round(written / 2**20, 1), "seconds": round(elapsed, 2),
+            "peak_mb": round(peak / 2**20, 1)}
+
+
+async def drive(conninfo: str, args) -> list[dict]:
+    from agent.db import open_async_pool, close_async_pool
+
+    await open_async_pool()
+    results = []
+    try:
+        for size in args.sizes:
+            chats = max(size // args.per_chat, 1)
+            with psycopg.connect(conninfo, autocommit=True) as conn:
+                for statement in SEED_SQL:
+                    conn.execute(statement, {"chats": chats, "per_chat": args.per_chat})
+            for name, run in (("list", lambda: export_list(chats)), ("stream", lambda: export_stream(args.format))):
+                if name == "list" and size > args.list_max:
+                    continue
+                results.append({"messages": chats * args.per_chat, **await measure(name, run)})
+    finally:
+        await close_async_pool()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")], default=[1000, 100000, 1000000])
+    parser.add_argument("--per-chat", type=int, default=20)
+    parser.add_argument("--format", choices=("ndjson", "csv", "parquet"), default="ndjson")
+    parser.add_argument("--list-max", type=int, default=100000,
+                        help="skip the in-memory list export above this many messages")
+    args = parser.parse_args()
+
+    with local_postgres(SCHEMA) as conninfo:
+        results = asyncio.run(drive(conninfo, args))
+
+    print(f"{'messages':>10} {'method':7} {'MB out':>8} {'seconds':>8} {'rows/s':>10} {'peak MB':>8}")
+    for r in results:
+        rate = r["messages"] / r["seconds"] if r["seconds"] else 0.0
+        print(f"{r['messages']:>10} {r['method']:7} {r['mb_out']:8.1f} {r['seconds']:8.2f} {rate:10.0f} {r['peak_mb']:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
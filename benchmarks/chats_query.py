@@ -0,0 +1,152 @@
+"""
+GET /chats query cost: legacy N+1 vs single-query keyset pages.
+
+Seeds a throwaway `bench` schema in a local Postgres with --chats chats of
+--messages messages each, then times the legacy per-chat message query and
+AsyncChatDBService.get_chats/get_chat_with_messages.
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres:16
+    python -m benchmarks.chats_query --chats 10000 --messages 50
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import psycopg
+
+from .fixtures import BENCH_DB_URL, schema_conninfo
+
+BENCH_CONNINFO = schema_conninfo("bench")
+# agent.db builds its pools from this at import
+os.environ["SUPABASE_DB_URL"] = BENCH_CONNINFO
+
+SCHEMA_SQL = """
+    DROP SCHEMA IF EXISTS bench CASCADE;
+    CREATE SCHEMA bench;
+    CREATE TABLE bench.chats (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+    CREATE TABLE bench.messages (
+        id TEXT PRIMARY KEY,
+        chat_id TEXT NOT NULL REFERENCES bench.chats(id) ON DELETE CASCADE,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        response_time_ms INTEGER,
+        context_used BOOLEAN,
+        tool_calls TEXT,
+        error_occurred BOOLEAN DEFAULT FALSE,
+        error_type TEXT,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+"""
+
+SEED_SQL = """
+    INSERT INTO bench.chats (id, title, created_at, updated_at)
+    SELECT 'chat-' || c, 'Chat ' || c,
+           NOW() - make_interval(mins => c), NOW() - make_interval(mins => c)
+    FROM generate_series(1, %(chats)s) AS c;
+
+    INSERT INTO bench.messages (id, chat_id, role, content, response_time_ms, context_used, tool_calls, created_at)
+    SELECT 'msg-' || c || '-' || m, 'chat-' || c,
+           CASE WHEN m %% 2 = 0 THEN 'assistant' ELSE 'user' END,
+           repeat('Policy answer text. ', 20), 1200, TRUE, 'search_policies',
+           NOW() - make_interval(mins => c) + make_interval(secs => m)
+    FROM generate_series(1, %(chats)s) AS c, generate_series(1, %(messages)s) AS m;
+"""
+
+INDEX_SQL = """
+    CREATE INDEX ON bench.messages(chat_id);
+    CREATE INDEX ON bench.messages(created_at);
+    CREATE INDEX ON bench.chats(updated_at DESC, id DESC);
+    CREATE INDEX ON bench.messages(chat_id, created_at, id);
+    ANALYZE;
+"""
+
+
+def legacy_get_chats(conn) -> int:
+    """The pre-pagination implementation: one messages query per chat."""
+    queries = 1
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, title, created_at, updated_at FROM chats ORDER BY updated_at DESC")
+        for row in cur.fetchall():
+            cur.execute("""
+                SELECT id, role, content, response_time_ms, context_used,
+                       tool_calls, error_occurred, error_type, created_at
+                FROM messages WHERE chat_id = %s ORDER BY created_at ASC
+            """, (row[0],))
+            cur.fetchall()
+            queries += 1
+    return queries
+
+
+def report(label: str, start: float, queries: int | str) -> None:
+    print(f"{label:42} {(time.perf_counter() - start) * 1000:10.1f} ms   queries: {queries}")
+
+
+def timed(label: str, fn, queries: int | str) -> None:
+    start = time.perf_counter()
+    fn()
+    report(label, start, queries)
+
+
+async def atimed(label: str, fn, queries: int | str) -> None:
+    start = time.perf_counter()
+    await fn()
+    report(label, start, queries)
+
+
+async def drive(args) -> None:
+    from agent.db import open_async_pool, close_async_pool
+    from api.db_service import AsyncChatDBService
+
+    await open_async_pool()
+    try:
+        await atimed(f"first page of {args.page}, with messages",
+                     lambda: AsyncChatDBService.get_chats(limit=args.page), 1)
+        await atimed(f"first page of {args.page}, summary only",
+                     lambda: AsyncChatDBService.get_chats(limit=args.page, include_messages=False), 1)
+
+        async def walk_all(include_messages: bool) -> None:
+            cursor = None
+            while True:
+                _, cursor = await AsyncChatDBService.get_chats(
+                    limit=args.page, cursor=cursor, include_messages=include_messages,
+                )
+                if not cursor:
+                    break
+
+        pages = -(-args.chats // args.page)
+        await atimed("all pages, with messages", lambda: walk_all(True), pages)
+        await atimed("all pages, summary only", lambda: walk_all(False), pages)
+        await atimed("one chat, first 20 messages",
+                     lambda: AsyncChatDBService.get_chat_with_messages(f"chat-{args.chats // 2}", limit=20), 2)
+    finally:
+        await close_async_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--page", type=int, default=100)
+    args = parser.parse_args()
+
+    with psycopg.connect(BENCH_DB_URL, autocommit=True) as conn:
+        start = time.perf_counter()
+        conn.execute(SCHEMA_SQL)
+        with conn.cursor() as cur:
+            cur.execute(SEED_SQL, {"chats": args.chats, "messages": args.messages})
+        conn.execute(INDEX_SQL)
+        print(f"Seeded {args.chats} chats x {args.messages} messages in {time.perf_counter() - start:.1f}s\n")
+
+    with psycopg.connect(BENCH_CONNINFO) as conn:
+        timed("legacy N+1, all chats", lambda: legacy_get_chats(conn), args.chats + 1)
+
+    asyncio.run(drive(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Chat history search: what a client does today (page through GET /chats with
+every transcript and filter locally), an ILIKE scan, and the full-text
+/chats/search query on the GIN index.
+
+Seeds a migrated `bench_search` schema (see benchmarks/fixtures.py) with
+--chats chats of --messages messages each, drawn from a policy vocabulary so
+terms have realistic selectivity.
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres:16
+    python -m benchmarks.chats_search --chats 10000 --messages 50
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import psycopg
+
+from .fixtures import local_postgres, schema_conninfo
+
+SCHEMA = "bench_search"
+# agent.db builds its pools from this on first use
+os.environ["SUPABASE_DB_URL"] = schema_conninfo(SCHEMA)
+
+WORDS = (
+    "tuition refund withdrawal deadline transcript grade appeal probation parking permit "
+    "housing residency scholarship financial aid plagiarism integrity conduct hearing "
+    "registration enrollment leave absence accommodation disability harassment title "
+    "complaint records privacy ferpa immunization insurance library fine course audit "
+    "incomplete repeat credit transfer graduation honors commencement petition waiver"
+).split()
+
+# Each message is 12 words picked deterministically from WORDS. Separate
+# statements: psycopg cannot bind parameters into a multi-statement string.
+SEED_SQL = ["""
+    INSERT INTO chats (id, title, created_at, updated_at)
+    SELECT 'chat-' || c, initcap((%(words)s::text[])[1 + (c * 7) %% %(n_words)s]) || ' question ' || c,
+           NOW() - make_interval(mins => c), NOW() - make_interval(mins => c)
+    FROM generate_series(1, %(chats)s) AS c
+""", """
+    INSERT INTO messages (id, chat_id, role, content, response_time_ms, context_used, tool_calls, created_at)
+    SELECT 'msg-' || c || '-' || m, 'chat-' || c,
+           CASE WHEN m %% 2 = 0 THEN 'assistant' ELSE 'user' END,
+           (SELECT string_agg((%(words)s::text[])[1 + (c * 31 + m * 17 + w * w * 13) %% %(n_words)s], ' ')
+            FROM generate_series(1, 12) AS w),
+           1200, TRUE, 'search_policies',
+           NOW() - make_interval(mins => c) + make_interval(secs => m)
+    FROM generate_series(1, %(chats)s) AS c, generate_series(1, %(messages)s) AS m
+""", "ANALYZE chats", "ANALYZE messages"]
+
+ILIKE_SQL = """
+    SELECT c.id, c.title
+    FROM chats c
+    WHERE c.title ILIKE %(pattern)s
+       OR EXISTS (SELECT 1 FROM messages m WHERE m.chat_id = c.id AND m.content ILIKE %(pattern)s)
+    ORDER BY c.updated_at DESC
+    LIMIT %(limit)s
+"""
+
+
+async def timed(label: str, fn) -> None:
+    start = time.perf_counter()
+    result = await fn()
+    print(f"{label:48} {(time.perf_counter() - start) * 1000:10.1f} ms   results: {result}")
+
+
+async def drive(conninfo: str, args) -> None:
+    from agent.db import open_async_pool, close_async_pool
+    from api.db_service import AsyncChatDBService
+
+    async def client_side(term: str) -> int:
+        """Every page of GET /chats with transcripts, filtered by substring."""
+        matches, cursor = 0, None
+        while True:
+            chats, cursor = await AsyncChatDBService.get_chats(limit=100, cursor=cursor)
+            matches += sum(
+                term in chat["title"].lower() or any(term in m["content"] for m in chat["messages"])
+                for chat in chats
+            )
+            if not cursor:
+                return matches
+
+    async def ilike(term: str) -> int:
+        async with await psycopg.AsyncConnection.connect(conninfo) as conn:
+            cur = await conn.execute(ILIKE_SQL, {"pattern": f"%{term}%", "limit": args.page})
+            return len(await cur.fetchall())
+
+    async def search(query: str) -> int:
+        return len((await AsyncChatDBService.search_chats(query, limit=args.page))[0])
+
+    async def search_deep(query: str) -> int:
+        pages, cursor = 0, None
+        while pages < 5:
+            _, cursor = await AsyncChatDBService.search_chats(query, limit=args.page, cursor=cursor)
+            pages += 1
+            if not cursor:
+                break
+        return pages
+
+    await open_async_pool()
+    try:
+        first = args.queries[0]
+        await timed(f"client-side filter of all chats ({first})", lambda: client_side(first))
+        for query in args.queries:
+            print(f"\n{query}:")
+            term = query.strip('"').split()[0]
+            await timed(f"  ILIKE scan, first {args.page} ({term})", lambda: ilike(term))
+            await timed(f"  /chats/search, first {args.page}", lambda: search(query))
+            await timed("  /chats/search, 5 pages (pages)", lambda: search_deep(query))
+    finally:
+        await close_async_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--queries", nargs="+", default=["ferpa", "tuition refund", '"grade appeal"', "parking -permit"])
+    parser.add_argument("--keep", action="store_true", help="keep the seeded schema")
+    args = parser.parse_args()
+
+    with local_postgres(SCHEMA, keep=args.keep) as conninfo:
+        start = time.perf_counter()
+        with psycopg.connect(conninfo, autocommit=True) as conn:
+            params = {"words": WORDS, "n_words": len(WORDS), "chats": args.chats, "messages": args.messages}
+            for statement in SEED_SQL:
+                conn.execute(statement, params if "%(" in statement else None)
+        print(f"Seeded {args.chats} chats x {args.messages} messages in {time.perf_counter() - start:.1f}s\n")
+
+        asyncio.run(drive(conninfo, args))
+
+
+if __name__ == "__main__":
+    main()
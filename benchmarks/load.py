@@ -0,0 +1,191 @@
+"""
+Offline load test of the real API app: /chat, /chats, /messages and /feedback
+at increasing concurrency, reporting RPS, p50/p95/p99 and error rate.
+
+The LLM is a FakeChatModel, the collection a StubCollection, and Postgres a
+throwaway schema on BENCH_DB_URL (see benchmarks/fixtures.py), so runs cost
+nothing and are repeatable. Results are written as JSON; pass an earlier file
+as --baseline to fail on regressions.
+
+    python -m benchmarks.load --concurrency 1 8 32 64 --requests 200 \\
+        --output bench-results.json --baseline previous.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+ENDPOINTS = ("chat", "chats", "messages", "feedback")
+
+
+def _offline_env(conninfo: str) -> None:
+    """Settings that keep the app off paid services; must run before agent imports."""
+    os.environ["SUPABASE_DB_URL"] = conninfo
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ.setdefault("LANGSMITH_API_KEY", "offline")
+    os.environ["LANGSMITH_TRACING"] = "false"
+    # Both caches would embed with the local MiniLM model; keep the measurement on the request path
+    os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+    os.environ["QUERY_CACHE_ENABLED"] = "false"
+    os.environ["RETRIEVAL_MODE"] = "vector"
+    os.environ["HISTORY_PRUNE_INTERVAL_S"] = "0"
+    os.environ["ANALYTICS_REFRESH_INTERVAL_S"] = "0"
+    os.environ["RUN_MIGRATIONS_ON_STARTUP"] = "false"
+
+
+def _request(endpoint: str, i: int, run_id: str, chat_ids: list[str]) -> tuple[str, str, dict | None]:
+    if endpoint == "chat":
+        return "POST", "/chat", {"message": f"What is the procedure for request type {i % 17}?",
+                                 "thread_id": f"{run_id}-{i}"}
+    if endpoint == "chats":
+        return "GET", "/chats?limit=20&messages=false", None
+    if endpoint == "messages":
+        return "POST", "/messages", {"message_id": f"{run_id}-m{i}", "chat_id": chat_ids[i % len(chat_ids)],
+                                     "role": "user", "content": "How do I appeal a grade?"}
+    return "POST", "/feedback", {"message_id": f"{run_id}-f{i}", "thread_id": f"{run_id}-{i}",
+                                 "feedback": "up", "message_content": "According to the policy, yes."}
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, concurrency: int, n_requests: int,
+                    chat_ids: list[str]) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    latencies, statuses = [], {}
+    next_index = iter(range(n_requests))
+
+    async def worker():
+        for i in next_index:
+            method, path, body = _request(endpoint, i, run_id, chat_ids)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "rps": round(n_requests / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+        "error_rate": round(errors / n_requests, 4),
+        "statuses": statuses,
+    }
+
+
+async def drive(client: httpx.AsyncClient, args) -> list[dict]:
+    chat_ids = [f"load-chat-{i}" for i in range(20)]
+    for chat_id in chat_ids:
+        await client.post("/chats", json={"chat_id": chat_id, "title": chat_id})
+    results = []
+    for concurrency in args.concurrency:
+        for endpoint in args.endpoints:
+            result = await run_level(client, endpoint, concurrency, args.requests, chat_ids)
+            print(f"{endpoint:>9} c={concurrency:<4} rps={result['rps']:8.1f}  p50={result['p50_ms']:8.1f}ms  "
+                  f"p95={result['p95_ms']:8.1f}ms  p99={result['p99_ms']:8.1f}ms  errors={result['error_rate']:.2%}")
+            results.append(result)
+    return results
+
+
+async def drive_in_process(args) -> list[dict]:
+    from agent import chat_agent, chroma_setup
+    from api.main import app
+    from .stubs import FakeChatModel, StubCollection
+
+    chat_agent.llm = FakeChatModel(latency_s=args.llm_latency, tokens_per_s=args.tokens_per_s,
+                                   use_tool=args.use_tool)
+    chroma_setup.use_collection(StubCollection(latency_s=args.retrieval_latency))
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            return await drive(client, args)
+
+
+def compare(results: list[dict], baseline_path: str, max_regression: float) -> bool:
+    """Print p95/RPS changes against a baseline file; False if any p95 regressed too far."""
+    baseline = {(r["endpoint"], r["concurrency"]): r for r in json.load(open(baseline_path))["results"]}
+    ok = True
+    print(f"\nvs {baseline_path}:")
+    for result in results:
+        before = baseline.get((result["endpoint"], result["concurrency"]))
+        if before is None or not before["p95_ms"]:
+            continue
+        p95_change = result["p95_ms"] / before["p95_ms"] - 1
+        rps_change = result["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        flag = "REGRESSION" if p95_change > max_regression else ""
+        ok = ok and not flag
+        print(f"{result['endpoint']:>9} c={result['concurrency']:<4} p95 {p95_change:+7.1%}  rps {rps_change:+7.1%}  {flag}")
+    return ok
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint per level")
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=ENDPOINTS)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-s", type=float, default=0.0)
+    parser.add_argument("--use-tool", action="store_true", help="fake model calls search_policies first")
+    parser.add_argument("--retrieval-latency", type=float, default=0.05)
+    parser.add_argument("--url", help="drive a running server instead of the in-process stubbed app")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative p95 increase")
+    args = parser.parse_args()
+
+    if args.url:
+        async def remote():
+            async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+                return await drive(client, args)
+        results = asyncio.run(remote())
+    else:
+        from .fixtures import local_postgres, schema_conninfo
+
+        _offline_env(schema_conninfo("bench_load"))
+        with local_postgres("bench_load"):
+            results = asyncio.run(drive_in_process(args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "target": args.url or "in-process",
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline and not compare(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
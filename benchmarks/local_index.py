@@ -0,0 +1,78 @@
+"""
+Local vector index: query latency (p50/p99) and recall@k, exact vs IVF.
+
+Uses the index built by ingest_policies when --index-dir has one, otherwise a
+synthetic clustered corpus of --rows normalised vectors.
+
+    python -m benchmarks.local_index --rows 50000 --queries 500 --k 5
+"""
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from agent.local_index import IVFIndex, top_k
+
+
+def synthetic_corpus(rows: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, rows // 100), dim))
+    vectors = centers[rng.integers(0, len(centers), rows)] + 0.5 * rng.normal(size=(rows, dim))
+    vectors = vectors.astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile_ms(samples: list[float], q: float) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", type=Path, default=None)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    if args.index_dir and (args.index_dir / "embeddings.npy").exists():
+        embeddings = np.load(args.index_dir / "embeddings.npy", mmap_mode="r")
+    else:
+        embeddings = synthetic_corpus(args.rows, args.dim)
+
+    rng = np.random.default_rng(1)
+    queries = embeddings[rng.integers(0, len(embeddings), args.queries)] + 0.1 * rng.normal(
+        size=(args.queries, embeddings.shape[1])
+    ).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"{len(embeddings)} vectors x {embeddings.shape[1]} dims, {args.queries} queries, k={args.k}\n")
+
+    exact_latency, truth = [], []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(top_k(embeddings @ query, args.k).tolist()))
+        exact_latency.append(time.perf_counter() - start)
+    print(f"{'exact':12} p50 {percentile_ms(exact_latency, 50):7.3f} ms   "
+          f"p99 {percentile_ms(exact_latency, 99):7.3f} ms   recall@{args.k} 1.000")
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(embeddings)
+    print(f"{'ivf build':12} {time.perf_counter() - start:.2f} s, {len(ivf.centroids)} lists")
+
+    for nprobe in args.nprobe:
+        latency, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            rows = ivf.candidates(query, nprobe)
+            found = rows[top_k(embeddings[rows] @ query, args.k)]
+            latency.append(time.perf_counter() - start)
+            hits += len(expected & set(found.tolist()))
+        print(f"{'ivf/' + str(nprobe):12} p50 {percentile_ms(latency, 50):7.3f} ms   "
+              f"p99 {percentile_ms(latency, 99):7.3f} ms   recall@{args.k} {hits / (len(truth) * args.k):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Retrieval quality and latency per mode: vector, lexical (BM25), hybrid (RRF)
+and hybrid with the local reranker.
+
+Each line of the question file has a "question" and a list of "relevant"
+labels, matched case-insensitively against a result's policy_name or source.
+recall@k is the share of labels matched in the top k, averaged over questions.
+fast_path_rate is the share of questions whose top chunk is within
+--max-distance (FAST_PATH_MAX_DISTANCE) by vector distance, and
+fast_path_precision the share of those whose top chunk matches a label: check
+it before turning FAST_PATH_ENABLED on.
+Run after `python -m agent.ingest_policies`; RETRIEVAL_BACKEND=local keeps the
+vector side offline. The query cache is off so every query is timed cold.
+
+    RETRIEVAL_BACKEND=local python -m benchmarks.retrieval_eval --k 5
+"""
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("QUERY_CACHE_ENABLED", "false")
+# Queries run one at a time; a batch window would only add its wait to each
+os.environ.setdefault("RETRIEVAL_BATCH_WINDOW_MS", "0")
+
+from agent.retrieval import _query_collection, top_vector_distance  # noqa: E402
+from agent.routing import FAST_PATH_MAX_DISTANCE  # noqa: E402
+from agent.bm25 import bm25_index  # noqa: E402
+
+QUESTIONS_PATH = Path(__file__).parent / "data" / "retrieval_questions.jsonl"
+MODES = {
+    "vector": {"mode": "vector"},
+    "lexical": {"mode": "lexical"},
+    "hybrid": {"mode": "hybrid", "rerank_results": False},
+    "hybrid+rerank": {"mode": "hybrid", "rerank_results": True},
+}
+
+
+def load_questions(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def recall(metadatas: list[dict], labels: list[str]) -> float:
+    found = " | ".join(f"{m.get('policy_name', '')} {m.get('source', '')}".lower() for m in metadatas)
+    return sum(label.lower() in found for label in labels) / len(labels)
+
+
+def evaluate(questions: list[dict], k: int, options: dict, max_distance: float) -> dict:
+    recalls, latencies, fast_hits = [], [], []
+    for q in questions:
+        start = time.perf_counter()
+        results = _query_collection(q["question"], k, **options)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(recall(results["metadatas"], q["relevant"]))
+        distance = top_vector_distance(q["question"], results)
+        if distance is not None and distance <= max_distance:
+            fast_hits.append(recall(results["metadatas"][:1], q["relevant"]) > 0)
+    return {
+        f"recall@{k}": round(float(np.mean(recalls)), 3),
+        "fast_path_rate": round(len(fast_hits) / len(questions), 3),
+        "fast_path_precision": round(float(np.mean(fast_hits)), 3) if fast_hits else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=Path, default=QUESTIONS_PATH)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-distance", type=float, default=FAST_PATH_MAX_DISTANCE)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    with bm25_index() as index:
+        built = index is not None
+    if not built:
+        print("No BM25 index found; run `python -m agent.ingest_policies` first")
+        return
+    questions = load_questions(args.questions)
+    # Warm the embedding model and vector store so the first mode isn't penalised
+    _query_collection(questions[0]["question"], args.k, mode="vector")
+    for name in args.modes:
+        print(f"{name:>14}: {evaluate(questions, args.k, MODES[name], args.max_distance)}")
+
+
+if __name__ == "__main__":
+    main()
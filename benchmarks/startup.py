@@ -0,0 +1,65 @@
+"""
+Startup cost of the API: module import time, lifespan startup and the latency
+of the first requests afterwards.
+
+Import time runs in fresh interpreters and needs no services. The lifespan and
+first-request numbers use the real agent/.env (database and vector store).
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --import-only
+"""
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+_IMPORT_SNIPPET = "import time; t = time.perf_counter(); import api.main; print(time.perf_counter() - t)"
+
+
+def measure_import(runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET], capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+async def measure_first_requests() -> dict:
+    from api.main import app
+
+    start = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        lifespan_ms = (time.perf_counter() - start) * 1000
+        transport = httpx.ASGITransport(app=app)
+        timings = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for label, path in (("health", "/health"), ("chats_first", "/chats?limit=1&messages=false"),
+                                ("chats_second", "/chats?limit=1&messages=false")):
+                t = time.perf_counter()
+                response = await client.get(path)
+                timings[f"{label}_ms"] = round((time.perf_counter() - t) * 1000, 1)
+                timings[f"{label}_status"] = response.status_code
+    return {"lifespan_startup_ms": round(lifespan_ms, 1), **timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-only", action="store_true")
+    args = parser.parse_args()
+
+    print(f"import api.main: {measure_import(args.runs)}")
+    if not args.import_only:
+        print(f"startup: {asyncio.run(measure_first_requests())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Offline stand-ins for the paid services used by the agent."""
+import re
+import json
+import time
+import asyncio
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model that answers after a fixed latency.
+
+    With tokens_per_s set, the reply is streamed word by word at that rate
+    (and the blocking call takes as long). With use_tool, the first call of a
+    turn requests search_policies so the tool path is exercised too.
+    """
+
+    latency_s: float = 0.5
+    tokens_per_s: float = 0.0
+    use_tool: bool = False
+    reply: str = "According to the policy, yes."
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-latency"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _message(self, messages) -> AIMessage:
+        if self.use_tool and isinstance(messages[-1], HumanMessage):
+            query = str(messages[-1].content)[-200:]
+            return AIMessage(content="", tool_calls=[
+                {"name": "search_policies", "args": {"queries": [query]}, "id": f"call_{len(messages)}"}
+            ])
+        return AIMessage(content=self.reply)
+
+    def _tokens(self) -> list[str]:
+        return re.findall(r"\S+\s*", self.reply)
+
+    def _generation_s(self) -> float:
+        return len(self._tokens()) / self.tokens_per_s if self.tokens_per_s else 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_s + self._generation_s())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_s + self._generation_s())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_s)
+        message = self._message(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": 0}
+                for tc in message.tool_calls
+            ]))
+            return
+        for token in self._tokens():
+            if self.tokens_per_s:
+                time.sleep(1 / self.tokens_per_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency_s)
+        message = self._message(messages)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": 0}
+                for tc in message.tool_calls
+            ]))
+            return
+        for token in self._tokens():
+            if self.tokens_per_s:
+                await asyncio.sleep(1 / self.tokens_per_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class StubCollection:
+    """
+    In-memory stand-in for the Chroma collection: ranks documents by word
+    overlap with the query after a fixed latency. Deterministic, no embeddings.
+    """
+
+    def __init__(self, documents: list[str] | None = None, latency_s: float = 0.05,
+                 name: str = "richmond_policies"):
+        self.name = name
+        self.latency_s = latency_s
+        self._metadata = {}
+        documents = documents or [
+            f"Policy {i}: students must follow the procedure for request type {i % 17}. "
+            f"Forms are due {i % 5 + 1} weeks before the term ends."
+            for i in range(200)
+        ]
+        self._ids = [f"doc-{i}" for i in range(len(documents))]
+        self._documents = list(documents)
+        self._metadatas = [{"source": f"ch{i}-stub_policy.txt", "policy_name": f"stub policy {i}",
+                            "chunk": f"ch{i}", "sub_chunk": 0} for i in range(len(documents))]
+        self._terms = [set(_WORD_RE.findall(doc.lower())) for doc in documents]
+
+    @property
+    def metadata(self) -> dict:
+        return self._metadata
+
+    def modify(self, metadata: dict | None = None, **kwargs) -> None:
+        if metadata is not None:
+            self._metadata = metadata
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def get(self, ids=None, include=("metadatas", "documents"), **kwargs) -> dict:
+        rows = [i for i, doc_id in enumerate(self._ids) if ids is None or doc_id in ids]
+        return {
+            "ids": [self._ids[i] for i in rows],
+            "documents": [self._documents[i] for i in rows] if "documents" in include else None,
+            "metadatas": [self._metadatas[i] for i in rows] if "metadatas" in include else None,
+        }
+
+    def query(self, query_texts=None, n_results: int = 10, include=("metadatas", "documents", "distances"),
+              **kwargs) -> dict:
+        time.sleep(self.latency_s)
+        if isinstance(query_texts, str):
+            query_texts = [query_texts]
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for text in query_texts:
+            terms = set(_WORD_RE.findall(text.lower()))
+            scores = [len(terms & doc_terms) / (len(terms | doc_terms) or 1) for doc_terms in self._terms]
+            rows = sorted(range(len(scores)), key=lambda i: (-scores[i], i))[:n_results]
+            result["ids"].append([self._ids[i] for i in rows])
+            result["documents"].append([self._documents[i] for i in rows])
+            result["metadatas"].append([self._metadatas[i] for i in rows])
+            result["distances"].append([1 - scores[i] for i in rows])
+        return result
@@ -0,0 +1,78 @@
+import time
+import threading
+
+import pytest
+
+from agent.batching import QueryBatcher
+
+
+class Runner:
+    """Records every call; answers each text with a row naming it."""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, queries, n_results, where):
+        self.calls.append(list(queries))
+        if self.error is not None:
+            raise self.error
+        return [{"query": q, "n_results": n_results} for q in queries]
+
+
+def query_concurrently(batcher, requests, n_results=5, where=None):
+    results = [None] * len(requests)
+
+    def call(i, queries):
+        results[i] = batcher.query(queries, n_results, where)
+
+    threads = [threading.Thread(target=call, args=(i, q)) for i, q in enumerate(requests)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+
+def test_fans_results_back_out_per_caller():
+    runner = Runner()
+    batcher = QueryBatcher(runner, window_s=0.2, max_batch=100)
+    results = query_concurrently(batcher, [["a", "b"], ["c"], ["d", "e"]])
+    assert len(runner.calls) == 1
+    assert [[row["query"] for row in rows] for rows in results] == [["a", "b"], ["c"], ["d", "e"]]
+
+
+def test_duplicate_texts_are_sent_once():
+    runner = Runner()
+    batcher = QueryBatcher(runner, window_s=0.2, max_batch=100)
+    results = query_concurrently(batcher, [["a", "b"], ["b"], ["a"]])
+    assert sorted(runner.calls[0]) == ["a", "b"]
+    assert [[row["query"] for row in rows] for rows in results] == [["a", "b"], ["b"], ["a"]]
+
+
+def test_batch_closes_at_max_batch_without_waiting_out_the_window():
+    runner = Runner()
+    batcher = QueryBatcher(runner, window_s=5, max_batch=2)
+    started = time.monotonic()
+    rows = batcher.query(["a", "b"], 5)
+    assert time.monotonic() - started < 1
+    assert [row["query"] for row in rows] == ["a", "b"]
+    # The next caller opens a fresh batch
+    batcher.window_s = 0.01
+    batcher.query(["c"], 5)
+    assert runner.calls == [["a", "b"], ["c"]]
+
+
+def test_different_n_results_or_filters_do_not_share_a_batch():
+    runner = Runner()
+    batcher = QueryBatcher(runner, window_s=0.05, max_batch=100)
+    query_concurrently(batcher, [["a"]], n_results=5)
+    query_concurrently(batcher, [["a"]], n_results=5, where={"policy": "x"})
+    query_concurrently(batcher, [["a"]], n_results=10)
+    assert len(runner.calls) == 3
+
+
+def test_error_reaches_every_caller():
+    batcher = QueryBatcher(Runner(error=RuntimeError("down")), window_s=0.01, max_batch=100)
+    with pytest.raises(RuntimeError, match="down"):
+        batcher.query(["a"], 5)
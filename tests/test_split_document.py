@@ -0,0 +1,47 @@
+from agent.ingest_policies import split_document
+
+
+def byte_len(text):
+    return len(text.encode("utf-8"))
+
+
+def sentences(n, word="policy"):
+    return " ".join(f"Sentence {i} about the {word}." for i in range(n))
+
+
+def test_short_text_is_one_window():
+    assert list(split_document("One. Two.", max_bytes=100, overlap_bytes=10)) == ["One. Two."]
+
+
+def test_windows_respect_the_byte_bound():
+    windows = list(split_document(sentences(200), max_bytes=300, overlap_bytes=80))
+    assert len(windows) > 1
+    assert all(byte_len(w) <= 300 for w in windows)
+
+
+def test_windows_overlap_by_whole_sentences():
+    windows = list(split_document(sentences(50), max_bytes=200, overlap_bytes=80))
+    for prev, cur in zip(windows, windows[1:]):
+        first = cur.split(". ")[0].rstrip(".") + "."
+        assert first in prev
+
+
+def test_multibyte_text_is_not_cut_mid_character():
+    text = sentences(100, word="café ü 学生")
+    windows = list(split_document(text, max_bytes=256, overlap_bytes=64))
+    assert all(byte_len(w) <= 256 for w in windows)
+    assert all("�" not in w for w in windows)
+
+
+def test_over_long_sentence_is_hard_split():
+    text = "x" * 1000 + " " + "学" * 400
+    windows = list(split_document(text, max_bytes=100, overlap_bytes=0))
+    assert all(byte_len(w) <= 100 for w in windows)
+    assert "".join(windows).replace(" ", "") == text.replace(" ", "")
+
+
+def test_overlap_larger_than_max_still_bounded_and_progresses():
+    text = sentences(40)
+    windows = list(split_document(text, max_bytes=120, overlap_bytes=500))
+    assert all(byte_len(w) <= 120 for w in windows)
+    assert windows[-1].endswith("Sentence 39 about the policy.")
@@ -0,0 +1,182 @@
+import json
+import asyncio
+
+import pytest
+
+from api.write_behind import WriteBehindQueue
+
+
+class Writer:
+    """Records every batch; raises for items whose id is in bad."""
+
+    def __init__(self, bad=(), error=ValueError):
+        self.batches = []
+        self.bad = set(bad)
+        self.error = error
+
+    async def __call__(self, items):
+        self.batches.append([item["id"] for item in items])
+        if any(item["id"] in self.bad for item in items):
+            raise self.error("bad row")
+
+    @property
+    def written(self):
+        return [i for batch in self.batches if not self.bad.intersection(batch) for i in batch]
+
+
+def make_queue(tmp_path, writers, **kwargs):
+    kwargs.setdefault("max_delay_s", 0.01)
+    kwargs.setdefault("retry_delay_s", 0.001)
+    return WriteBehindQueue(writers, dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs)
+
+
+def dead_letters(tmp_path):
+    path = tmp_path / "dead.jsonl"
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_coalesces_by_key_and_resolves_every_waiter(tmp_path):
+    async def run():
+        writer = Writer()
+        queue = make_queue(tmp_path, {"messages": writer})
+        first = queue.put("messages", "a", {"id": "a", "v": 1})
+        second = queue.put("messages", "a", {"id": "a", "v": 2})
+        await queue.flush()
+        await asyncio.gather(first, second)
+        return writer, queue
+
+    writer, queue = asyncio.run(run())
+    assert writer.batches == [["a"]]
+    assert queue.stats["coalesced"] == 1
+    assert queue.stats["flushed_items"] == 1
+
+
+def test_bad_item_is_isolated_from_its_batch(tmp_path):
+    async def run():
+        writer = Writer(bad={"c"})
+        queue = make_queue(tmp_path, {"messages": writer}, max_retries=0)
+        waiters = {key: queue.put("messages", key, {"id": key}) for key in "abcde"}
+        await queue.flush()
+        return writer, queue, waiters
+
+    writer, queue, waiters = asyncio.run(run())
+    assert sorted(writer.written) == ["a", "b", "d", "e"]
+    assert all(waiters[key].result() is None for key in "abde")
+    assert isinstance(waiters["c"].exception(), ValueError)
+    assert queue.stats["failed_items"] == 1
+    assert [entry["item"]["id"] for entry in dead_letters(tmp_path)] == ["c"]
+
+
+def test_failed_kind_does_not_fail_other_kinds(tmp_path):
+    async def run():
+        queue = make_queue(tmp_path, {"messages": Writer(bad={"m"}), "feedback": Writer()}, max_retries=0)
+        message = queue.put("messages", "m", {"id": "m"})
+        feedback = queue.put("feedback", "f", {"id": "f"})
+        await queue.flush()
+        return message, feedback
+
+    message, feedback = asyncio.run(run())
+    assert feedback.result() is None
+    assert isinstance(message.exception(), ValueError)
+
+
+def test_retries_until_the_write_succeeds(tmp_path):
+    async def run():
+        writer = Writer(bad={"a"})
+        queue = make_queue(tmp_path, {"messages": writer}, max_retries=3)
+        waiter = queue.put("messages", "a", {"id": "a"})
+        await queue.flush()
+        assert not waiter.done()
+        writer.bad.clear()
+        await queue.flush()
+        await waiter
+        return writer, queue
+
+    writer, queue = asyncio.run(run())
+    assert writer.batches == [["a"], ["a"]]
+    assert queue.stats["retried_items"] == 1
+    assert dead_letters(tmp_path) == []
+
+
+def test_dead_letters_after_max_retries(tmp_path):
+    async def run():
+        writer = Writer(bad={"a"})
+        queue = make_queue(tmp_path, {"messages": writer}, max_retries=2)
+        await queue.start()
+        waiter = queue.put("messages", "a", {"id": "a"})
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(waiter, 1)
+        await queue.stop()
+        return writer, queue
+
+    writer, queue = asyncio.run(run())
+    assert len(writer.batches) == 3
+    assert queue.stats["dead_lettered"] == 1
+    assert dead_letters(tmp_path) == [{"kind": "messages", "error": "bad row", "item": {"id": "a"}}]
+
+
+def test_newer_write_supersedes_a_failed_one(tmp_path):
+    async def run():
+        writer = Writer(bad={"a"})
+        queue = make_queue(tmp_path, {"messages": writer}, max_retries=1)
+
+        async def fail_then_requeue(items):
+            # A newer write for the key arrives while the flush is in flight
+            queue.put("messages", "a", {"id": "a", "v": 2})
+            writer.bad.clear()
+            raise ValueError("bad row")
+
+        queue.writers["messages"] = fail_then_requeue
+        stale = queue.put("messages", "a", {"id": "a", "v": 1})
+        await queue.flush()
+        queue.writers["messages"] = writer
+        await queue.flush()
+        await stale
+        return writer, queue
+
+    writer, queue = asyncio.run(run())
+    assert writer.batches == [["a"]]
+    assert queue.stats["retried_items"] == 0
+
+
+def test_connection_errors_retry_the_whole_batch_without_splitting(tmp_path):
+    async def run():
+        writer = Writer(bad={"a", "b", "c"}, error=ConnectionError)
+        queue = make_queue(tmp_path, {"messages": writer}, batch_errors=(ConnectionError,))
+        for key in "abc":
+            queue.put("messages", key, {"id": key})
+        await queue.flush()
+        return writer, queue
+
+    writer, queue = asyncio.run(run())
+    assert writer.batches == [["a", "b", "c"]]
+    assert queue.stats["retried_items"] == 3
+
+
+def test_stop_drains_pending_writes_and_refuses_new_ones(tmp_path):
+    async def run():
+        writer = Writer()
+        queue = make_queue(tmp_path, {"messages": writer}, max_delay_s=60)
+        await queue.start()
+        waiters = [queue.put("messages", key, {"id": key}) for key in "ab"]
+        await queue.stop()
+        with pytest.raises(RuntimeError):
+            queue.put("messages", "c", {"id": "c"})
+        return writer, waiters
+
+    writer, waiters = asyncio.run(run())
+    assert sorted(writer.written) == ["a", "b"]
+    assert all(waiter.done() for waiter in waiters)
+
+
+def test_stop_dead_letters_items_that_keep_failing(tmp_path):
+    async def run():
+        queue = make_queue(tmp_path, {"messages": Writer(bad={"a"})}, max_delay_s=60, max_retries=2)
+        await queue.start()
+        waiter = queue.put("messages", "a", {"id": "a"})
+        await queue.stop()
+        return waiter
+
+    waiter = asyncio.run(run())
+    assert isinstance(waiter.exception(), ValueError)
+    assert len(dead_letters(tmp_path)) == 1